@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Bộ đếm cho đường thu CSI của com_readv5.py.
+
+ - CaptureStats: gom bộ đếm của các FrameReader (byte bị bỏ, số lần đồng bộ lại, lỗi checksum...),
+   bộ đếm hàng đợi/ghi đĩa, MAC ngoài whitelist và histogram độ trễ đọc -> ghi theo từng MAC.
+ - render_prometheus(): xuất dạng Prometheus text, phục vụ qua HTTP cục bộ (start_metrics_server).
+ - summary_line(): một dòng log gọn thay cho việc print từng sự kiện.
+"""
+import bisect
+import queue
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from process.csi_record import mac_to_str
+
+# Ngưỡng bucket (ms) cho histogram độ trễ đọc -> ghi
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 150, 200, 300, 500, 1000, 2000, 5000)
+
+# Bộ đếm lấy từ từng FrameReader: (thuộc tính, tên metric, mô tả)
+READER_COUNTERS = (
+    ('bytes_read', 'csi_uart_bytes_read_total', 'Số byte đã đọc từ UART'),
+    ('bytes_discarded', 'csi_uart_bytes_discarded_total', 'Số byte bị bỏ khi đồng bộ lại'),
+    ('resyncs', 'csi_resyncs_total', 'Số lần đồng bộ lại trên FRAME_START_BYTE'),
+    ('checksum_errors', 'csi_checksum_errors_total', 'Số frame sai checksum XOR'),
+    ('length_errors', 'csi_invalid_length_total', 'Số frame có payload_len không hợp lệ'),
+    ('csi_length_errors', 'csi_invalid_csi_length_total', 'Số frame đúng checksum nhưng length_field vượt payload, bị bỏ'),
+    ('log_lines', 'csi_uart_log_lines_total', 'Số dòng log văn bản từ ESP32'),
+)
+
+
+class LatencyHistogram:
+    """Histogram bucket cố định, thêm một mẫu là O(log số bucket)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # ô cuối là +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Ước lượng phân vị theo cận trên của bucket chứa nó."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+
+class CaptureStats:
+    """Bộ đếm dùng chung giữa các thread đọc, thread ghi, vòng báo cáo và HTTP endpoint."""
+
+    def __init__(self, q: queue.Queue):
+        self.queue = q
+        self.readers = []          # (port, FrameReader)
+        self.lock = threading.Lock()
+        self.frames_read = 0
+        self.frames_written = 0
+        self.frames_dropped = 0    # bỏ vì hàng đợi đầy (đĩa không theo kịp)
+        self.max_queue_depth = 0
+        self.csi_capacity = None   # số giá trị CSI tối đa sink lưu được (.bin), None nếu không giới hạn
+        self.csi_truncated = 0     # số frame có CSI dài hơn csi_capacity (bị cắt khi ghi)
+        self.packet_count = defaultdict(int)     # reset mỗi lần báo cáo FPS
+        self.frames_by_mac = defaultdict(int)    # cộng dồn
+        self.non_whitelisted = defaultdict(int)
+        self.latency = defaultdict(LatencyHistogram)
+        self.timing = None         # TimingTracker (timing_tracker.py) nếu có
+        self.deduper = None        # TimestampDeduper (process/ts_dedup.py) nếu có
+        self.occupancy = None      # OccupancyDetector (occupancy_stream.py) nếu có
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def take_packet_count(self):
+        with self.lock:
+            counts, self.packet_count = self.packet_count, defaultdict(int)
+        return counts
+
+    def count_read(self, batch, rejected):
+        with self.lock:
+            self.frames_read += len(batch)
+            for frame in batch:
+                self.packet_count[frame[0]] += 1
+                self.frames_by_mac[frame[0]] += 1
+            for mac_bytes in rejected:
+                self.non_whitelisted[mac_bytes] += 1
+
+    def count_written(self, frames, now_ms: float):
+        # Chỉ thread ghi gọi hàm này nên không cần khoá cho histogram
+        latency = self.latency
+        for frame in frames:
+            latency[frame[0]].observe(now_ms - frame[2])
+        if self.csi_capacity is not None:
+            capacity = self.csi_capacity
+            self.csi_truncated += sum(len(frame[4]) > capacity for frame in frames)
+        self.frames_written += len(frames)
+
+    def reader_total(self, attr: str) -> int:
+        return sum(getattr(reader, attr) for _, reader in self.readers)
+
+
+def render_prometheus(stats: CaptureStats) -> str:
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f'{name}{{{label_str}}} {value}' if label_str else f'{name} {value}')
+
+    for attr, name, help_text in READER_COUNTERS:
+        metric(name, 'counter', help_text,
+               [({'port': port}, getattr(reader, attr)) for port, reader in stats.readers])
+
+    with stats.lock:
+        by_mac = list(stats.frames_by_mac.items())
+        rejected = list(stats.non_whitelisted.items())
+    metric('csi_frames_read_total', 'counter', 'Số frame hợp lệ trong whitelist đã đọc',
+           [({'mac': mac_to_str(m)}, n) for m, n in by_mac])
+    metric('csi_non_whitelisted_total', 'counter', 'Số frame từ MAC ngoài whitelist',
+           [({'mac': mac_to_str(m)}, n) for m, n in rejected])
+    metric('csi_frames_written_total', 'counter', 'Số frame đã ghi ra đĩa', [({}, stats.frames_written)])
+    metric('csi_queue_drops_total', 'counter', 'Số frame bị bỏ vì hàng đợi đầy', [({}, stats.frames_dropped)])
+    if stats.csi_capacity is not None:
+        metric('csi_truncated_total', 'counter', f'Số frame có CSI dài hơn {stats.csi_capacity} giá trị, bị cắt khi ghi',
+               [({}, stats.csi_truncated)])
+    if stats.deduper is not None:
+        metric('csi_timestamp_shifts_total', 'counter', 'Số frame bị lùi timestamp_real_ms do trùng',
+               [({}, stats.deduper.shifted)])
+    metric('csi_queue_depth', 'gauge', 'Số lô đang chờ ghi', [({}, stats.queue_depth)])
+    metric('csi_queue_depth_max', 'gauge', 'Số lô chờ ghi lớn nhất từng gặp', [({}, stats.max_queue_depth)])
+
+    name = 'csi_write_latency_ms'
+    lines.append(f'# HELP {name} Độ trễ từ lúc đọc frame tới lúc ghi ra đĩa (ms)')
+    lines.append(f'# TYPE {name} histogram')
+    for mac_bytes, hist in list(stats.latency.items()):
+        mac = mac_to_str(mac_bytes)
+        acc = 0
+        for le, c in zip(hist.buckets + ('+Inf',), hist.counts):
+            acc += c
+            lines.append(f'{name}_bucket{{mac="{mac}",le="{le}"}} {acc}')
+        lines.append(f'{name}_sum{{mac="{mac}"}} {hist.sum:.3f}')
+        lines.append(f'{name}_count{{mac="{mac}"}} {hist.count}')
+
+    if stats.occupancy is not None:
+        occ = stats.occupancy.snapshot()
+        metric('csi_occupancy_state', 'gauge', '1 nếu đang phát hiện có người theo STI',
+               [({'mac': mac_to_str(m), 'port': p}, int(st.occupied)) for m, p, st in occ])
+        metric('csi_occupancy_sti', 'gauge', 'STI của gói gần nhất',
+               [({'mac': mac_to_str(m), 'port': p}, st.sti) for m, p, st in occ])
+        metric('csi_occupancy_changes_total', 'counter', 'Số lần đổi trạng thái có người / không',
+               [({'mac': mac_to_str(m), 'port': p}, st.changes) for m, p, st in occ])
+        name = 'csi_occupancy_latency_ms'
+        lines.append(f'# HELP {name} Độ trễ từ lúc đọc frame tới lúc ra quyết định có người (ms)')
+        lines.append(f'# TYPE {name} histogram')
+        for mac_bytes, port, st in occ:
+            labels = f'mac="{mac_to_str(mac_bytes)}",port="{port}"'
+            hist = st.latency
+            acc = 0
+            for le, c in zip(hist.buckets + ('+Inf',), hist.counts):
+                acc += c
+                lines.append(f'{name}_bucket{{{labels},le="{le}"}} {acc}')
+            lines.append(f'{name}_sum{{{labels}}} {hist.sum:.3f}')
+            lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+    if stats.timing is not None:
+        links = stats.timing.snapshot()
+        metric('csi_gap_events_total', 'counter', 'Số gap timestamp_real_ms vượt ngưỡng',
+               [({'mac': mac_to_str(m), 'port': p}, link.gaps) for m, p, link in links])
+        metric('csi_tx_stalls_total', 'counter', 'Số lần TX im lặng quá STALL_MS',
+               [({'mac': mac_to_str(m), 'port': p}, link.stalls) for m, p, link in links])
+        metric('csi_tx_stalled', 'gauge', '1 nếu TX đang im lặng quá STALL_MS',
+               [({'mac': mac_to_str(m), 'port': p}, int(link.stalled)) for m, p, link in links])
+        for stat, help_text in (('mean', 'Khoảng cách trung bình giữa các gói (EWMA, ms)'),
+                                ('jitter', 'Jitter khoảng cách giữa các gói (EWMA, ms)'),
+                                ('p99', 'p99 khoảng cách giữa các gói trong cửa sổ (ms)'),
+                                ('max', 'Khoảng cách lớn nhất trong cửa sổ (ms)')):
+            samples = []
+            for m, p, link in links:
+                for clock in ('device', 'host'):
+                    c = getattr(link, clock)
+                    value = {'mean': c.mean, 'jitter': c.jitter, 'p99': c.p99(), 'max': c.max_gap()}[stat]
+                    samples.append(({'mac': mac_to_str(m), 'port': p, 'clock': clock}, value))
+            metric(f'csi_interarrival_{stat}_ms', 'gauge', help_text, samples)
+    return '\n'.join(lines) + '\n'
+
+
+def summary_line(stats: CaptureStats) -> str:
+    p99 = max((h.quantile(0.99) for h in list(stats.latency.values())), default=0.0)
+    if stats.occupancy is not None:
+        occ = stats.occupancy.snapshot()
+        occupied = sum(st.occupied for _, _, st in occ)
+        occ_p99 = max((st.latency.quantile(0.99) for _, _, st in occ), default=0.0)
+    if stats.timing is not None:
+        links = stats.timing.snapshot()
+        gaps = sum(link.gaps for _, _, link in links)
+        stalled = sum(link.stalled for _, _, link in links)
+    return (f"q={stats.queue_depth}/{stats.max_queue_depth} "
+            f"ghi={stats.frames_written}/{stats.frames_read} drop={stats.frames_dropped} "
+            f"crc={stats.reader_total('checksum_errors')} len={stats.reader_total('length_errors')} len_csi={stats.reader_total('csi_length_errors')} "
+            f"resync={stats.reader_total('resyncs')} bỏ={stats.reader_total('bytes_discarded')}B "
+            f"ngoài_wl={sum(stats.non_whitelisted.values())} "
+            + (f"cắt={stats.csi_truncated} " if stats.csi_capacity is not None else '')
+            + (f"gap={gaps} đứng={stalled} " if stats.timing is not None else '') +
+            f"trùng_ts={stats.deduper.shifted if stats.deduper is not None else '-'} trễ_p99≤{p99:g}ms"
+            + (f" người={occupied} trễ_người_p99≤{occ_p99:g}ms" if stats.occupancy is not None else ''))
+
+
+def start_metrics_server(stats: CaptureStats, port: int, host: str = '127.0.0.1'):
+    """Phục vụ GET /metrics trên thread nền; trả về server để shutdown()."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = render_prometheus(stats).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # không in mỗi request ra console
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -2,10 +2,24 @@ import serial
 import serial.tools.list_ports
 import struct
 import csv
+import os
 import time
+import bisect
+import queue
+import threading
+import traceback
+import numpy as np
 from collections import defaultdict
 from datetime import datetime
 
+from process.csi_record import RecordWriter, mac_to_str, csi_to_text
+from process.capture_manifest import Manifest
+from process.clock_model import ClockModel
+from process.ts_dedup import TimestampDeduper
+from capture_metrics import CaptureStats, start_metrics_server, summary_line
+from occupancy_stream import OccupancyDetector, OccupancyPublisher
+from timing_tracker import GAP_CSV_HEADER, TimingTracker, WINDOW_MS
+
 # WHITELIST MACs
 WHITELIST_MACS = {
     # b'\x3C\x8A\x1F\xA8\x0C\x1C',
@@ -25,25 +39,54 @@ WHITELIST_MACS = {
 CSV_HEADER = ["mac", "timestamp_real_ms", "timestamp_pc_ms", "timestamp_pc_hms", "CSI"]
 FPS_CSV_HEADER = ["timestamp_pc_hms", "mac", "fps"]
 
+# 'bin': file .bin (process/csi_record.py), 'csv': CSV cũ với CSI dạng chuỗi
+OUTPUT_FORMAT = 'bin'
+# Số giá trị CSI mỗi bản ghi .bin; CSI dài hơn bị cắt và được đếm (csi_truncated_total, cắt= trong log)
+BIN_N_VALUES = 128
+# 'merged': một file cho mọi MAC; 'by_mac': mỗi MAC một stream trong csi_data_<ts>_by_mac/
+# (AA_BB_.._partNNN.*, stream tên MAC trong manifest); 'both': ghi cả hai.
+# Đọc lại cả phiên thu qua manifest: process/capture_cache.load_capture / csi_tensor.load_csi
+OUTPUT_LAYOUT = 'merged'
+# Mỗi file đầu ra được chia thành csi_data_<ts>_partNNN.*, sang phần mới khi vượt một trong hai ngưỡng
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+SEGMENT_MAX_S = 10 * 60
+MANIFEST_SYNC_MS = 10_000  # cập nhật segment đang ghi trong manifest (số frame, khoảng timestamp) mỗi bấy nhiêu ms
+
 FRAME_START_BYTE = 0xA5
 MAX_PAYLOAD_LEN = 512
+MAX_LOG_LEN = 1024         # dòng log dài hơn mức này bị cắt
+READ_BUFFER_SIZE = 64 * 1024
+_TEXT_BYTES = bytes(range(0x20, 0x7F)) + b'\t\r\n\x1b'  # ký tự có thể có trong log ESP-IDF
+QUEUE_MAX_BATCHES = 4096   # số lô (mỗi lô = một lần poll) tối đa chờ ghi đĩa
+WRITE_BATCH_FRAMES = 512   # writer ghi tối đa bấy nhiêu frame mỗi lần gọi sink.write_frames
+REORDER_MS = 100           # giữ frame lại bấy nhiêu ms để trộn các cổng theo thời gian nhận
+WRITER_STOP_TIMEOUT_S = 30 # chờ writer ghi nốt hàng đợi tối đa bấy nhiêu giây khi dừng
+# Sửa timestamp_real_ms trùng ngay lúc ghi, cùng quy tắc với #1_duplicate_rows.py, theo từng (MAC, cổng):
+# file 'merged' thu từ nhiều cổng vẫn có thể trùng (mac, timestamp_real_ms) giữa các cổng -> vẫn chạy #1
+DEDUP_TIMESTAMPS = True
+METRICS_PORT = 9108        # Prometheus text tại http://127.0.0.1:9108/metrics, 0 để tắt
+OCCUPANCY_DETECT = True    # phát hiện có người trực tuyến (STI như ocupice.py), ghi occupancy_<ts>.jsonl
+OCCUPANCY_UDP_PORT = 9109  # gửi mỗi lần đổi trạng thái (JSON) tới udp://127.0.0.1:9109, 0 để tắt
+OCCUPANCY_OFF_THRESHOLD = None  # None = cùng ngưỡng STI (không hysteresis)
+OCCUPANCY_ENTER_FRAMES = 1      # số gói liên tiếp vượt ngưỡng để báo có người
+OCCUPANCY_EXIT_MS = 0           # STI dưới ngưỡng liên tục bấy nhiêu ms mới báo hết người
 
 def list_serial_ports():
     return serial.tools.list_ports.comports()
 
-def choose_port():
+def choose_ports():
     ports = list_serial_ports()
     if not ports:
         print("⚠️ Không tìm thấy cổng COM nào.")
-        exit(1)
     print("🔌 Danh sách COM khả dụng:")
     for idx, p in enumerate(ports):
         desc = p.description or ""
         hwid = p.hwid or ""
         extra = f"({desc} | {hwid})" if desc or hwid else ""
         print(f"  [{idx}] {p.device} {extra}")
-    i = int(input("Chọn COM theo số: "))
-    return ports[i].device
+    sel = input("Chọn COM theo số hoặc đường dẫn (nhiều cổng cách nhau bởi dấu phẩy): ")
+    # Cho phép nhập thẳng đường dẫn, ví dụ pty từ serial_replay.py
+    return [ports[int(i)].device if i.strip().isdigit() else i.strip() for i in sel.split(',') if i.strip()]
 
 def choose_baud():
     common_bauds = [9600, 57600, 115200, 230400, 460800, 921600]
@@ -56,117 +99,526 @@ def choose_baud():
 def open_serial(port: str, baud: int) -> serial.Serial:
     return serial.Serial(port, baudrate=baud, timeout=0.1)
 
-def read_event(ser: serial.Serial):
-    start = ser.read(1)
-    if not start:
-        return None
-    b0 = start[0]
-    if b0 != FRAME_START_BYTE:
-        rest = ser.readline()
+class FrameReader:
+    """
+    Đọc UART theo khối: lấy toàn bộ ser.in_waiting vào một bộ đệm dùng lại,
+    đồng bộ lại trên FRAME_START_BYTE và tách mọi frame hoàn chỉnh trong một lượt.
+    Dòng log văn bản của ESP32 được đẩy sang on_log, không lẫn với frame.
+    """
+
+    def __init__(self, ser: serial.Serial, on_log=None, capacity: int = READ_BUFFER_SIZE):
+        self.ser = ser
+        self.on_log = on_log or print_uart_log
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._u8 = np.frombuffer(self._buf, dtype=np.uint8)  # view để tính checksum, không copy
+        self._start = 0  # vị trí byte đầu tiên chưa xử lý
+        self._end = 0    # vị trí sau byte cuối cùng đã nhận
+        # Bộ đếm, chỉ thread đọc của cổng này ghi vào (xem capture_metrics.py)
+        self.bytes_read = 0
+        self.bytes_discarded = 0
+        self.resyncs = 0
+        self.checksum_errors = 0
+        self.length_errors = 0
+        self.csi_length_errors = 0   # checksum đúng nhưng length_field vượt quá payload: frame bị bỏ
+        self.log_lines = 0
+        self._resyncing = True  # lúc mở cổng hoặc vừa bỏ một 0xA5 giả: dữ liệu có thể là mảnh frame dở
+
+    def _fill(self) -> int:
+        # Dồn phần dữ liệu còn dở về đầu bộ đệm nếu không đủ chỗ
+        if self._start == self._end:
+            self._start = self._end = 0
+        want = max(self.ser.in_waiting, 1)  # ít nhất 1 byte để chờ theo timeout
+        if self._end + want > len(self._buf) and self._start > 0:
+            pending = self._end - self._start
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        want = min(want, len(self._buf) - self._end)
+        if want <= 0:
+            # Bộ đệm đầy mà không tách được frame nào: bỏ 1 byte để đồng bộ lại
+            self._start += 1
+            self.bytes_discarded += 1
+            return 0
+        got = self.ser.readinto(self._view[self._end:self._end + want])
+        self._end += got
+        self.bytes_read += got
+        return got
+
+    def _emit_log(self, pos: int, stop: int):
+        line = bytes(self._buf[pos:stop])
+        if self._resyncing and line.translate(None, _TEXT_BYTES):
+            # Mảnh nhị phân của frame hỏng, không phải log
+            self.bytes_discarded += len(line)
+            return
+        self._resyncing = False
         try:
-            line = start + rest
             text = line.decode('utf-8', errors='replace').rstrip()
         except:
-            text = repr(start + rest)
-        print(f"[UART LOG] {text}")
-        return None
-
-    length_bytes = ser.read(2)
-    if len(length_bytes) < 2:
-        return None
-    payload_len = struct.unpack('<H', length_bytes)[0]
-    # if payload_len < 24 or payload_len > MAX_PAYLOAD_LEN:
-    if payload_len < 16 or payload_len > MAX_PAYLOAD_LEN:
-        print(f"[❌] Invalid payload length: {payload_len}")
-        ser.read(payload_len + 1)
-        return None
-
-    payload = ser.read(payload_len)
-    if len(payload) < payload_len:
-        return None
-    checksum_b = ser.read(1)
-    if len(checksum_b) < 1:
-        return None
-    recv_crc = checksum_b[0]
-    calc_crc = 0
-    for x in payload:
-        calc_crc ^= x
-    if calc_crc != recv_crc:
-        print(f"[❌] Checksum mismatch: calc=0x{calc_crc:02X} recv=0x{recv_crc:02X}")
-        return None
+            text = repr(line)
+        if text:
+            self.log_lines += 1
+            self.on_log(text)
 
+    def poll(self):
+        """
+        Đọc dữ liệu đang chờ và trả về danh sách (mac_bytes, ts_real_ms, csi).
+        csi là np.ndarray int8 trỏ thẳng vào payload, không tạo object cho từng giá trị.
+        """
+        self._fill()
+        buf = self._buf
+        pos, end = self._start, self._end
+        first = None  # vị trí frame hợp lệ đầu tiên trong lượt này
+        spans = []    # (offset payload, length_field) của các frame hợp lệ
+        while pos < end:
+            if buf[pos] != FRAME_START_BYTE:
+                # Dòng log: kết thúc ở '\n' hoặc ngay trước byte 0xA5 kế tiếp
+                nl = buf.find(b'\n', pos, end)
+                sync = buf.find(FRAME_START_BYTE, pos, end if nl < 0 else nl)
+                if sync >= 0:
+                    self._emit_log(pos, sync)
+                    pos = sync
+                    continue
+                if nl < 0:
+                    if end - pos > MAX_LOG_LEN:
+                        self._emit_log(pos, end)
+                        pos = end
+                    break
+                self._emit_log(pos, nl + 1)
+                pos = nl + 1
+                continue
+
+            if end - pos < 3:
+                break
+            payload_len = buf[pos + 1] | (buf[pos + 2] << 8)
+            # if payload_len < 24 or payload_len > MAX_PAYLOAD_LEN:
+            if payload_len < 16 or payload_len > MAX_PAYLOAD_LEN:
+                self.length_errors += 1
+                self.resyncs += 1
+                self.bytes_discarded += 1
+                self._resyncing = True
+                pos += 1  # 0xA5 giả, đồng bộ lại từ byte kế tiếp
+                continue
+            frame_end = pos + 3 + payload_len + 1
+            if frame_end > end:
+                break  # frame chưa nhận đủ, chờ lượt sau
+
+            recv_crc = buf[frame_end - 1]
+            calc_crc = int(np.bitwise_xor.reduce(self._u8[pos + 3:frame_end - 1]))
+            if calc_crc != recv_crc:
+                self.checksum_errors += 1
+                self.resyncs += 1
+                self.bytes_discarded += 1
+                self._resyncing = True
+                pos += 1
+                continue
+
+            # length_field nằm ở byte 14..15 của payload
+            length_field = buf[pos + 17] | (buf[pos + 18] << 8)
+            self._resyncing = False
+            if 16 + length_field <= payload_len:
+                if first is None:
+                    first = pos
+                spans.append((pos + 3, length_field))
+            else:
+                self.csi_length_errors += 1
+            pos = frame_end
+
+        self._start = pos
+        if not spans:
+            return []
+
+        # Chụp một lần toàn bộ vùng chứa các frame, mọi CSI là view int8 trên vùng này
+        block = bytes(self._view[first:pos])
+        frames = []
+        for off, length_field in spans:
+            off -= first
+            # mac_bytes, ts_local_us, ts_real_ms, length_field = struct.unpack('<6sQQH', payload[:24])
+            mac_bytes, ts_real_ms = struct.unpack_from('<6sQ', block, off)
+            csi = np.frombuffer(block, dtype=np.int8, count=length_field, offset=off + 16)
+            frames.append((mac_bytes, ts_real_ms, csi))
+        return frames
+
+def print_uart_log(text: str):
+    print(f"[UART LOG] {text}")
+
+class CsvSink:
+    """Ghi CSV cũ: CSI dạng chuỗi "[12, -3, ...]"; thêm cột port ở cuối khi thu nhiều cổng."""
+
+    def __init__(self, path, with_port: bool = False):
+        self.path = path
+        self.f = open(path, 'w', newline='')
+        self.writer = csv.writer(self.f)
+        self.with_port = with_port
+        self.writer.writerow(CSV_HEADER + ["port"] if with_port else CSV_HEADER)
+
+    def write_frames(self, frames):
+        # frames: list (mac_bytes, ts_real_ms, ts_pc_ms, port, csi)
+        rows = []
+        for mac_bytes, ts_real_ms, ts_pc_ms, port, csi in frames:
+            ts_pc_hms = datetime.fromtimestamp(ts_pc_ms / 1000).strftime("%H:%M:%S.%f")[:-3]
+            # rows.append([mac_str, ts_local_us, ts_real_ms, timestamp_pc_ms, timestamp_pc_hms, csi])
+            row = [mac_to_str(mac_bytes), ts_real_ms, ts_pc_ms, ts_pc_hms, csi_to_text(csi)]
+            if self.with_port:
+                row.append(port)
+            rows.append(row)
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+class ShardedSink:
+    """Chia frame về sink riêng của từng MAC qua bảng tra mac_bytes -> shard dựng sẵn."""
+
+    def __init__(self, sinks_by_mac: dict):
+        self.shards = list(sinks_by_mac.values())
+        self.shard_index = {mac: i for i, mac in enumerate(sinks_by_mac)}
+
+    def write_frames(self, frames):
+        groups = [[] for _ in self.shards]
+        shard_index = self.shard_index
+        for frame in frames:
+            groups[shard_index[frame[0]]].append(frame)
+        for shard, group in zip(self.shards, groups):
+            if group:
+                shard.write_frames(group)
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+class TeeSink:
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write_frames(self, frames):
+        for sink in self.sinks:
+            sink.write_frames(frames)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+class SegmentedSink:
+    """
+    Ghi một stream thành nhiều segment theo dung lượng / thời lượng. Mỗi segment được thêm vào
+    manifest ngay khi mở (closed = False), cập nhật tập MAC, [min, max] của timestamp_real_ms,
+    timestamp_pc_ms và số frame / byte mỗi sync_ms, và lần cuối khi đóng (closed = True).
+    """
+
+    def __init__(self, path_no_ext: str, stream: str, open_file, manifest: Manifest,
+                 max_bytes: int = SEGMENT_MAX_BYTES, max_s: float = SEGMENT_MAX_S, sync_ms: int = MANIFEST_SYNC_MS):
+        self.path_no_ext = path_no_ext
+        self.stream = stream
+        self.open_file = open_file  # path_no_ext -> sink có .f, .path
+        self.manifest = manifest
+        self.max_bytes = max_bytes
+        self.max_ms = max_s * 1000
+        self.sync_ms = sync_ms
+        self.part = -1
+        self.sink = None
+        self.entry = None
+        self._new_segment()
+
+    def _new_segment(self):
+        self.part += 1
+        self.sink = self.open_file(f'{self.path_no_ext}_part{self.part:03d}')
+        self.frames = 0
+        self.macs = set()
+        self.real_range = [None, None]
+        self.pc_range = [None, None]
+        self.last_sync = None
+        self.entry = self.manifest.add({
+            'file': os.path.relpath(self.sink.path, os.path.dirname(os.path.abspath(self.manifest.path))),
+            'stream': self.stream,
+            'part': self.part,
+            'closed': False,
+            **self._progress(),
+        })
+
+    def _progress(self):
+        return {
+            'frames': self.frames,
+            'bytes': self.sink.f.tell(),
+            'macs': sorted(mac_to_str(m) for m in self.macs),
+            'timestamp_real_ms': list(self.real_range),
+            'timestamp_pc_ms': list(self.pc_range),
+        }
+
+    def _sync(self):
+        self.sink.f.flush()  # số byte trong manifest phải có trên đĩa
+        self.manifest.update(self.entry, **self._progress())
+
+    def _close_segment(self):
+        progress = self._progress()
+        self.sink.close()
+        self.manifest.update(self.entry, closed=True, **progress)
+
+    def write_frames(self, frames):
+        if self.frames and (self.sink.f.tell() >= self.max_bytes or
+                            frames[0][2] - self.pc_range[0] >= self.max_ms):
+            self._close_segment()
+            self._new_segment()
+        self.sink.write_frames(frames)
+
+        real_lo, real_hi = self.real_range
+        pc_lo, pc_hi = self.pc_range
+        macs = self.macs
+        for mac_bytes, ts_real_ms, ts_pc_ms, *_ in frames:
+            macs.add(mac_bytes)
+            if real_lo is None or ts_real_ms < real_lo:
+                real_lo = ts_real_ms
+            if real_hi is None or ts_real_ms > real_hi:
+                real_hi = ts_real_ms
+            if pc_lo is None or ts_pc_ms < pc_lo:
+                pc_lo = ts_pc_ms
+            if pc_hi is None or ts_pc_ms > pc_hi:
+                pc_hi = ts_pc_ms
+        self.real_range = [real_lo, real_hi]
+        self.pc_range = [pc_lo, pc_hi]
+        self.frames += len(frames)
+        if self.last_sync is None or pc_hi - self.last_sync >= self.sync_ms:
+            self.last_sync = pc_hi
+            self._sync()
+
+    def close(self):
+        self._close_segment()
+
+def _open_file_sink(path_no_ext: str, n_ports: int):
+    if OUTPUT_FORMAT == 'csv':
+        return CsvSink(f'{path_no_ext}.csv', with_port=n_ports > 1)
+    return RecordWriter(f'{path_no_ext}.bin', sorted(WHITELIST_MACS), BIN_N_VALUES)
+
+def open_manifest(now_str: str) -> Manifest:
+    return Manifest(f'csi_data_{now_str}_manifest.json', format=OUTPUT_FORMAT, started=now_str,
+                    macs=sorted(mac_to_str(m) for m in WHITELIST_MACS))
+
+def open_sink(now_str: str, manifest: Manifest, n_ports: int = 1):
+    base = f'csi_data_{now_str}'
+
+    def segmented(path_no_ext, stream):
+        return SegmentedSink(path_no_ext, stream, lambda p: _open_file_sink(p, n_ports), manifest)
+
+    sinks = []
+    if OUTPUT_LAYOUT in ('merged', 'both'):
+        sinks.append(segmented(base, 'merged'))
+    if OUTPUT_LAYOUT in ('by_mac', 'both'):
+        shard_dir = f'{base}_by_mac'
+        os.makedirs(shard_dir, exist_ok=True)
+        sinks.append(ShardedSink({
+            mac: segmented(os.path.join(shard_dir, mac_to_str(mac).replace(':', '_')), mac_to_str(mac))
+            for mac in sorted(WHITELIST_MACS)
+        }))
+    return sinks[0] if len(sinks) == 1 else TeeSink(*sinks)
+
+def reader_loop(reader: FrameReader, port: int, out_queue: queue.Queue, stats: CaptureStats, stop: threading.Event):
+    # Chỉ đọc UART, gắn timestamp PC + số thứ tự cổng và đẩy sang hàng đợi; không đụng tới đĩa
+    while not stop.is_set():
+        frames = reader.poll()
+        if not frames:
+            continue
+        timestamp_pc_ms = int(time.time() * 1000)
+
+        # mac_bytes, ts_local_us, ts_real_ms, csi = evt
+        batch = []
+        rejected = []
+        for mac_bytes, ts_real_ms, csi in frames:
+            if mac_bytes in WHITELIST_MACS:
+                batch.append((mac_bytes, ts_real_ms, timestamp_pc_ms, port, csi))
+            else:
+                rejected.append(mac_bytes)
+        stats.count_read(batch, rejected)
+        if not batch:
+            continue
+        try:
+            out_queue.put_nowait(batch)
+        except queue.Full:
+            with stats.lock:
+                stats.frames_dropped += len(batch)
+            continue
+        depth = out_queue.qsize()
+        if depth > stats.max_queue_depth:
+            stats.max_queue_depth = depth
+
+def _ts_pc(frame):
+    return frame[2]
+
+def writer_loop(sink, in_queue: queue.Queue, stats: CaptureStats, observers=(), reorder_ms: int = REORDER_MS,
+                deduper: TimestampDeduper = None, stop: threading.Event = None):
+    """
+    Vét hết các lô đang chờ của mọi cổng, sắp theo timestamp_pc_ms và chỉ ghi những frame cũ hơn
+    (bây giờ - reorder_ms), để file đầu ra là một dòng thời gian duy nhất. Dừng khi nhận None.
+    deduper (nếu có) sửa timestamp_real_ms trùng trước khi ghi, nhìn trước các frame còn chờ.
+    Mỗi observer có update(frames), được gọi với các frame vừa ghi theo đúng thứ tự đó.
+    Lỗi khi ghi (đầy đĩa, observer lỗi, ...) được in ra và set stop để dừng cả phiên thu, thay vì
+    thread chết im lặng trong khi các reader vẫn đổ vào hàng đợi.
+    """
     try:
-        # mac_bytes, ts_local_us, ts_real_ms, length_field = struct.unpack('<6sQQH', payload[:24])
-        mac_bytes, ts_real_ms, length_field = struct.unpack('<6sQH', payload[:16])
-    except struct.error as e:
-        print(f"[❌] Header unpack error: {e}")
-        return None
-    # csi_raw = payload[24:24+length_field]
-    csi_raw = payload[16:16+length_field]
-    if len(csi_raw) < length_field:
-        return None
-    try:
-        csi_list = list(struct.unpack(f'<{length_field}b', csi_raw))
-    except struct.error as e:
-        print(f"[❌] CSI unpack error: {e}")
-        return None
+        _writer_loop(sink, in_queue, stats, observers, reorder_ms, deduper)
+    except Exception as e:
+        print(f"❌ Lỗi khi ghi, dừng thu: {e!r}")
+        traceback.print_exc()
+        if stop is not None:
+            stop.set()
 
-    # return mac_bytes, ts_local_us, ts_real_ms, csi_list
-    return mac_bytes, ts_real_ms, csi_list
+def _writer_loop(sink, in_queue, stats, observers, reorder_ms, deduper):
+    pending = []
+    running = True
+    while running:
+        try:
+            batch = in_queue.get(timeout=reorder_ms / 1000)
+        except queue.Empty:
+            batch = []
+        # Lấy giờ trước khi vét hàng đợi: lô nào vào hàng đợi sau đó đều được gắn giờ sau mốc này
+        now_ms = int(time.time() * 1000)
+        while batch is not None:
+            pending.extend(batch)
+            try:
+                batch = in_queue.get_nowait()
+            except queue.Empty:
+                break
+        if batch is None:
+            running = False
+        if not pending:
+            continue
 
-def mac_to_str(mac_bytes: bytes) -> str:
-    return ':'.join(f'{b:02X}' for b in mac_bytes)
+        pending.sort(key=_ts_pc)  # các lô gần như đã đúng thứ tự nên sort gần tuyến tính
+        if running:
+            # Hàng đợi đã vét hết nên mọi frame chưa tới đều có giờ >= now_ms (trừ độ trễ gắn giờ -> đẩy
+            # vào hàng đợi, nhỏ hơn nhiều so với reorder_ms): ghi phần cũ hơn watermark là đúng thứ tự
+            cut = bisect.bisect_right(pending, now_ms - reorder_ms, key=_ts_pc)
+        else:
+            cut = len(pending)
+        if not cut:
+            continue
+        ready = pending[:cut]
+        del pending[:cut]
+        if deduper is not None:
+            ready = deduper.resolve(ready, pending)
+        for lo in range(0, cut, WRITE_BATCH_FRAMES):
+            chunk = ready[lo:lo + WRITE_BATCH_FRAMES]
+            sink.write_frames(chunk)
+            stats.count_written(chunk, time.time() * 1000)
+            for observer in observers:
+                observer.update(chunk)
 
 def main():
-    port = choose_port()
+    ports = choose_ports()
     baud = choose_baud()
-    ser = open_serial(port, baud)
+    sers = [open_serial(port, baud) for port in ports]
     now_str = datetime.now().strftime("%Y%m%d_%H%M%S")
 
 
-    with open(f'csi_data_{now_str}.csv', 'w', newline='') as csvfile, open('fps_log.csv', 'w', newline='') as fpsfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(CSV_HEADER)
-
+    manifest = open_manifest(now_str)
+    sink = open_sink(now_str, manifest, len(ports))
+    frame_queue = queue.Queue(maxsize=QUEUE_MAX_BATCHES)
+    stats = CaptureStats(frame_queue)
+    stats.csi_capacity = BIN_N_VALUES if OUTPUT_FORMAT == 'bin' else None
+    stop = threading.Event()
+    stats.readers = [(i, FrameReader(ser)) for i, ser in enumerate(sers)]
+    reader_ths = [
+        threading.Thread(target=reader_loop, args=(reader, i, frame_queue, stats, stop), daemon=True)
+        for i, reader in stats.readers
+    ]
+    with open(f'fps_log_{now_str}.csv', 'w', newline='') as fpsfile, open(f'gaps_{now_str}.csv', 'w', newline='') as gapfile:
         fps_writer = csv.writer(fpsfile)
         fps_writer.writerow(FPS_CSV_HEADER)
+        gap_writer = csv.writer(gapfile)
+        gap_writer.writerow(GAP_CSV_HEADER)
 
-        packet_count = defaultdict(int)
-        last_report = time.time()
+        def on_timing_event(event):
+            ts_pc_ms, mac_bytes, port, kind, dev_gap, host_gap, ts_real_ms = event
+            # Chỉ ghi file; số gap / TX đang đứng nằm trong metrics và dòng tóm tắt mỗi giây
+            gap_writer.writerow([ts_pc_ms, mac_to_str(mac_bytes), port, kind, dev_gap, host_gap, ts_real_ms])
 
-        print(f"🟢 Bắt đầu ghi CSI từ {port} @ {baud}... Nhấn Ctrl+C để dừng.")
-        try:
-            while True:
-                evt = read_event(ser)
-                if evt:
-                    timestamp_pc = time.time()
-                    timestamp_pc_ms = int(timestamp_pc * 1000)
-                    timestamp_pc_hms = datetime.fromtimestamp(timestamp_pc).strftime("%H:%M:%S.%f")[:-3]
-
-                    # mac_bytes, ts_local_us, ts_real_ms, csi = evt
-                    mac_bytes, ts_real_ms, csi = evt
-                    if mac_bytes in WHITELIST_MACS:
-                        mac_str = mac_to_str(mac_bytes)
-                        # writer.writerow([mac_str, ts_local_us, ts_real_ms, timestamp_pc_ms, timestamp_pc_hms, csi])
-                        writer.writerow([mac_str, ts_real_ms, timestamp_pc_ms, timestamp_pc_hms, csi])
-                        packet_count[mac_str] += 1
-                    else:
-                        print(f"[⚠️] MAC không nằm trong whitelist: {mac_to_str(mac_bytes)}")
+        timing = TimingTracker(on_timing_event)
+        stats.timing = timing
+        clock = ClockModel()
+        deduper = TimestampDeduper() if DEDUP_TIMESTAMPS else None
+        if deduper is not None and len(ports) > 1 and OUTPUT_LAYOUT != 'by_mac':
+            print("ℹ️ Thu từ nhiều cổng: timestamp chỉ hết trùng trong từng (MAC, cổng); "
+                  "file merged vẫn cần #1_duplicate_rows.py")
+        stats.deduper = deduper
+        observers = [timing, clock]
+        occupancy = publisher = None
+        if OCCUPANCY_DETECT:
+            publisher = OccupancyPublisher(f'occupancy_{now_str}.jsonl', OCCUPANCY_UDP_PORT)
 
+            def on_occupancy(event):
+                publisher(event)
+                print(f"{'🚶' if event['occupied'] else '🫥'} {event['mac']}@{event['port']}: "
+                      f"{'có người' if event['occupied'] else 'không có người'} "
+                      f"(STI {event['sti']}, trễ {event['latency_ms']:.0f} ms)")
+
+            occupancy = OccupancyDetector(on_occupancy, off_threshold=OCCUPANCY_OFF_THRESHOLD,
+                                          enter_frames=OCCUPANCY_ENTER_FRAMES, exit_ms=OCCUPANCY_EXIT_MS)
+            observers.append(occupancy)
+        stats.occupancy = occupancy
+        writer_th = threading.Thread(target=writer_loop, args=(sink, frame_queue, stats, observers),
+                                     kwargs={'deduper': deduper, 'stop': stop}, daemon=True)
+
+        print(f"🟢 Bắt đầu ghi CSI từ {', '.join(ports)} @ {baud}... Nhấn Ctrl+C để dừng.")
+        metrics_server = start_metrics_server(stats, METRICS_PORT) if METRICS_PORT else None
+        if metrics_server:
+            print(f"📈 Metrics: http://127.0.0.1:{METRICS_PORT}/metrics")
+        for th in reader_ths:
+            th.start()
+        writer_th.start()
+        last_timing_report = time.time()
+        try:
+            while not stop.is_set():  # writer_loop set stop khi ghi lỗi
+                time.sleep(1.0)
                 now = time.time()
-                if now - last_report >= 1.0:
-                    if packet_count:
-                        print("📶 Tần số (gói/s) mỗi MAC:")
-                        timestamp_hms = datetime.now().strftime("%H:%M:%S")
-                        for m, cnt in packet_count.items():
-                            print(f"  {m}: {cnt:.2f} Hz")
-                            fps_writer.writerow([timestamp_hms, m, cnt])
-                    packet_count.clear()
-                    last_report = now
+                timing.check_stalls(int(now * 1000))
+                packet_count = stats.take_packet_count()
+                timestamp_hms = datetime.now().strftime("%H:%M:%S")
+                rates = []
+                for mac_bytes, cnt in packet_count.items():
+                    m = mac_to_str(mac_bytes)
+                    rates.append(f"{m}={cnt}")
+                    fps_writer.writerow([timestamp_hms, m, cnt])
+                print(f"📶 {timestamp_hms} {' '.join(rates) or 'không có gói'} | {summary_line(stats)}")
+                if now - last_timing_report >= WINDOW_MS / 1000:
+                    last_timing_report = now
+                    manifest.set('clock', clock.to_dict())
+                    for mac_bytes, port, link in timing.snapshot():
+                        d, h = link.device, link.host
+                        print(f"⏱️ {mac_to_str(mac_bytes)}@{port}: thiết bị {d.mean:.1f}±{d.jitter:.1f} ms "
+                              f"p99≤{d.p99():g} max {d.max_gap()} | PC {h.mean:.1f}±{h.jitter:.1f} ms "
+                              f"p99≤{h.p99():g} max {h.max_gap()} | gap {link.gaps}")
         except KeyboardInterrupt:
             print("\n🛑 Dừng ghi.")
         finally:
-            ser.close()
+            stop.set()
+            for th in reader_ths:
+                th.join()
+            for ser in sers:
+                ser.close()
+            # Ghi nốt phần còn trong hàng đợi rồi dừng; writer đã chết vì lỗi thì hàng đợi có thể đầy
+            if writer_th.is_alive():
+                try:
+                    frame_queue.put(None, timeout=WRITER_STOP_TIMEOUT_S)
+                except queue.Full:
+                    print("⚠️ Writer không lấy hàng đợi, bỏ phần chưa ghi")
+                writer_th.join(timeout=WRITER_STOP_TIMEOUT_S)
+                if writer_th.is_alive():
+                    print("⚠️ Writer chưa dừng sau "
+                          f"{WRITER_STOP_TIMEOUT_S} s, đóng file (phần đang ghi dở có thể mất)")
+            sink.close()
+            clock.close()
+            clock_fits = clock.to_dict()
+            manifest.set('clock', clock_fits)
+            for mac, segments in clock_fits.items():
+                seg = segments[-1]
+                print(f"🕒 {mac}: offset {seg['offset_ms']:.1f} ms, drift {seg['drift_ppm']:+.1f} ppm, "
+                      f"rms {seg['rms_ms']:.2f} ms ({len(segments)} đoạn)")
+            if occupancy is not None:
+                publisher.close()
+                for mac_bytes, port, st in occupancy.snapshot():
+                    print(f"🚶 {mac_to_str(mac_bytes)}@{port}: {st.changes} lần đổi trạng thái, trễ quyết định "
+                          f"p50≤{st.latency.quantile(0.5):g} p99≤{st.latency.quantile(0.99):g} ms")
+            if metrics_server:
+                metrics_server.shutdown()
+            print(f"📊 {summary_line(stats)}")
 
 if __name__ == '__main__':
     main()
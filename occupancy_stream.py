@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Phát hiện có người trực tuyến trong lúc thu: observer của writer_loop (com_readv5.py).
+
+Cùng STI như ocupice.py / process/sti.py: mỗi cặp (MAC, cổng) giữ vector CSI đã chuẩn hoá của gói trước,
+mỗi gói mới chỉ chuẩn hoá một vector và lấy ||cur - prev|| (không phụ thuộc độ dài phiên thu).
+Quyết định có hysteresis / debounce tuỳ chọn:
+ - vào trạng thái có người khi STI > threshold ở enter_frames gói liên tiếp
+ - ra khi STI <= off_threshold liên tục ít nhất exit_ms (theo timestamp_real_ms của thiết bị)
+Mặc định (off_threshold = threshold, enter_frames = 1, exit_ms = 0) trùng với quyết định
+từng dòng của ocupice.py.
+
+Chỉ báo khi trạng thái đổi: on_event(event) với event là dict
+    {'mac', 'port', 'occupied', 'timestamp_real_ms', 'timestamp_pc_ms', 'sti', 'latency_ms'}
+OccupancyPublisher ghi event thành một dòng JSON vào file và/hoặc gửi UDP tới 127.0.0.1:port.
+
+Độ trễ = lúc ra quyết định - timestamp_pc_ms (lúc đọc gói từ UART), đo cho mọi gói và gom
+vào LatencyHistogram theo (MAC, cổng); gồm cả REORDER_MS mà writer_loop giữ gói lại.
+"""
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+
+from capture_metrics import LatencyHistogram
+from process.csi_record import mac_to_str
+from process.sti import THRESHOLD
+
+ENTER_FRAMES = 1   # số gói liên tiếp có STI > threshold để chuyển sang có người
+EXIT_MS = 0        # thời gian STI <= off_threshold liên tục để chuyển về không có người
+
+
+class MacOccupancy:
+    """Trạng thái của một cặp (MAC, cổng)."""
+
+    __slots__ = ('prev', 'occupied', 'above', 'below_since', 'sti', 'frames', 'changes', 'latency')
+
+    def __init__(self):
+        self.prev = None           # vector chuẩn hoá của gói trước
+        self.occupied = False
+        self.above = 0             # số gói liên tiếp có STI > threshold
+        self.below_since = None    # timestamp_real_ms của gói đầu tiên trong chuỗi STI <= off_threshold
+        self.sti = 0.0
+        self.frames = 0
+        self.changes = 0
+        self.latency = LatencyHistogram()
+
+
+class OccupancyDetector:
+    def __init__(self, on_event=None, threshold: float = THRESHOLD, off_threshold: float = None,
+                 enter_frames: int = ENTER_FRAMES, exit_ms: int = EXIT_MS):
+        self.on_event = on_event
+        self.threshold = threshold
+        self.off_threshold = threshold if off_threshold is None else off_threshold
+        self.enter_frames = enter_frames
+        self.exit_ms = exit_ms
+        self.macs = {}  # (mac_bytes, port) -> MacOccupancy
+        self.lock = threading.Lock()
+
+    def update(self, frames):
+        """frames: list (mac_bytes, ts_real_ms, ts_pc_ms, port, csi), theo thứ tự ghi."""
+        macs = self.macs
+        for mac_bytes, ts_real_ms, ts_pc_ms, port, csi in frames:
+            key = (mac_bytes, port)
+            st = macs.get(key)
+            if st is None:
+                with self.lock:
+                    st = macs[key] = MacOccupancy()
+            shifted = csi - csi.mean()   # int8 -> float64
+            sigma = np.sqrt(np.dot(shifted, shifted))
+            cur = shifted if sigma == 0 else shifted / sigma
+            prev, st.prev = st.prev, cur
+            st.frames += 1
+            if prev is None or len(prev) != len(cur):
+                continue  # gói đầu tiên (hoặc đổi độ dài CSI): chưa có STI
+            diff = cur - prev
+            sti = float(np.sqrt(np.dot(diff, diff)))
+            st.sti = sti
+
+            changed = False
+            if sti > self.threshold:
+                st.above += 1
+                if not st.occupied and st.above >= self.enter_frames:
+                    st.occupied = changed = True
+            else:
+                st.above = 0
+            if sti <= self.off_threshold:
+                if st.below_since is None:
+                    st.below_since = ts_real_ms
+                if st.occupied and ts_real_ms - st.below_since >= self.exit_ms:
+                    st.occupied = False
+                    changed = True
+            else:
+                st.below_since = None
+
+            latency_ms = time.time() * 1000 - ts_pc_ms
+            st.latency.observe(latency_ms)
+            if changed:
+                st.changes += 1
+                if self.on_event:
+                    self.on_event({'mac': mac_to_str(mac_bytes), 'port': port, 'occupied': st.occupied,
+                                   'timestamp_real_ms': ts_real_ms, 'timestamp_pc_ms': ts_pc_ms,
+                                   'sti': round(sti, 4), 'latency_ms': round(latency_ms, 1)})
+
+    def snapshot(self):
+        """[(mac_bytes, port, MacOccupancy)] để báo cáo."""
+        with self.lock:
+            return [(mac, port, st) for (mac, port), st in sorted(self.macs.items())]
+
+
+class OccupancyPublisher:
+    """Nhận event của OccupancyDetector: ghi JSON lines vào path và/hoặc gửi UDP tới host:udp_port."""
+
+    def __init__(self, path=None, udp_port: int = 0, host: str = '127.0.0.1'):
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if udp_port else None
+        self.addr = (host, udp_port)
+
+    def __call__(self, event):
+        line = json.dumps(event)
+        if self.file:
+            self.file.write(line + '\n')
+            self.file.flush()
+        if self.sock:
+            try:
+                self.sock.sendto(line.encode('utf-8'), self.addr)
+            except OSError:
+                pass  # không có ai nghe thì bỏ qua, không làm chậm vòng ghi
+
+    def close(self):
+        if self.file:
+            self.file.close()
+        if self.sock:
+            self.sock.close()
@@ -1,34 +1,42 @@
 import pandas as pd
 import numpy as np
 
+# Khoảng cách tối đa (ms) từ điểm lưới tới dòng được gán; None = không giới hạn (như trước)
+MAX_SNAP_MS = None
+
 # Đọc dữ liệu gốc
 df = pd.read_csv('csi_data_20250508_141303_fix_duplicate.csv')
-df = df.sort_values(['mac', 'timestamp_real_ms']).reset_index(drop=True)
+df = df.sort_values(['mac', 'timestamp_real_ms'], kind='stable').reset_index(drop=True)
 
 # Tạo lưới thời gian 100 Hz
 start_time = df['timestamp_real_ms'].min()
 end_time = df['timestamp_real_ms'].max()
 grid_timestamps = np.arange(start_time, end_time + 1, 10)
 
-# Danh sách kết quả
-result_rows = []
+# Chỉ số dòng (trong df) được chọn cho từng điểm lưới, lần lượt theo từng MAC
+all_times = df['timestamp_real_ms'].values
+macs = df['mac'].values
+bounds = np.flatnonzero(macs[1:] != macs[:-1]) + 1
+take_parts = []
+grid_parts = []
 
-# Xử lý theo từng MAC
-for mac, group in df.groupby('mac'):
-    group = group.sort_values('timestamp_real_ms').reset_index(drop=True)
-    source_times = group['timestamp_real_ms'].values
+# Xử lý theo từng MAC (df đã xếp theo mac nên mỗi MAC là một đoạn liên tiếp)
+for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(df)]):
+    source_times = all_times[lo:hi]
 
     # Tìm chỉ số dòng có timestamp >= t (gần nhất về phía sau)
     indices = np.searchsorted(source_times, grid_timestamps, side='left')
+    valid = indices < len(source_times)
+    if MAX_SNAP_MS is not None:
+        valid[valid] = source_times[indices[valid]] - grid_timestamps[valid] <= MAX_SNAP_MS
+
+    take_parts.append(lo + indices[valid])
+    grid_parts.append(grid_timestamps[valid])
 
-    for i, t in enumerate(grid_timestamps):
-        idx = indices[i]
-        if idx < len(group):
-            row = group.iloc[idx].copy()
-            if row['timestamp_real_ms'] >= t:
-                row['timestamp_real_ms'] = t  # Gán lại timestamp theo lưới
-                result_rows.append(row)
+# Gom một lần: lấy dòng theo chỉ số rồi gán lại timestamp theo lưới
+take = np.concatenate(take_parts) if take_parts else np.zeros(0, dtype=np.intp)
+output_df = df.take(take)
+output_df['timestamp_real_ms'] = np.concatenate(grid_parts) if grid_parts else []
 
-# Tạo DataFrame và xuất
-output_df = pd.DataFrame(result_rows)
+# Xuất
 output_df.to_csv('csi_data_20250508_141303_snapped_forward.csv', index=False)
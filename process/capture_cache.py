@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cache file thu CSI đã parse: mỗi file CSV chỉ đọc và parse cột CSI một lần, các lần sau mở
+lại bằng memmap các file .npy trong thư mục .csi_cache/ cạnh file gốc.
+
+    from capture_cache import load_capture
+    data_df, csi, valid = load_capture('merged.csv')
+    # data_df: các cột không phải CSI (mac là chuỗi), csi: ma trận int8 (N, L) memmap,
+    # valid: dòng CSI parse được (xem csi_parse.py); mọi dòng của file gốc đều có mặt
+
+Cũng nhận file .bin (csi_record.py, đọc bằng memmap, không cần cache) và manifest của phiên thu
+chia segment (csi_data_<ts>_manifest.json, capture_manifest.py): các segment giao với
+[start_ms, end_ms] (theo clock 'pc' hoặc 'real') của stream được ghép lại theo thứ tự ghi, rồi
+chỉ giữ các dòng trong khoảng đó và thuộc macs (nếu truyền):
+
+    data_df, csi, valid = load_capture('csi_data_20250508_141303_manifest.json', start_ms=t0, end_ms=t1)
+
+Mỗi mục cache (.csi_cache/<tên file>_<hash đường dẫn>/) gồm:
+ - colN.npy     cột số lưu nguyên kiểu; cột chuỗi (mac, ...) lưu mã int32, danh sách giá trị ở meta.json
+ - csi.npy      ma trận int8 (N, L), valid.npy (N,) bool
+ - meta.json    đường dẫn, size, mtime_ns, hash nội dung (blake2b), thứ tự cột, last_used
+
+Khoá: đường dẫn (tên thư mục), rồi size + mtime_ns; nếu size khớp mà mtime khác (file bị copy
+hoặc touch) thì so hash nội dung trước khi tạo lại. Tổng dung lượng .csi_cache/ vượt
+budget_bytes thì xoá mục lâu không dùng nhất (LRU theo last_used).
+
+    python capture_cache.py merged.csv        # tạo / mở cache, in thời gian (hoặc .bin / _manifest.json)
+    python capture_cache.py --list [dir]      # liệt kê mục cache trong dir/.csi_cache
+    python capture_cache.py --clear [dir]
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from capture_manifest import is_manifest, segment_paths
+from csi_parse import parse_csi_column
+from csi_record import load_records, mac_to_str
+
+CACHE_DIR_NAME = '.csi_cache'
+CACHE_BUDGET_BYTES = 4 * 1024 ** 3
+CHUNK_ROWS = 200_000
+FORMAT_VERSION = 1
+
+
+def file_hash(path, block: int = 8 * 1024 * 1024) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            buf = f.read(block)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def _cache_root(path, cache_dir=None):
+    return cache_dir or os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+
+
+def _entry_dir(path, cache_dir=None):
+    abspath = os.path.abspath(path)
+    key = hashlib.sha1(abspath.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(_cache_root(path, cache_dir), f'{os.path.basename(abspath)}_{key}')
+
+
+def _read_meta(entry):
+    try:
+        with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(entry, meta):
+    tmp = os.path.join(entry, 'meta.json.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, os.path.join(entry, 'meta.json'))
+
+
+def _detect_csi_col(chunk):
+    return next(col for col in chunk.columns
+                if not pd.api.types.is_numeric_dtype(chunk[col])
+                and chunk[col].astype(str).str.strip().str.startswith('[').any())
+
+
+def build_cache(path, entry, csi_col=None, chunk_rows: int = CHUNK_ROWS):
+    """Đọc file theo khối, parse cột CSI, ghi các .npy vào entry (qua thư mục tạm)."""
+    st = os.stat(path)
+    parts = {}        # cột -> list mảng theo khối
+    uniques = {}      # cột chuỗi -> {giá trị: mã}
+    csi_parts, valid_parts = [], []
+    n_values = None
+    columns = None
+    for chunk in pd.read_csv(path, chunksize=chunk_rows):
+        if columns is None:
+            columns = list(chunk.columns)
+            csi_col = csi_col or _detect_csi_col(chunk)
+        csi, valid = parse_csi_column(chunk[csi_col], n_values)
+        n_values = csi.shape[1]
+        csi_parts.append(csi)
+        valid_parts.append(valid)
+        for col in columns:
+            if col != csi_col:
+                parts.setdefault(col, []).append(chunk[col].to_numpy())
+
+    tmp = entry + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'csi.npy'), np.concatenate(csi_parts) if csi_parts else np.zeros((0, 0), np.int8))
+    np.save(os.path.join(tmp, 'valid.npy'), np.concatenate(valid_parts) if valid_parts else np.zeros(0, bool))
+    files = {}
+    for i, (col, arrs) in enumerate(parts.items()):
+        fname = f'col{i}.npy'
+        if any(a.dtype == object for a in arrs):
+            # Cột chuỗi: mã hoá theo thứ tự xuất hiện, giữ danh sách giá trị trong meta
+            table = uniques.setdefault(col, {})
+            codes = []
+            for a in arrs:
+                if a.dtype != object:
+                    a = a.astype(str).astype(object)
+                chunk_codes, chunk_uniques = pd.factorize(a, use_na_sentinel=False)
+                remap = np.array([table.setdefault(None if pd.isna(v) else v, len(table))
+                                  for v in chunk_uniques], dtype=np.int32)
+                codes.append(remap[chunk_codes])
+            np.save(os.path.join(tmp, fname), np.concatenate(codes))
+        else:
+            np.save(os.path.join(tmp, fname), np.concatenate(arrs))
+        files[col] = fname
+    meta = {
+        'version': FORMAT_VERSION,
+        'source': os.path.abspath(path),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'hash': file_hash(path),
+        'columns': [c for c in columns or [] if c != csi_col],
+        'csi_col': csi_col,
+        'files': files,
+        'uniques': {col: list(table) for col, table in uniques.items()},
+        'last_used': time.time(),
+    }
+    _write_meta(tmp, meta)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+    return meta
+
+
+def _dir_size(d):
+    return sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d))
+
+
+def list_entries(cache_root):
+    """[(entry, meta, số byte)] của mọi mục trong cache_root, mục lâu không dùng nhất trước."""
+    if not os.path.isdir(cache_root):
+        return []
+    out = []
+    for name in os.listdir(cache_root):
+        entry = os.path.join(cache_root, name)
+        meta = _read_meta(entry) if os.path.isdir(entry) and not name.endswith('.tmp') else None
+        if meta is not None:
+            out.append((entry, meta, _dir_size(entry)))
+    out.sort(key=lambda e: e[1].get('last_used', 0))
+    return out
+
+
+def evict(cache_root, budget_bytes: int = CACHE_BUDGET_BYTES, keep=()):
+    """Xoá mục LRU tới khi tổng dung lượng <= budget_bytes; trả về danh sách mục đã xoá."""
+    entries = list_entries(cache_root)
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for entry, _, size in entries:
+        if total <= budget_bytes:
+            break
+        if entry in keep:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed.append(entry)
+    return removed
+
+
+def open_cache(path, csi_col=None, cache_dir=None, budget_bytes: int = CACHE_BUDGET_BYTES, verbose: bool = True):
+    """Trả về (entry, meta), tạo lại cache nếu file gốc đã đổi."""
+    entry = _entry_dir(path, cache_dir)
+    st = os.stat(path)
+    meta = _read_meta(entry)
+    fresh = meta is not None and meta.get('version') == FORMAT_VERSION and \
+        (csi_col is None or meta['csi_col'] == csi_col) and meta['size'] == st.st_size
+    if fresh and meta['mtime_ns'] != st.st_mtime_ns:
+        fresh = meta['hash'] == file_hash(path)
+        meta['mtime_ns'] = st.st_mtime_ns
+    if fresh:
+        meta['last_used'] = time.time()
+        _write_meta(entry, meta)
+        if verbose:
+            print(f"⚡ Dùng cache {entry}")
+        return entry, meta
+    if verbose:
+        print(f"🧱 Tạo cache cho {path} ...")
+    os.makedirs(_cache_root(path, cache_dir), exist_ok=True)
+    meta = build_cache(path, entry, csi_col)
+    removed = evict(_cache_root(path, cache_dir), budget_bytes, keep=(entry,))
+    if verbose and removed:
+        print(f"🧹 Xoá {len(removed)} mục cache cũ (vượt {budget_bytes / 1024 ** 3:.1f} GB)")
+    return entry, meta
+
+
+def load_bin(path):
+    """
+    File .bin thành cùng bộ ba như load_capture (cột mac, timestamp_real_ms, timestamp_pc_ms, port).
+    L là độ dài CSI phổ biến nhất; bản ghi có độ dài khác thì valid = False, như dòng CSV hỏng.
+    """
+    macs, records = load_records(path)
+    mac_strs = np.array([mac_to_str(m) for m in macs], dtype=object)
+    data_df = pd.DataFrame({
+        'mac': mac_strs[records['mac_id']],
+        'timestamp_real_ms': records['ts_real_ms'].astype(np.int64),
+        'timestamp_pc_ms': records['ts_pc_ms'].astype(np.int64),
+        'port': records['port'].astype(np.int64),
+    })
+    lengths = np.asarray(records['csi_len'])
+    n_values = int(np.bincount(lengths).argmax()) if len(lengths) else records.dtype['csi'].shape[0]
+    return data_df, records['csi'][:, :n_values], (lengths == n_values) & (lengths > 0)
+
+
+def _load_manifest_capture(path, start_ms, end_ms, clock, stream, macs, **kwargs):
+    """Ghép các segment của manifest (csi chép vào bộ nhớ, không còn là memmap)."""
+    paths = segment_paths(path, start_ms, end_ms, clock, stream, macs)
+    if not paths:
+        raise ValueError(f"{path}: không có segment nào của stream {stream!r} trong khoảng đã chọn")
+    parts = [load_bin(p) if p.lower().endswith('.bin') else load_capture(p, **kwargs) for p in paths]
+    widths = {csi.shape[1] for _, csi, _ in parts}
+    if len(widths) > 1:
+        raise ValueError(f"{path}: các segment có độ dài CSI khác nhau {sorted(widths)}")
+    data_df = pd.concat([df for df, _, _ in parts], ignore_index=True)
+    csi = np.concatenate([c for _, c, _ in parts])
+    valid = np.concatenate([v for _, _, v in parts])
+    keep = np.ones(len(data_df), dtype=bool)
+    ts = data_df['timestamp_pc_ms' if clock == 'pc' else 'timestamp_real_ms'].to_numpy()
+    if start_ms is not None:
+        keep &= ts >= start_ms
+    if end_ms is not None:
+        keep &= ts <= end_ms
+    if macs is not None:
+        keep &= data_df['mac'].isin(list(macs)).to_numpy()
+    if not keep.all():
+        data_df, csi, valid = data_df[keep].reset_index(drop=True), csi[keep], valid[keep]
+    if kwargs.get('verbose', True):
+        print(f"- {len(paths)} segment từ {path}, {len(valid)} dòng")
+    return data_df, csi, valid
+
+
+def load_capture(path, csi_col=None, cache_dir=None, budget_bytes: int = CACHE_BUDGET_BYTES,
+                 verbose: bool = True, start_ms=None, end_ms=None, clock: str = 'pc', stream: str = 'merged',
+                 macs=None):
+    """
+    Như mô tả ở đầu file: (data_df không có cột CSI, csi int8 memmap (N, L), valid (N,)).
+    start_ms, end_ms, clock, stream, macs chỉ dùng khi path là manifest.
+    """
+    if is_manifest(path):
+        return _load_manifest_capture(path, start_ms, end_ms, clock, stream, macs, csi_col=csi_col,
+                                      cache_dir=cache_dir, budget_bytes=budget_bytes, verbose=verbose)
+    if path.lower().endswith('.bin'):
+        return load_bin(path)
+    entry, meta = open_cache(path, csi_col, cache_dir, budget_bytes, verbose)
+    data = {}
+    for col in meta['columns']:
+        arr = np.load(os.path.join(entry, meta['files'][col]), mmap_mode='r')
+        if col in meta['uniques']:
+            arr = np.array([np.nan if v is None else v for v in meta['uniques'][col]], dtype=object)[arr]
+        data[col] = arr
+    data_df = pd.DataFrame(data, columns=meta['columns'])
+    csi = np.load(os.path.join(entry, 'csi.npy'), mmap_mode='r')
+    valid = np.load(os.path.join(entry, 'valid.npy'))
+    if verbose:
+        print(f"- Cột CSI: {meta['csi_col']}, {len(valid)} dòng")
+    return data_df, csi, valid
+
+
+def main():
+    args = sys.argv[1:]
+    if not args:
+        print("Cách dùng: python capture_cache.py <file.csv|file.bin|_manifest.json> | --list [dir] | --clear [dir]")
+        sys.exit(1)
+    if args[0] in ('--list', '--clear'):
+        cache_root = os.path.join(args[1] if len(args) > 1 else '.', CACHE_DIR_NAME)
+        entries = list_entries(cache_root)
+        for entry, meta, size in entries:
+            print(f"{size / 1024 ** 2:8.1f} MB  {time.ctime(meta['last_used'])}  {meta['source']}")
+        if args[0] == '--clear':
+            evict(cache_root, 0)
+            print(f"🧹 Đã xoá {len(entries)} mục")
+        return
+    for i in range(2):
+        t0 = time.perf_counter()
+        data_df, csi, valid = load_capture(args[0])
+        print(f"  lần {i + 1}: {time.perf_counter() - t0:.3f} s, csi {csi.shape}, hợp lệ {valid.sum()}/{len(valid)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest cho file thu CSI được chia segment (com_readv5.py ghi csi_data_<ts>_manifest.json).
+
+Mỗi segment ghi: file, stream ('merged' hoặc tên shard theo MAC), tập MAC, số frame, số byte,
+[min, max] của timestamp_real_ms và timestamp_pc_ms; khoá "clock" chứa mô hình đồng hồ
+thiết bị -> PC của từng MAC (clock_model.py). Segment có mặt trong manifest ngay khi được mở
+(closed = False) và được cập nhật định kỳ, nên sau khi chương trình thu bị dừng đột ngột segment
+đang ghi dở vẫn được tìm thấy. Công cụ phía sau chỉ cần mở các segment giao với khoảng nhãn
+thay vì đọc cả phiên thu:
+
+    from capture_manifest import load_manifest, select_segments
+    files = select_segments(load_manifest('csi_data_20250508_141303_manifest.json'), start_ms, end_ms)
+
+capture_cache.load_capture() và csi_tensor.load_csi() nhận thẳng đường dẫn manifest (segment_paths
+bên dưới) và ghép các segment thành một phiên thu.
+"""
+import json
+import os
+import threading
+
+
+class Manifest:
+    """Ghi manifest; mỗi lần thêm segment thì ghi lại cả file (qua file tạm + os.replace)."""
+
+    def __init__(self, path, **info):
+        self.path = path
+        self.data = dict(info, segments=[])
+        self.lock = threading.Lock()
+        self._save()
+
+    def add(self, entry: dict):
+        with self.lock:
+            self.data['segments'].append(entry)
+            self._save()
+        return entry
+
+    def update(self, entry: dict, **fields):
+        """Sửa một segment đã add (cùng object dict) rồi ghi lại file."""
+        with self.lock:
+            entry.update(fields)
+            self._save()
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self._save()
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def load_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    # Đường dẫn segment là tương đối so với thư mục chứa manifest
+    base = os.path.dirname(os.path.abspath(path))
+    for seg in data['segments']:
+        seg['path'] = os.path.join(base, seg['file'])
+    return data
+
+
+def select_segments(manifest, start_ms, end_ms, clock: str = 'pc', stream: str = 'merged', macs=None):
+    """
+    Trả về đường dẫn các segment của stream có [min, max] theo clock ('pc' hoặc 'real')
+    giao với [start_ms, end_ms]; macs (danh sách chuỗi "AA:BB:..") để lọc thêm theo MAC.
+    Segment chưa đóng (closed = False, chương trình thu dừng đột ngột) có thể chứa dữ liệu sau
+    lần cập nhật manifest cuối: coi như kéo dài tới vô cùng và không lọc theo MAC.
+    """
+    key = 'timestamp_pc_ms' if clock == 'pc' else 'timestamp_real_ms'
+    paths = []
+    for seg in manifest['segments']:
+        if seg['stream'] != stream:
+            continue
+        closed = seg.get('closed', True)
+        if closed and not seg['frames']:
+            continue
+        lo, hi = seg[key]
+        if not closed:
+            lo = -float('inf') if lo is None else lo
+            hi = float('inf')
+        if hi < start_ms or lo > end_ms:
+            continue
+        if closed and macs is not None and not set(macs) & set(seg['macs']):
+            continue
+        paths.append(seg['path'])
+    return paths
+
+
+def is_manifest(path) -> bool:
+    return str(path).lower().endswith('_manifest.json')
+
+
+def segment_paths(path, start_ms=None, end_ms=None, clock: str = 'pc', stream: str = 'merged', macs=None):
+    """
+    Đường dẫn các segment của manifest ở path, theo thứ tự ghi, như select_segments; start_ms /
+    end_ms None là không giới hạn. stream là 'merged' hoặc chuỗi MAC của shard (OUTPUT_LAYOUT 'by_mac').
+    """
+    lo = -float('inf') if start_ms is None else start_ms
+    hi = float('inf') if end_ms is None else end_ms
+    return select_segments(load_manifest(path), lo, hi, clock, stream, macs)
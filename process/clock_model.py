@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mô hình đồng hồ thiết bị -> PC (UTC ms) cho từng cặp (MAC, cổng), khớp trực tuyến trong lúc thu.
+timestamp_real_ms là đồng hồ của ESP32 nhận, nên cùng một TX nghe qua hai cổng là hai đồng hồ.
+
+Mỗi frame có timestamp_real_ms (đồng hồ ESP32) và timestamp_pc_ms (time.time() của PC khi đọc).
+timestamp_pc_ms luôn trễ hơn thời điểm thật một khoảng dương (UART, hàng đợi, lập lịch), nên thay
+vì hồi quy trên mọi điểm, ta lấy đường bao dưới: trong mỗi cửa sổ WINDOW_MS (theo đồng hồ thiết bị)
+chỉ giữ điểm có (pc - real) nhỏ nhất, rồi cộng dồn bình phương tối thiểu trên các điểm đó:
+
+    pc ≈ real + offset_ms + drift * (real - ref_dev)        (drift_ppm = drift * 1e6)
+
+Điểm lệch quá REJECT_MS so với mô hình hiện tại bị loại (PC khựng, cả cửa sổ bị trễ). Khi đồng hồ
+thiết bị nhảy lùi (ESP32 khởi động lại) hoặc bị loại liên tiếp MAX_REJECTS lần (PC chỉnh giờ NTP),
+mô hình mở một đoạn mới. com_readv5.py lưu kết quả vào manifest của phiên thu (khoá "clock"),
+công cụ phía sau đổi timestamp_real_ms -> UTC ms mà không cần đọc lại cả file:
+
+    from clock_model import load_clock_model, device_to_host
+    clock = load_clock_model('csi_data_20250508_141303_manifest.json')   # khoá "MAC@cổng"
+    utc_ms = device_to_host(segments_for(clock, '34:86:5D:39:A5:5C', port), df['timestamp_real_ms'].values,
+                            df['timestamp_pc_ms'].values)
+
+    python clock_model.py csi_data_20250508_141303_manifest.json     # in mô hình đã lưu
+"""
+import json
+import sys
+import threading
+
+import numpy as np
+
+WINDOW_MS = 1000      # độ dài cửa sổ lấy điểm đáy (ms, đồng hồ thiết bị)
+REJECT_MS = 20        # điểm đáy lệch quá mức này so với mô hình thì bỏ
+MAX_REJECTS = 5       # bị bỏ liên tiếp bấy nhiêu cửa sổ thì coi là đồng hồ PC đã nhảy
+RESET_MS = 1000       # timestamp_real_ms lùi quá mức này thì coi là thiết bị khởi động lại
+MIN_POINTS = 3        # cần ít nhất bấy nhiêu điểm trước khi bắt đầu loại điểm lệch
+
+
+def _mac_to_str(mac_bytes: bytes) -> str:
+    return ':'.join(f'{b:02X}' for b in mac_bytes)
+
+
+class ClockFit:
+    """Một đoạn liên tục của đồng hồ thiết bị; hồi quy tuyến tính tăng dần trên các điểm đáy."""
+
+    def __init__(self, ts_real_ms: int, ts_pc_ms: int):
+        self.ref_dev = ts_real_ms
+        self.ref_off = ts_pc_ms - ts_real_ms   # trừ đi trước khi cộng dồn để tổng bình phương không mất độ chính xác
+        self.dev_start = self.dev_end = ts_real_ms
+        self.host_start = self.host_end = ts_pc_ms
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+        self.rejected = 0
+        self.reject_run = 0
+        self.window_end = ts_real_ms + WINDOW_MS
+        self.window_min = None   # (x, y) có y = pc - real nhỏ nhất trong cửa sổ đang mở
+
+    def _fit(self):
+        """(offset so với ref_off, drift) của hồi quy trên các điểm đã nhận."""
+        n = self.n
+        if n == 0:
+            return (float(self.window_min[1]) if self.window_min else 0.0), 0.0
+        den = n * self.sxx - self.sx * self.sx
+        if n < 2 or den <= 0:
+            return self.sy / n, 0.0
+        drift = (n * self.sxy - self.sx * self.sy) / den
+        return (self.sy - drift * self.sx) / n, drift
+
+    def offset_drift(self):
+        """(offset_ms tại ref_dev, drift không thứ nguyên)."""
+        offset, drift = self._fit()
+        return self.ref_off + offset, drift
+
+    def predict(self, ts_real_ms):
+        offset, drift = self.offset_drift()
+        x = ts_real_ms - self.ref_dev
+        return ts_real_ms + offset + drift * x
+
+    def _add_point(self, x: float, y: float) -> bool:
+        """Trả về False nếu điểm bị loại."""
+        if self.n >= MIN_POINTS:
+            offset, drift = self._fit()
+            if abs(y - (offset + drift * x)) > REJECT_MS:
+                self.rejected += 1
+                self.reject_run += 1
+                return False
+        self.reject_run = 0
+        self.n += 1
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.sxy += x * y
+        self.syy += y * y
+        return True
+
+    def update(self, ts_real_ms: int, ts_pc_ms: int):
+        if ts_real_ms >= self.window_end:
+            self.close_window()
+            self.window_end = ts_real_ms + WINDOW_MS
+        self.dev_end = max(self.dev_end, ts_real_ms)
+        self.host_end = max(self.host_end, ts_pc_ms)
+        x = ts_real_ms - self.ref_dev
+        y = ts_pc_ms - ts_real_ms - self.ref_off
+        if self.window_min is None or y < self.window_min[1]:
+            self.window_min = (x, y)
+
+    def close_window(self):
+        if self.window_min is not None:
+            self._add_point(*self.window_min)
+            self.window_min = None
+
+    def rms_ms(self) -> float:
+        if self.n < 2:
+            return 0.0
+        offset, drift = self._fit()
+        rss = self.syy - offset * self.sy - drift * self.sxy
+        return max(rss / self.n, 0.0) ** 0.5
+
+    def to_dict(self) -> dict:
+        offset, drift = self.offset_drift()
+        return {
+            'dev_start': self.dev_start,
+            'dev_end': self.dev_end,
+            'host_start': self.host_start,
+            'host_end': self.host_end,
+            'ref_dev': self.ref_dev,
+            'offset_ms': round(offset, 3),
+            'drift_ppm': round(drift * 1e6, 3),
+            'points': self.n,
+            'rejected': self.rejected,
+            'rms_ms': round(self.rms_ms(), 3),
+        }
+
+
+class ClockModel:
+    """Observer cho writer_loop: update(frames) với frame (mac_bytes, ts_real_ms, ts_pc_ms, port, csi)."""
+
+    def __init__(self):
+        self.fits = {}   # (mac_bytes, port) -> [ClockFit], đoạn cuối là đoạn đang khớp
+        self.last_dev = {}
+        self.lock = threading.Lock()
+
+    def update(self, frames):
+        fits = self.fits
+        last_dev = self.last_dev
+        with self.lock:
+            for mac_bytes, ts_real_ms, ts_pc_ms, port, _ in frames:
+                key = (mac_bytes, port)
+                segs = fits.get(key)
+                if segs is None:
+                    fits[key] = [ClockFit(ts_real_ms, ts_pc_ms)]
+                else:
+                    fit = segs[-1]
+                    if ts_real_ms < last_dev[key] - RESET_MS or fit.reject_run >= MAX_REJECTS:
+                        fit.close_window()
+                        segs.append(ClockFit(ts_real_ms, ts_pc_ms))
+                    fit = segs[-1]
+                    fit.update(ts_real_ms, ts_pc_ms)
+                last_dev[key] = ts_real_ms
+
+    def close(self):
+        with self.lock:
+            for segs in self.fits.values():
+                segs[-1].close_window()
+
+    def to_dict(self) -> dict:
+        """{ "AA:BB:..@cổng": [đoạn, ...] } để lưu vào manifest."""
+        with self.lock:
+            return {f'{_mac_to_str(mac)}@{port}': [fit.to_dict() for fit in segs]
+                    for (mac, port), segs in sorted(self.fits.items())}
+
+
+def load_clock_model(path) -> dict:
+    """Đọc mô hình từ manifest (khoá "clock") hoặc từ file JSON chỉ chứa mô hình."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('clock', data)
+
+
+def segments_for(clock: dict, mac: str, port=None):
+    """
+    Các đoạn của một link trong mô hình đã lưu (khoá "MAC@cổng"), None nếu không có.
+    mac có thể đã là nhãn "MAC@cổng"; port None với MAC chỉ thu qua một cổng thì lấy cổng đó
+    (manifest cũ khoá theo MAC cũng đọc được).
+    """
+    if port is not None:
+        mac = f'{mac}@{port}'
+    if mac in clock:
+        return clock[mac]
+    if '@' in mac:
+        return clock.get(mac.split('@')[0])   # manifest cũ, khoá theo MAC
+    matches = [segs for key, segs in clock.items() if key.split('@')[0] == mac]
+    return matches[0] if len(matches) == 1 else None
+
+
+def device_to_host(segments, ts_real_ms, ts_pc_ms=None) -> np.ndarray:
+    """
+    Đổi timestamp_real_ms (mảng) sang UTC ms theo các đoạn của một link (MAC, cổng).
+    Nếu thiết bị từng khởi động lại thì timestamp_real_ms của các đoạn trùng nhau; khi đó truyền
+    thêm ts_pc_ms để chọn đoạn theo giờ PC.
+    """
+    ts_real_ms = np.asarray(ts_real_ms, dtype=np.float64)
+    if ts_pc_ms is not None and len(segments) > 1:
+        starts = np.array([seg['host_start'] for seg in segments], dtype=np.float64)
+        idx = np.searchsorted(starts, np.asarray(ts_pc_ms, dtype=np.float64), side='right') - 1
+        idx = np.clip(idx, 0, len(segments) - 1)
+        # Frame cuối của đoạn trước có thể bị PC đọc trễ sau lúc đoạn mới bắt đầu
+        dev_start = np.array([seg['dev_start'] for seg in segments], dtype=np.float64)[idx]
+        dev_end = np.array([seg['dev_end'] for seg in segments], dtype=np.float64)[idx]
+        idx[((ts_real_ms < dev_start) | (ts_real_ms > dev_end)) & (idx > 0)] -= 1
+    else:
+        starts = np.array([seg['dev_start'] for seg in segments], dtype=np.float64)
+        idx = np.searchsorted(starts, ts_real_ms, side='right') - 1
+    idx = np.clip(idx, 0, len(segments) - 1)
+    ref = np.array([seg['ref_dev'] for seg in segments], dtype=np.float64)[idx]
+    offset = np.array([seg['offset_ms'] for seg in segments], dtype=np.float64)[idx]
+    drift = np.array([seg['drift_ppm'] for seg in segments], dtype=np.float64)[idx] * 1e-6
+    return ts_real_ms + offset + drift * (ts_real_ms - ref)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Cách dùng: python clock_model.py <csi_data_xxx_manifest.json>")
+        sys.exit(1)
+    for mac, segments in load_clock_model(sys.argv[1]).items():
+        for i, seg in enumerate(segments):
+            print(f"🕒 {mac} đoạn {i}: offset {seg['offset_ms']:.1f} ms, drift {seg['drift_ppm']:+.1f} ppm, "
+                  f"rms {seg['rms_ms']:.2f} ms, {seg['points']} điểm ({seg['rejected']} bị loại), "
+                  f"real {seg['dev_start']}..{seg['dev_end']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Lọc subcarrier trên cả ma trận CSI (N, 128) thay cho filter_csi_raw từng dòng.
+
+Mỗi bố cục (sub_ids: subcarrier của từng cặp giá trị trong dòng raw, null: subcarrier bỏ đi)
+được dịch một lần thành mảng chỉ số; lọc cả ma trận chỉ là một phép lấy theo chỉ số.
+
+    from csi_layout import get_layout
+    layout = get_layout('fft64')
+    filtered = layout.filter(csi)        # (N, 2 * n_sub) Re/Im xen kẽ, như filter_csi_raw cũ
+    amp = layout.amplitude(csi)          # (N, n_sub)
+    phase = layout.phase(csi)            # (N, n_sub), radian
+
+Bố cục có sẵn (LAYOUTS):
+ - 'fft64'        64-FFT, bỏ guard band + DC (p.py, p2.py, processing_v2.py) -> 52 subcarrier
+ - 'ht20_pilots'  như p3.py: bỏ thêm 4 pilot -21, -7, 7, 21                   -> 51 subcarrier
+ - 'leading_zero' như p5.py / video_view.py: cặp đầu là số 0 ESP32 chèn vào  -> 55 subcarrier
+
+Cặp giá trị thứ idx là (raw[2 * idx], raw[2 * idx + 1]), gọi là (Re, Im) như các script cũ.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+LAYOUTS = {
+    'fft64': (
+        list(range(0, 32)) + list(range(-32, 0)),
+        [-32, -31, -30, -29, -28, -27, 0, 27, 28, 29, 30, 31],
+    ),
+    'ht20_pilots': (
+        list(range(0, 31)) + list(range(-32, -1)),
+        [-32, -31, -30, -29, -21, -7, 0, 7, 21, 29, 30, 31],
+    ),
+    'leading_zero': (
+        list(range(0, 1)) + list(range(0, 32)) + list(range(-31, 0)),
+        [-31, -30, -29, 0, 28, 29, 30, 31],
+    ),
+}
+
+
+class SubcarrierLayout:
+    """Bố cục đã dịch: pairs là vị trí cặp được giữ, subcarriers là chỉ số subcarrier tương ứng."""
+
+    def __init__(self, sub_ids, null_subcarriers, name=None):
+        remove_set = set(null_subcarriers)
+        self.name = name
+        self.pairs = np.array([idx for idx, sc in enumerate(sub_ids) if sc not in remove_set], dtype=np.intp)
+        self.subcarriers = np.array([sub_ids[idx] for idx in self.pairs], dtype=np.int64)
+        self.re_idx = 2 * self.pairs
+        self.im_idx = 2 * self.pairs + 1
+        self.raw_idx = np.stack([self.re_idx, self.im_idx], axis=1).ravel()
+        self.n_values = 2 * len(sub_ids)   # độ dài dòng tối thiểu
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __repr__(self):
+        return f"SubcarrierLayout({self.name!r}, {len(self)} subcarrier)"
+
+    def filter(self, csi, dtype=None):
+        """csi: (N, L) hoặc (L,). Trả về Re/Im xen kẽ của các subcarrier giữ lại."""
+        out = np.asarray(csi)[..., self.raw_idx]
+        return out if dtype is None else out.astype(dtype)
+
+    def re_im(self, csi, dtype=np.float64):
+        csi = np.asarray(csi)
+        return csi[..., self.re_idx].astype(dtype), csi[..., self.im_idx].astype(dtype)
+
+    def amplitude(self, csi, dtype=np.float64):
+        re, im = self.re_im(csi, dtype)
+        return np.sqrt(re * re + im * im)
+
+    def phase(self, csi, dtype=np.float64):
+        re, im = self.re_im(csi, dtype)
+        return np.arctan2(im, re)
+
+    def amplitude_phase(self, csi, dtype=np.float64):
+        re, im = self.re_im(csi, dtype)
+        return np.sqrt(re * re + im * im), np.arctan2(im, re)
+
+
+@lru_cache(maxsize=None)
+def get_layout(name: str) -> SubcarrierLayout:
+    """Bố cục có tên trong LAYOUTS, chỉ dịch một lần."""
+    sub_ids, null_subcarriers = LAYOUTS[name]
+    return SubcarrierLayout(sub_ids, null_subcarriers, name)
+
+
+def compile_layout(sub_ids, null_subcarriers=()) -> SubcarrierLayout:
+    """Bố cục tự định nghĩa (ví dụ thử danh sách null khác)."""
+    return SubcarrierLayout(list(sub_ids), list(null_subcarriers))
+
+
+if __name__ == '__main__':
+    for layout_name in LAYOUTS:
+        layout = get_layout(layout_name)
+        print(f"{layout_name}: {len(layout)} subcarrier, dùng {layout.n_values} giá trị đầu của dòng")
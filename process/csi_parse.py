@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parse cột CSI dạng chuỗi "[12, -3, ...]" của cả file thành ma trận int8 (N, L) trong một lượt,
+thay cho ast.literal_eval / split(',') từng dòng.
+
+    from csi_parse import parse_csi_column
+    csi, valid = parse_csi_column(df['CSI'])     # csi: (N, L) int8, valid: (N,) bool
+
+Dòng hỏng (không đúng dạng danh sách số nguyên, độ dài khác L, giá trị ngoài int8, ô trống)
+không làm dừng chương trình: valid = False và hàng tương ứng trong csi là 0. L là n_values nếu
+truyền vào, ngược lại là độ dài phổ biến nhất trong 1000 dòng đầu. Xuống dòng trong một ô được
+coi như dấu cách (như ast.literal_eval).
+
+    python csi_parse.py bench [--rows 200000]   # so với ast.literal_eval
+    python csi_parse.py check                   # các trường hợp biên (ô trống, NaN, '[]', xuống dòng)
+    python csi_parse.py file.csv                # kiểm tra cột CSI của một file
+"""
+import argparse
+import ast
+import time
+
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 20_000
+
+
+def _parse_chunk(strs, n_values):
+    """
+    Parse một khối chuỗi ở mức byte: nối bằng '\n', tìm vị trí các chữ số / dấu phẩy / ngoặc bằng
+    phép toán mảng, rồi kiểm tra và đổi số theo từng số (không theo từng byte).
+    Trả về (csi int8 (n, n_values), valid (n,)). strs không được chứa '\n' (parse_csi_column đã thay).
+    """
+    n = len(strs)
+    u = np.frombuffer(('\n'.join(strs) + '\n').encode('ascii', errors='replace'), dtype=np.uint8)
+    nl_pos = np.flatnonzero(u == 10)
+
+    def per_row(pos):
+        # pos đã tăng dần: đếm theo dòng bằng vị trí các dấu '\n' thay vì gán dòng cho từng phần tử
+        return np.diff(np.searchsorted(pos, nl_pos), prepend=0)
+
+    is_digit = (u >= 48) & (u <= 57)
+    prev_digit = np.r_[False, is_digit[:-1]]
+    next_digit = np.r_[is_digit[1:], False]
+    is_minus = u == 45
+    comma_pos = np.flatnonzero(u == 44)
+    open_pos = np.flatnonzero(u == 91)
+    close_pos = np.flatnonzero(u == 93)
+
+    # Ký tự lạ, hoặc dấu '-' không đứng ngay trước một số
+    bad = ~(is_digit | is_minus | (u == 44) | (u == 91) | (u == 93) | (u == 32) | (u == 10))
+    bad |= is_minus & (prev_digit | ~next_digit)
+    valid = per_row(np.flatnonzero(bad)) == 0
+    valid &= (per_row(open_pos) == 1) & (per_row(close_pos) == 1)
+    valid &= per_row(comma_pos) == n_values - 1
+
+    # Mỗi số là một dãy chữ số liền nhau
+    starts = np.flatnonzero(is_digit & ~prev_digit)
+    ends = np.flatnonzero(is_digit & ~next_digit) + 1
+    csi = np.zeros((n, n_values), dtype=np.int8)
+    if not len(starts):
+        return csi, np.zeros(n, dtype=bool)   # không có số nào (ô trống, NaN, '[]'): mọi dòng hỏng
+    n_tok = per_row(starts)
+    valid &= n_tok == n_values
+    tok_row = np.repeat(np.arange(n), n_tok)
+    # Giữa hai số liên tiếp của một dòng có đúng một dấu phẩy (trong một số không có dấu phẩy)
+    commas_before = np.searchsorted(comma_pos, starts)
+    tok_bad = np.r_[False, (tok_row[1:] == tok_row[:-1]) & (np.diff(commas_before) != 1)]
+    # '[' trước số đầu tiên, ']' sau số cuối cùng (chỉ có nghĩa với dòng có đúng một cặp ngoặc)
+    row_open = np.zeros(n, dtype=np.int64)
+    row_close = np.zeros(n, dtype=np.int64)
+    row_open[np.searchsorted(nl_pos, open_pos)] = open_pos
+    row_close[np.searchsorted(nl_pos, close_pos)] = close_pos
+    tok_bad |= (starts < row_open[tok_row]) | (ends > row_close[tok_row])
+
+    # Đổi số: tối đa 3 chữ số (int8), số dài hơn là lỗi
+    tok_len = ends - starts
+    tok_bad |= tok_len > 3
+    vals = (u[ends - 1] - 48).astype(np.int16)
+    vals += np.where(tok_len >= 2, u[np.maximum(ends - 2, 0)] - 48, 0).astype(np.int16) * 10
+    vals += np.where(tok_len >= 3, u[np.maximum(ends - 3, 0)] - 48, 0).astype(np.int16) * 100
+    vals = np.where(u[np.maximum(starts - 1, 0)] == 45, -vals, vals)
+    tok_bad |= (vals < -128) | (vals > 127)
+    valid &= np.bincount(tok_row[tok_bad], minlength=n) == 0
+
+    if n_values:
+        csi[valid] = vals[valid[tok_row]].reshape(-1, n_values)
+    return csi, valid
+
+
+def _row_length(strs):
+    """Số phần tử của dòng (đếm dấu phẩy) dùng để đoán L khi không được truyền vào."""
+    counts = [v.count(',') + 1 for v in strs if isinstance(v, str) and v.strip(' []')]
+    return int(np.bincount(counts).argmax()) if counts else 0
+
+
+def _clean_cell(v):
+    """Ô không phải chuỗi (NaN) -> ''; xuống dòng -> dấu cách, vì _parse_chunk tách dòng bằng '\n'."""
+    if not isinstance(v, str):
+        return ''
+    if '\n' in v or '\r' in v:
+        return v.replace('\r', ' ').replace('\n', ' ')
+    return v
+
+
+def parse_csi_column(values, n_values: int = None, chunk_rows: int = CHUNK_ROWS):
+    """values: Series / list chuỗi CSI. Trả về (csi int8 (N, L), valid bool (N,))."""
+    values = list(values)
+    if n_values is None:
+        n_values = _row_length(values[:1000])
+    n = len(values)
+    csi = np.zeros((n, n_values), dtype=np.int8)
+    valid = np.zeros(n, dtype=bool)
+    for lo in range(0, n, chunk_rows):
+        strs = [_clean_cell(v) for v in values[lo:lo + chunk_rows]]
+        csi[lo:lo + len(strs)], valid[lo:lo + len(strs)] = _parse_chunk(strs, n_values)
+    return csi, valid
+
+
+def _literal_eval_column(values):
+    """Cách cũ: ast.literal_eval từng dòng, dòng lỗi -> None."""
+    out = []
+    for v in values:
+        try:
+            out.append(np.array(ast.literal_eval(v), dtype=float))
+        except Exception:
+            out.append(None)
+    return out
+
+
+def benchmark(n_rows: int = 200_000, n_values: int = 128, bad_rate: float = 0.001, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(-128, 128, size=(n_rows, n_values))
+    values = ['[' + ', '.join(map(str, row)) + ']' for row in data.tolist()]
+    bad = rng.random(n_rows) < bad_rate
+    for i in np.flatnonzero(bad):
+        values[i] = values[i][:len(values[i]) // 2]  # dòng bị cắt giữa chừng
+
+    t0 = time.perf_counter()
+    csi, valid = parse_csi_column(values)
+    t_new = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    old = _literal_eval_column(values)
+    t_old = time.perf_counter() - t0
+
+    old_valid = np.array([v is not None and len(v) == n_values for v in old])
+    assert (old_valid == valid).all() and (valid == ~bad).all()
+    assert (csi[valid] == data[valid]).all()
+    print(f"📊 {n_rows} dòng x {n_values} giá trị, {int(bad.sum())} dòng hỏng")
+    print(f"  ast.literal_eval: {t_old:.2f} s ({n_rows / t_old:,.0f} dòng/s)")
+    print(f"  parse_csi_column: {t_new:.2f} s ({n_rows / t_new:,.0f} dòng/s), nhanh hơn {t_old / t_new:.1f} lần")
+    return t_old, t_new
+
+
+def check():
+    """Các ô hỏng chỉ làm valid = False, không làm dừng cả cột; so với ast.literal_eval."""
+    good = '[1, -2, 3]'
+    cases = [
+        ('ô trống', [''], 3),
+        ('toàn NaN', [np.nan, float('nan'), None], 3),
+        ("'[]'", ['[]'], 3),
+        ("'[]' x2, n_values=None", ['[]', '[]'], None),
+        ('NaN lẫn dòng tốt', [np.nan, good, ''], 3),
+        ('xuống dòng trong ô', [good, '[1,\n -2, 3]', '[1, 2\n', good, '\r\n'], 3),
+        ('xuống dòng, n_values=None', ['[4,\n5]', '[6, 7]'], None),
+    ]
+    ok = True
+    for name, values, n_values in cases:
+        try:
+            csi, valid = parse_csi_column(values, n_values)
+        except Exception as e:
+            print(f"❌ {name}: {type(e).__name__}: {e}")
+            ok = False
+            continue
+        old = _literal_eval_column([v if isinstance(v, str) else '' for v in values])
+        length = csi.shape[1]
+        expected = np.array([v is not None and length > 0 and len(v) == length for v in old])
+        same = len(valid) == len(values) and (valid == expected).all() and \
+            all((csi[i] == old[i]).all() for i in np.flatnonzero(valid))
+        ok &= bool(same)
+        print(f"{'✅' if same else '❌'} {name}: valid = {valid.tolist()}")
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Parse cột CSI")
+    ap.add_argument('target', help="'bench', 'check' hoặc đường dẫn file CSV")
+    ap.add_argument('--rows', type=int, default=200_000)
+    ap.add_argument('--column', default='CSI')
+    args = ap.parse_args()
+    if args.target == 'bench':
+        benchmark(args.rows)
+        return
+    if args.target == 'check':
+        raise SystemExit(0 if check() else 1)
+    df = pd.read_csv(args.target, usecols=[args.column])
+    csi, valid = parse_csi_column(df[args.column])
+    print(f"✅ {valid.sum()}/{len(valid)} dòng hợp lệ, ma trận {csi.shape}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Định dạng nhị phân cho file thu CSI (.bin), thay cho CSV chứa CSI dạng chuỗi "[12, -3, ...]".
+
+Cấu trúc file:
+ - Header cố định HEADER_SIZE byte: magic, version, số giá trị CSI mỗi bản ghi, bảng MAC.
+ - Sau header là các bản ghi cùng kích thước, chỉ ghi nối tiếp (append-only):
+   ts_real_ms, ts_pc_ms, mac_id (chỉ số trong bảng MAC), port, csi_len, csi int8[n_values].
+File đọc lại bằng np.memmap thành mảng có cấu trúc, không cần parse.
+
+Chuyển đổi qua lại với CSV cũ:
+    python csi_record.py csi_data_20250508_141303.csv      -> csi_data_20250508_141303.bin
+    python csi_record.py csi_data_20250508_141303.bin      -> csi_data_20250508_141303.csv
+"""
+import csv
+import os
+import struct
+import sys
+from datetime import datetime
+
+import numpy as np
+
+try:
+    from csi_parse import parse_csi_column
+except ImportError:  # import từ thư mục gốc dưới dạng process.csi_record (com_readv5.py)
+    from process.csi_parse import parse_csi_column
+
+MAGIC = b'CSIREC\x00\x01'
+VERSION = 1
+HEADER_SIZE = 256
+MAX_MACS = 32
+MAC_TABLE_OFFSET = 64
+DEFAULT_N_VALUES = 128
+
+CSV_HEADER = ["mac", "timestamp_real_ms", "timestamp_pc_ms", "timestamp_pc_hms", "CSI"]
+
+# magic, version, header_size, n_values, n_macs
+_HEADER_STRUCT = struct.Struct('<8sHHHH')
+
+# Bảng chuỗi dựng sẵn cho 256 giá trị int8, tra theo byte (uint8)
+_INT8_TEXT = np.array([str(v) for v in np.arange(256, dtype=np.uint8).view(np.int8)], dtype=object)
+
+
+def record_dtype(n_values: int = DEFAULT_N_VALUES) -> np.dtype:
+    return np.dtype([
+        ('ts_real_ms', '<u8'),
+        ('ts_pc_ms', '<u8'),
+        ('mac_id', 'u1'),
+        ('port', 'u1'),
+        ('csi_len', '<u2'),
+        ('csi', 'i1', (n_values,)),
+    ])
+
+
+def mac_to_str(mac_bytes: bytes) -> str:
+    return ':'.join(f'{b:02X}' for b in mac_bytes)
+
+
+def mac_from_str(mac_str: str) -> bytes:
+    return bytes(int(x, 16) for x in mac_str.split(':'))
+
+
+def csi_to_text(csi: np.ndarray) -> str:
+    # Cùng định dạng với repr(list) cũ: "[12, -3, ...]"
+    return '[' + ', '.join(_INT8_TEXT[csi.view(np.uint8)].tolist()) + ']'
+
+
+def pack_header(macs, n_values: int = DEFAULT_N_VALUES) -> bytes:
+    macs = list(macs)
+    if len(macs) > MAX_MACS:
+        raise ValueError(f'Tối đa {MAX_MACS} MAC trong một file, nhận {len(macs)}')
+    header = bytearray(HEADER_SIZE)
+    _HEADER_STRUCT.pack_into(header, 0, MAGIC, VERSION, HEADER_SIZE, n_values, len(macs))
+    for i, mac in enumerate(macs):
+        off = MAC_TABLE_OFFSET + 6 * i
+        header[off:off + 6] = mac
+    return bytes(header)
+
+
+def read_header(path):
+    """Trả về (danh sách mac_bytes theo mac_id, n_values)."""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError(f'{path}: header không đủ {HEADER_SIZE} byte')
+    magic, version, header_size, n_values, n_macs = _HEADER_STRUCT.unpack_from(header, 0)
+    if magic != MAGIC or header_size != HEADER_SIZE:
+        raise ValueError(f'{path}: không phải file CSI nhị phân')
+    if version != VERSION:
+        raise ValueError(f'{path}: version {version} không được hỗ trợ')
+    macs = [bytes(header[MAC_TABLE_OFFSET + 6 * i:MAC_TABLE_OFFSET + 6 * i + 6]) for i in range(n_macs)]
+    return macs, n_values
+
+
+class RecordWriter:
+    """
+    Ghi nối tiếp bản ghi vào file .bin; mở lại file cũ thì ghi tiếp sau bản ghi cuối.
+    CSI dài hơn n_values bị cắt: đếm trong truncated và báo khi close().
+    """
+
+    def __init__(self, path, macs, n_values: int = DEFAULT_N_VALUES):
+        self.path = path
+        self.macs = list(macs)
+        self.n_values = n_values
+        self.dtype = record_dtype(n_values)
+        self.mac_ids = {mac: i for i, mac in enumerate(self.macs)}
+        self.truncated = 0
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            old_macs, old_n = read_header(path)
+            if old_macs != self.macs or old_n != n_values:
+                raise ValueError(f'{path}: header khác với cấu hình hiện tại')
+            # Cắt bỏ bản ghi dở dang nếu lần ghi trước bị dừng giữa chừng
+            n_records = (os.path.getsize(path) - HEADER_SIZE) // self.dtype.itemsize
+            self.f = open(path, 'r+b')
+            self.f.truncate(HEADER_SIZE + n_records * self.dtype.itemsize)
+            self.f.seek(0, os.SEEK_END)
+        else:
+            self.f = open(path, 'wb')
+            self.f.write(pack_header(self.macs, n_values))
+
+    def make_batch(self, n: int) -> np.ndarray:
+        return np.zeros(n, dtype=self.dtype)
+
+    def write_frames(self, frames):
+        """frames: list (mac_bytes, ts_real_ms, ts_pc_ms, port, csi int8)."""
+        rec = self.make_batch(len(frames))
+        for i, (mac_bytes, ts_real_ms, ts_pc_ms, port, csi) in enumerate(frames):
+            n = len(csi)
+            if n > self.n_values:
+                self.truncated += 1
+                n = self.n_values
+            rec['ts_real_ms'][i] = ts_real_ms
+            rec['ts_pc_ms'][i] = ts_pc_ms
+            rec['mac_id'][i] = self.mac_ids[mac_bytes]
+            rec['port'][i] = port
+            rec['csi_len'][i] = n
+            rec['csi'][i, :n] = csi[:n]
+        self.write(rec)
+
+    def write(self, records: np.ndarray):
+        self.f.write(records.tobytes())
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+        if self.truncated:
+            print(f"⚠️ {self.path}: {self.truncated} bản ghi có CSI dài hơn {self.n_values} giá trị bị cắt")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_records(path, mmap: bool = True):
+    """
+    Mở file .bin thành (macs, records). records là mảng có cấu trúc (np.memmap khi mmap=True);
+    bản ghi dở dang ở cuối file (do dừng đột ngột) bị bỏ qua.
+    """
+    macs, n_values = read_header(path)
+    dtype = record_dtype(n_values)
+    n_records = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if n_records == 0:
+        return macs, np.zeros(0, dtype=dtype)
+    if mmap:
+        records = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(n_records,))
+    else:
+        with open(path, 'rb') as f:
+            f.seek(HEADER_SIZE)
+            records = np.fromfile(f, dtype=dtype, count=n_records)
+    return macs, records
+
+
+def _csi_length(text) -> int:
+    """Số giá trị của ô CSI (đếm dấu phẩy), 0 nếu ô trống."""
+    return text.count(',') + 1 if text.strip(' []') else 0
+
+
+def csv_to_records(csv_path, bin_path, n_values: int = None, chunk_rows: int = 100_000):
+    """
+    Chuyển CSV cũ (mac, timestamp_real_ms, timestamp_pc_ms, ..., CSI) sang .bin.
+    n_values mặc định là độ dài CSI lớn nhất trong file (không cắt bản ghi nào); truyền nhỏ hơn
+    thì báo lỗi. Ô CSI hỏng (trống, bị cắt dở, giá trị ngoài int8) được bỏ qua như csi_parse.py.
+    Trả về (số bản ghi đã ghi, số dòng bị bỏ).
+    """
+    # Lượt 1: danh sách MAC để dựng header và độ dài CSI lớn nhất
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+        macs = set()
+        max_len = 0
+        for row in csv.DictReader(f):
+            macs.add(mac_from_str(row['mac']))
+            max_len = max(max_len, _csi_length(row['CSI'] or ''))
+    if n_values is None:
+        n_values = max(max_len, 1)
+    elif max_len > n_values:
+        raise ValueError(f'{csv_path}: có CSI dài {max_len} giá trị, lớn hơn n_values={n_values}')
+
+    with open(csv_path, 'r', newline='', encoding='utf-8') as f, RecordWriter(bin_path, sorted(macs), n_values) as out:
+        reader = csv.DictReader(f)
+        has_pc = 'timestamp_pc_ms' in reader.fieldnames
+        has_port = 'port' in reader.fieldnames
+        total = skipped = 0
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                n_ok = _write_csv_chunk(out, rows, has_pc, has_port)
+                total += n_ok
+                skipped += len(rows) - n_ok
+                rows = []
+        n_ok = _write_csv_chunk(out, rows, has_pc, has_port)
+        total += n_ok
+        skipped += len(rows) - n_ok
+    return total, skipped
+
+
+def _write_csv_chunk(out, rows, has_pc, has_port) -> int:
+    """Parse cột CSI của khối theo từng độ dài (csi_parse.py), ghi các dòng hợp lệ; trả về số dòng đã ghi."""
+    if not rows:
+        return 0
+    texts = [row['CSI'] or '' for row in rows]
+    lengths = np.array([_csi_length(t) for t in texts])
+    valid = np.zeros(len(rows), dtype=bool)
+    batch = out.make_batch(len(rows))
+    for n in np.unique(lengths[lengths > 0]):
+        idx = np.flatnonzero(lengths == n)
+        csi, ok = parse_csi_column([texts[i] for i in idx], int(n))
+        batch['csi'][idx[ok], :n] = csi[ok]
+        batch['csi_len'][idx] = n
+        valid[idx[ok]] = True
+    for i in np.flatnonzero(valid):
+        row = rows[i]
+        batch['ts_real_ms'][i] = int(row['timestamp_real_ms'])
+        batch['ts_pc_ms'][i] = int(row['timestamp_pc_ms']) if has_pc and row['timestamp_pc_ms'] else 0
+        batch['mac_id'][i] = out.mac_ids[mac_from_str(row['mac'])]
+        batch['port'][i] = int(row['port']) if has_port else 0
+    out.write(batch[valid])
+    return int(valid.sum())
+
+
+def records_to_csv(bin_path, csv_path):
+    """
+    Chuyển .bin về CSV cùng định dạng com_readv5.py vẫn ghi trước đây;
+    cột port chỉ được thêm vào cuối khi file thu từ nhiều cổng.
+    """
+    macs, records = load_records(bin_path)
+    mac_strs = [mac_to_str(m) for m in macs]
+    with_port = len(records) > 0 and records['port'].max() > 0
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER + ["port"] if with_port else CSV_HEADER)
+        for rec in records:
+            ts_pc_ms = int(rec['ts_pc_ms'])
+            ts_pc_hms = datetime.fromtimestamp(ts_pc_ms / 1000).strftime("%H:%M:%S.%f")[:-3]
+            row = [
+                mac_strs[rec['mac_id']],
+                int(rec['ts_real_ms']),
+                ts_pc_ms,
+                ts_pc_hms,
+                csi_to_text(rec['csi'][:rec['csi_len']]),
+            ]
+            if with_port:
+                row.append(int(rec['port']))
+            writer.writerow(row)
+    return len(records)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Cách dùng: python csi_record.py <file.csv|file.bin> [file đích]")
+        sys.exit(1)
+    src = sys.argv[1]
+    base, ext = os.path.splitext(src)
+    if ext.lower() == '.csv':
+        dst = sys.argv[2] if len(sys.argv) > 2 else base + '.bin'
+        n, skipped = csv_to_records(src, dst)
+        if skipped:
+            print(f"⚠️ Bỏ {skipped} dòng có CSI hỏng")
+    else:
+        dst = sys.argv[2] if len(sys.argv) > 2 else base + '.csv'
+        n = records_to_csv(src, dst)
+    print(f"✅ Đã chuyển {n} bản ghi: {src} -> {dst}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dựng tensor CSI đã căn lưới thời gian chung: (T, n_mac, n_values) + mặt nạ hợp lệ (T, n_mac);
+mỗi vị trí trên trục n_mac là một cặp (MAC, cổng).
+
+Thay cho việc nội suy từng MAC rồi ghép lại chuỗi CSI từng dòng (#3_Csi_Interpolation.py):
+mỗi điểm lưới lấy hai mẫu kẹp nó (searchsorted) và nội suy tuyến tính theo timestamp cho mọi
+subcarrier cùng lúc, ghi thẳng vào file .npy mở bằng memmap theo từng khối thời gian.
+
+File ra (cùng tiền tố out_base):
+ - <out_base>_csi.npy    (T, n_mac, n_values) float32 hoặc int8 (làm tròn như cách cũ)
+ - <out_base>_mask.npy   (T, n_mac) bool: True nếu điểm lưới nằm giữa hai mẫu cách nhau
+                         không quá max_gap_ms; ngoài khoảng có mẫu thì giá trị là mẫu gần nhất
+                         (giống limit_direction='both' cũ) nhưng mask = False
+ - <out_base>_time.npy   (T,) int64 timestamp_real_ms của lưới
+ - <out_base>_meta.json  danh sách link (theo thứ tự trục 1; "MAC@cổng" khi file thu từ nhiều
+                         cổng, xem load_csi), step_ms, max_gap_ms, dtype
+
+Với đầu vào đã snap vào lưới (#2), kết quả trùng với cách cũ (reindex + interpolate).
+
+    python csi_tensor.py csi_data_20250508_141303_fix_duplicate.csv [out_base]
+    python csi_tensor.py csi_data_20250508_141303.bin [out_base]
+    python csi_tensor.py csi_data_20250508_141303_manifest.json [out_base]   # mọi segment của phiên thu
+
+    csi = np.load('..._csi.npy', mmap_mode='r'); mask = np.load('..._mask.npy')
+"""
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from capture_cache import load_capture
+from capture_manifest import is_manifest
+from csi_record import load_records, mac_to_str
+
+STEP_MS = 10
+MAX_GAP_MS = 100
+BLOCK_T = 16_384   # số điểm lưới xử lý mỗi khối (giới hạn bộ nhớ tạm)
+
+
+def load_csi(path, **select):
+    """
+    Đọc file thu (.csv, .bin hoặc manifest của phiên thu chia segment) thành (links, link_idx, ts, csi):
+    mỗi link là một cặp (MAC, cổng), vì cùng một TX nghe qua hai cổng cho hai chuỗi CSI khác nhau
+    và không được trộn vào nhau. links là list nhãn, "AA:BB:.." khi file chỉ có một cổng,
+    "AA:BB:..@cổng" khi có nhiều cổng; link_idx/ts là mảng theo dòng, csi là ma trận int8 (N, n_values).
+    select (start_ms, end_ms, clock, stream, macs) chọn segment / dòng khi path là manifest
+    (capture_cache.load_capture).
+    """
+    if is_manifest(path) or path.lower().endswith('.csv'):
+        df, csi, valid = load_capture(path, csi_col='CSI', verbose=False, **select)
+        df, csi = df[valid], csi[valid]   # bỏ dòng CSI hỏng
+        mac_idx, macs = pd.factorize(df['mac'], sort=True)
+        port = df['port'].to_numpy(dtype=np.int64) if 'port' in df else np.zeros(len(df), dtype=np.int64)
+        links, link_idx = _links(list(macs), mac_idx, port)
+        return links, link_idx, df['timestamp_real_ms'].to_numpy(dtype=np.int64), csi
+    macs, records = load_records(path)
+    links, link_idx = _links([mac_to_str(m) for m in macs], records['mac_id'], records['port'])
+    return links, link_idx, records['ts_real_ms'].astype(np.int64), records['csi']
+
+
+def _links(macs, mac_idx, port):
+    """(mac_idx, port) theo dòng -> (nhãn link theo thứ tự MAC rồi cổng, link_idx theo dòng)."""
+    key = np.asarray(mac_idx, dtype=np.int64) * 256 + np.asarray(port, dtype=np.int64)
+    keys, link_idx = np.unique(key, return_inverse=True)
+    multi_port = len(np.unique(keys % 256)) > 1
+    links = [f'{macs[k // 256]}@{k % 256}' if multi_port else macs[k // 256] for k in keys.tolist()]
+    return links, link_idx
+
+
+def build_tensor(macs, mac_idx, ts, csi, out_base, step_ms: int = STEP_MS, max_gap_ms: int = MAX_GAP_MS,
+                 dtype=np.float32, block_t: int = BLOCK_T):
+    """Ghi các file .npy như mô tả ở đầu file; trả về (csi memmap, mask, time)."""
+    order = np.lexsort((ts, mac_idx))
+    mac_sorted = np.asarray(mac_idx)[order]
+    ts_sorted = np.asarray(ts, dtype=np.int64)[order]
+    grid = np.arange(ts_sorted.min(), ts_sorted.max() + 1, step_ms, dtype=np.int64)
+    n_t, n_mac, n_values = len(grid), len(macs), csi.shape[1]
+
+    out = np.lib.format.open_memmap(f'{out_base}_csi.npy', mode='w+', dtype=dtype, shape=(n_t, n_mac, n_values))
+    mask = np.zeros((n_t, n_mac), dtype=bool)
+    starts = np.searchsorted(mac_sorted, np.arange(n_mac), side='left')
+    ends = np.searchsorted(mac_sorted, np.arange(n_mac), side='right')
+    for m in range(n_mac):
+        lo, hi = starts[m], ends[m]
+        if lo == hi:
+            continue
+        t_src = ts_sorted[lo:hi]
+        rows = order[lo:hi]   # chỉ số dòng gốc, theo thời gian
+        for b0 in range(0, n_t, block_t):
+            g = grid[b0:b0 + block_t]
+            # Mẫu bên phải: đầu tiên có t >= g; bên trái: ngay trước đó
+            right = np.searchsorted(t_src, g, side='left')
+            exact = (right < len(t_src)) & (t_src[np.minimum(right, len(t_src) - 1)] == g)
+            right = np.clip(right, 0, len(t_src) - 1)
+            left = np.where(exact, right, np.clip(right - 1, 0, len(t_src) - 1))
+            t0 = t_src[left]
+            t1 = t_src[right]
+            span = t1 - t0
+            w = np.where(span > 0, (g - t0) / np.where(span > 0, span, 1), 0.0)
+            w = np.clip(w, 0.0, 1.0)  # ngoài khoảng có mẫu: giữ mẫu gần nhất
+            mask[b0:b0 + block_t, m] = exact | ((g > t0) & (g < t1) & (span <= max_gap_ms))
+            v0 = csi[rows[left]].astype(np.float64)
+            v1 = csi[rows[right]].astype(np.float64)
+            vals = v0 + (v1 - v0) * w[:, None]
+            if np.issubdtype(dtype, np.integer):
+                vals = np.round(vals)
+            out[b0:b0 + block_t, m] = vals
+    out.flush()
+    np.save(f'{out_base}_mask.npy', mask)
+    np.save(f'{out_base}_time.npy', grid)
+    with open(f'{out_base}_meta.json', 'w', encoding='utf-8') as f:
+        json.dump({'macs': list(macs), 'step_ms': step_ms, 'max_gap_ms': max_gap_ms,
+                   'dtype': np.dtype(dtype).name, 'shape': [n_t, n_mac, n_values]}, f, indent=1)
+    return out, mask, grid
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Cách dùng: python csi_tensor.py <file.csv|file.bin|_manifest.json> [out_base]")
+        sys.exit(1)
+    src = sys.argv[1]
+    out_base = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(src)[0]
+    macs, mac_idx, ts, csi = load_csi(src)
+    out, mask, grid = build_tensor(macs, mac_idx, ts, csi, out_base)
+    print(f"✅ {out.shape} -> {out_base}_csi.npy, hợp lệ {mask.mean() * 100:.1f}% điểm lưới")
+
+
+if __name__ == '__main__':
+    main()
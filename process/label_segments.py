@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Cắt dữ liệu CSI theo khoảng nhãn (timestamps.csv: start_utc_ms, end_utc_ms, label, location).
+
+Thay cho mask (ts >= start) & (ts <= end) trên cả file cho từng nhãn (O(nhãn x dòng)):
+xếp dữ liệu theo (mac, timestamp) một lần, mỗi nhãn tìm đoạn dòng của từng MAC bằng
+searchsorted; mỗi nhóm là một lát cắt liên tục của bảng đã xếp (không tạo mask).
+
+    from label_segments import segment_labels, SampleWriter
+    with SampleWriter() as writer:
+        for s in segment_labels(data_df, timestamp_df, 'timestamp_real_ms'):
+            # s.label, s.location, s.sample_id (đếm theo (label, location) như trước), s.devices
+            for mac, grp in s.devices:        # theo thứ tự mac như groupby('mac')
+                writer.write(grp, os.path.join(folder, f'{mac}.csv'))
+
+Kết quả giống hệt data_df.loc[mask].groupby('mac'): cùng dòng, cùng thứ tự dòng, cùng index.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+WORKERS = 4
+
+LabelSample = namedtuple('LabelSample', 'label location sample_id start end devices')
+
+
+def segment_labels(data_df, timestamp_df, ts_col, mac_col='mac',
+                   start_col='start_utc_ms', end_col='end_utc_ms'):
+    """Trả về list LabelSample theo thứ tự dòng của timestamp_df."""
+    mac_codes, macs = pd.factorize(data_df[mac_col], sort=True)
+    ts = data_df[ts_col].to_numpy()
+    order = np.lexsort((ts, mac_codes))
+    order = order[mac_codes[order] >= 0]   # groupby bỏ MAC trống (NaN)
+    sorted_df = data_df.iloc[order]
+    ts_sorted = ts[order]
+    bounds = np.searchsorted(mac_codes[order], np.arange(len(macs) + 1))
+
+    starts = timestamp_df[start_col].to_numpy()
+    ends = timestamp_df[end_col].to_numpy()
+    # Đoạn [lo, hi) của từng (nhãn, MAC): tính cho mọi nhãn một lần
+    lo = np.empty((len(starts), len(macs)), dtype=np.intp)
+    hi = np.empty((len(starts), len(macs)), dtype=np.intp)
+    for m in range(len(macs)):
+        seg = ts_sorted[bounds[m]:bounds[m + 1]]
+        lo[:, m] = bounds[m] + np.searchsorted(seg, starts, side='left')
+        hi[:, m] = bounds[m] + np.searchsorted(seg, ends, side='right')
+
+    samples = []
+    sample_counters = {}
+    labels = timestamp_df['label'].astype(str).tolist()
+    locations = timestamp_df['location'].astype(str).tolist()
+    for k, (label, location) in enumerate(zip(labels, locations)):
+        sample_id = sample_counters.get((label, location), 1)
+        sample_counters[(label, location)] = sample_id + 1
+        devices = []
+        for m in np.flatnonzero(hi[k] > lo[k]):
+            rows = order[lo[k, m]:hi[k, m]]
+            if len(rows) > 1 and (np.diff(rows) < 0).any():
+                # Timestamp của MAC không tăng theo thứ tự dòng: giữ thứ tự dòng gốc như mask cũ
+                devices.append((macs[m], data_df.iloc[np.sort(rows)]))
+            else:
+                devices.append((macs[m], sorted_df.iloc[lo[k, m]:hi[k, m]]))
+        samples.append(LabelSample(label, location, sample_id, starts[k], ends[k], devices))
+    return samples
+
+
+class SampleWriter:
+    """
+    Ghi CSV của các sample bằng một nhóm luồng; vẽ hình vẫn làm ở luồng chính vì pyplot
+    không an toàn với luồng. Lỗi ghi file được ném lại khi close().
+    """
+
+    def __init__(self, workers: int = WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def write(self, df, path):
+        self.futures.append(self.pool.submit(df.to_csv, path, index=False))
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        for fut in self.futures:
+            fut.result()
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
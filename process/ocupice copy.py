@@ -1,8 +1,9 @@
 import csv
-import ast
 import numpy as np
 import matplotlib.pyplot as plt
-import pywt
+
+from csi_parse import parse_csi_column
+from wavelet_denoise import denoise_blocks, preprocess_csi
 
 # Configuration
 CSV_FILE = '34_86_5D_39_A5_5C.csv'            # Path to your input CSV data
@@ -10,24 +11,8 @@ OUTPUT_CSV = 'occupancy_output.csv'  # Path to save detection results
 THRESHOLD = 0.8                      # STI threshold for occupancy
 PLOT_INTERVAL_MS = 20_000            # Interval to plot STI (20 seconds in ms)
 WAVELET = 'sym4'                     # Symlet wavelet for DWT denoising
-
-# Utility: parse CSI string to numpy array
-# Returns None if parsing fails
-def parse_csi(csi_str):
-    try:
-        raw = ast.literal_eval(csi_str)
-        return np.array(raw, dtype=float)
-    except Exception:
-        return None
-
-# DWT denoising of a 1D signal
-def denoise_signal(signal, wavelet=WAVELET, level=None):
-    coeffs = pywt.wavedec(signal, wavelet, level=level)
-    detail_coeffs = coeffs[1]
-    sigma = np.median(np.abs(detail_coeffs)) / 0.6745
-    uthresh = sigma * np.sqrt(2 * np.log(len(signal)))
-    denoised_coeffs = [coeffs[0]] + [pywt.threshold(c, uthresh, mode='soft') for c in coeffs[1:]]
-    return pywt.waverec(denoised_coeffs, wavelet)[:len(signal)]
+DWT_LEVEL = None                     # None: max level for the whole file
+BLOCK_ROWS = 0                       # >0: denoise in overlapping blocks (bounded memory, use a fixed DWT_LEVEL)
 
 # Load CSI entries robustly, handling missing data
 def load_entries(path):
@@ -37,44 +22,16 @@ def load_entries(path):
         for row in reader:
             raw_rows.append(row)
 
-    # Determine subcarrier length from first valid row
-    n_sub = None
-    for row in raw_rows:
-        vec = parse_csi(row['CSI'])
-        if vec is not None:
-            n_sub = len(vec)
-            break
-    if n_sub is None:
+    # Parse the whole CSI column at once; rows that fail to parse become NaN
+    csi, valid = parse_csi_column([row['CSI'] for row in raw_rows])
+    if not valid.any():
         raise ValueError('No valid CSI data found')
+    raw_matrix = csi.astype(float)
+    raw_matrix[~valid] = np.nan
 
-    # Build arrays
-    timestamps = []
-    macs = []
-    raw_matrix = []
-    for row in raw_rows:
-        macs.append(row['mac'])
-        ts = float(row['timestamp_real_ms'])
-        timestamps.append(ts)
-        vec = parse_csi(row['CSI'])
-        if vec is None:
-            raw_matrix.append(np.full(n_sub, np.nan))
-        else:
-            raw_matrix.append(vec)
-
-    return np.array(timestamps), np.vstack(raw_matrix), macs
-
-# Preprocess CSI matrix: interpolate missing and DWT denoise
-def preprocess_csi(timestamps, raw_matrix):
-    denoised = np.zeros_like(raw_matrix)
-    for i in range(raw_matrix.shape[1]):
-        col = raw_matrix[:, i]
-        valid_idx = ~np.isnan(col)
-        if valid_idx.sum() < 2:
-            denoised[:, i] = np.nan_to_num(col)
-            continue
-        interp = np.interp(timestamps, timestamps[valid_idx], col[valid_idx])
-        denoised[:, i] = denoise_signal(interp)
-    return denoised
+    timestamps = np.array([float(row['timestamp_real_ms']) for row in raw_rows])
+    macs = [row['mac'] for row in raw_rows]
+    return timestamps, raw_matrix, macs
 
 # Normalize CSI vector: translation and scale
 def normalize_csi(vec):
@@ -86,7 +43,11 @@ def normalize_csi(vec):
 # Main occupancy detection + plotting
 def run():
     ts, raw_matrix, macs = load_entries(CSV_FILE)
-    csi_matrix = preprocess_csi(ts, raw_matrix)
+    # All subcarriers at once (wavelet_denoise.py), same result as the old per-column loop
+    if BLOCK_ROWS:
+        csi_matrix = denoise_blocks(ts, raw_matrix, wavelet=WAVELET, level=DWT_LEVEL, block_rows=BLOCK_ROWS)
+    else:
+        csi_matrix = preprocess_csi(ts, raw_matrix, WAVELET, DWT_LEVEL)
 
     # Prepare output CSV and write header
     with open(OUTPUT_CSV, 'w', newline='') as out_file:
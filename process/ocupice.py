@@ -1,115 +1,50 @@
-import csv
-import ast
 import numpy as np
 import matplotlib.pyplot as plt
 
+from capture_cache import load_capture
+from sti import plot_windows, sti_series, write_sti_csv
+
 # Configuration
-CSV_FILE = 'A0_DD_6C_0F_99_C8.csv'      # Path to your input CSV data
+CSV_FILE = 'A0_DD_6C_0F_99_C8.csv'      # Path to your input data: .csv, .bin or a capture manifest
+STREAM = 'merged'              # For a manifest: 'merged', or one MAC (e.g. 'A0:DD:6C:0F:99:C8') with OUTPUT_LAYOUT = 'by_mac'
 OUTPUT_CSV = 'occupancy_output.csv'  # Path to save detection results
-THRESHOLD = 0.8                # STI threshold for occupancy
+THRESHOLD = 0.8                # STI threshold for occupancy (sti.THRESHOLD, tune with sti_sweep.py)
 PLOT_INTERVAL_MS = 10_000      # Interval to plot STI (20 seconds in ms)
 
-# Utility: parse CSI string to numpy array
-def parse_csi(csi_str):
-    try:
-        raw = ast.literal_eval(csi_str)
-        return np.array(raw, dtype=float)
-    except (ValueError, SyntaxError) as e:
-        print(f'Failed to parse CSI: {e}')
-        return None
-
-# Utility: compute normalized (translated + scaled) CSI vector
-def normalize_csi(vec):
-    mean = np.mean(vec)
-    shifted = vec - mean
-    sigma = np.linalg.norm(shifted)
-    return shifted if sigma == 0 else shifted / sigma
-
-# Load all CSI entries from CSV into memory (fast batch processing)
+# Load the capture as arrays: macs (list), timestamps (list of float), CSI matrix (N, L)
 def load_entries(path):
-    entries = []
-    with open(path, 'r', newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            csi_vec = parse_csi(row['CSI'])
-            if csi_vec is not None:
-                entries.append({
-                    'mac': row['mac'],
-                    'timestamp': float(row['timestamp_real_ms']),
-                    'csi': csi_vec
-                })
-    return entries
+    # Parsed capture is cached next to the CSV (capture_cache.py); malformed rows are skipped.
+    # A manifest joins every segment of the stream (com_readv5.py writes _partNNN files)
+    data_df, csi, valid = load_capture(path, csi_col='CSI', stream=STREAM)
+    if not valid.all():
+        print(f'Failed to parse CSI: {np.count_nonzero(~valid)} rows skipped')
+    macs = data_df['mac'].to_numpy()[valid].tolist()
+    timestamps = data_df['timestamp_real_ms'].to_numpy(dtype=float)[valid].tolist()
+    return macs, timestamps, csi[valid]
 
 # Main occupancy detection and periodic plotting
 def run():
-    entries = load_entries(CSV_FILE)
-    prev_norm = None
-
-    # Prepare output CSV
-    with open(OUTPUT_CSV, 'w', newline='') as out_file:
-        writer = csv.writer(out_file)
-        writer.writerow(['mac', 'timestamp_real_ms', 'sti', 'occupancy'])
-
-    # Initialize plotting window
-    window_start_ts = entries[0]['timestamp'] if entries else 0
-    window_timestamps = []
-    window_sti = []
-
-
-
-    # Process entries
-    for entry in entries:
-        current_norm = normalize_csi(entry['csi'])
-        if prev_norm is not None:
-            sti = np.linalg.norm(current_norm - prev_norm)
-            # Record occupancy detections
-            if sti > THRESHOLD:
-                with open(OUTPUT_CSV, 'a', newline='') as out_file:
-                    writer = csv.writer(out_file)
-                    writer.writerow([
-                        entry['mac'],
-                        entry['timestamp'],
-                        round(float(sti), 4),
-                        True
-                    ])
-            else:
-                with open(OUTPUT_CSV, 'a', newline='') as out_file:
-                    writer = csv.writer(out_file)
-                    writer.writerow([
-                        entry['mac'],
-                        entry['timestamp'],
-                        round(float(sti), 4),
-                        False
-                    ])
-            # Append to current window
-            window_timestamps.append(entry['timestamp'])
-            window_sti.append(float(sti))
-
-            # Check if it's time to plot
-            if entry['timestamp'] - window_start_ts >= PLOT_INTERVAL_MS:
-                # Plot STI over the last interval
-                plt.figure(figsize=(14, 7))
-                plt.grid(True)
-                # convert ms to seconds relative to window
-                times_sec = [(ts - window_start_ts) / 1000.0 for ts in window_timestamps]
-                plt.plot(times_sec, window_sti)
-                plt.title(f'STI from {window_start_ts}ms to {entry["timestamp"]}ms')
-                plt.xlabel('Time (s)')
-                plt.ylabel('STI')
-                fname = f'sti_{int(window_start_ts)}_{int(entry["timestamp"])}.png'
-                plt.savefig(fname)
-                plt.close()
-                # print(f'Plot saved: {fname}')
-
-                # Reset window
-                window_start_ts = entry['timestamp']
-                window_timestamps.clear()
-                window_sti.clear()
-            Check if it's time to plot
-
-            
-            
-        prev_norm = current_norm
+    macs, timestamps, csi = load_entries(CSV_FILE)
+
+    # STI for the whole matrix at once (sti.py); row k compares with row k - 1
+    sti, occupied = sti_series(csi, THRESHOLD)
+    write_sti_csv(OUTPUT_CSV, macs[1:], timestamps[1:], sti, occupied)
+
+    # Plot STI for each completed interval
+    for window_start_ts, lo, hi in plot_windows(timestamps, PLOT_INTERVAL_MS):
+        window_end_ts = timestamps[hi - 1]
+        plt.figure(figsize=(14, 7))
+        plt.grid(True)
+        # convert ms to seconds relative to window
+        times_sec = (np.asarray(timestamps[lo:hi]) - window_start_ts) / 1000.0
+        plt.plot(times_sec, sti[lo - 1:hi - 1])
+        plt.title(f'STI from {window_start_ts}ms to {window_end_ts}ms')
+        plt.xlabel('Time (s)')
+        plt.ylabel('STI')
+        fname = f'sti_{int(window_start_ts)}_{int(window_end_ts)}.png'
+        plt.savefig(fname)
+        plt.close()
+        # print(f'Plot saved: {fname}')
 
     print(f'Processing complete: results saved to {OUTPUT_CSV}')
 
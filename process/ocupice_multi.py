@@ -0,0 +1,75 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from csi_tensor import load_csi
+from sti import fuse_grid, sti_by_mac, write_sti_csv
+
+# Configuration
+CAPTURE_FILE = 'csi_data_20250508_141303.csv'   # Whole capture with every whitelisted MAC (.csv or .bin)
+                                                # Each (MAC, port) pair is its own link, labelled MAC@port for multi-port captures
+OUTPUT_CSV = 'occupancy_output.csv'             # Per-packet STI of every link
+FUSED_CSV = 'occupancy_fused.csv'               # One fused decision per grid cell
+THRESHOLD = 0.8                # STI threshold for occupancy (sti.THRESHOLD)
+GRID_MS = 500                  # Common time grid; each link contributes its max STI in the cell
+FUSION = 'vote'                # 'vote': share of links above THRESHOLD >= QUORUM, 'weighted': weighted mean STI > THRESHOLD
+QUORUM = 0.5
+WEIGHTS = {}                   # e.g. {'A0:DD:6C:0F:99:C8': 2.0} (every port of that MAC) or {'A0:DD:6C:0F:99:C8@1': 2.0}; others weigh 1
+PLOT_INTERVAL_MS = 10_000      # Interval per plot, 0 to skip plotting
+
+def plot_fused(grid_ts, sti_grid, score, fused, links):
+    bins_per_plot = max(PLOT_INTERVAL_MS // GRID_MS, 1)
+    for lo in range(0, len(grid_ts) - bins_per_plot + 1, bins_per_plot):
+        hi = lo + bins_per_plot
+        times_sec = (grid_ts[lo:hi] - grid_ts[lo]) / 1000.0
+        fig, (ax_sti, ax_fused) = plt.subplots(2, 1, figsize=(14, 9), sharex=True)
+        for m, link in enumerate(links):
+            ax_sti.plot(times_sec, sti_grid[lo:hi, m], label=link)
+        ax_sti.axhline(THRESHOLD, color='k', linestyle='--')
+        ax_sti.set_ylabel('STI (max per cell)')
+        ax_sti.legend(fontsize=7)
+        ax_sti.grid(True)
+        ax_fused.plot(times_sec, score[lo:hi], label=f'{FUSION} score')
+        ax_fused.fill_between(times_sec, 0, fused[lo:hi], step='mid', alpha=0.3, label='occupied')
+        ax_fused.set_xlabel('Time (s)')
+        ax_fused.legend()
+        ax_fused.grid(True)
+        window_end_ts = grid_ts[hi - 1] + GRID_MS
+        fig.suptitle(f'Fused occupancy from {grid_ts[lo]}ms to {window_end_ts}ms')
+        plt.savefig(f'fused_{grid_ts[lo]}_{window_end_ts}.png')
+        plt.close(fig)
+
+# All links of one capture in a single pass, then fuse them on a common time grid
+def run(path=CAPTURE_FILE):
+    t0 = time.perf_counter()
+    links, link_idx, ts, csi = load_csi(path)
+    t_load = time.perf_counter() - t0
+
+    # Per-link STI (each packet vs the previous packet of the same MAC on the same port), vectorized over all links
+    sti = sti_by_mac(link_idx, csi)
+    has_sti = ~np.isnan(sti)
+    write_sti_csv(OUTPUT_CSV, np.asarray(links)[link_idx[has_sti]], ts[has_sti], sti[has_sti], sti[has_sti] > THRESHOLD)
+
+    weights = [WEIGHTS.get(link, WEIGHTS.get(link.split('@')[0], 1.0)) for link in links]
+    grid_ts, sti_grid, score, fused = fuse_grid(link_idx, ts, sti, len(links), GRID_MS, THRESHOLD,
+                                                mode=FUSION, quorum=QUORUM, weights=weights)
+    fused_df = pd.DataFrame(np.round(sti_grid, 4), columns=links)
+    fused_df.insert(0, 'timestamp_real_ms', grid_ts)
+    fused_df['n_devices'] = (~np.isnan(sti_grid)).sum(axis=1)
+    fused_df['score'] = np.round(score, 4)
+    fused_df['occupancy'] = fused
+    fused_df.to_csv(FUSED_CSV, index=False)
+    t_sti = time.perf_counter() - t0 - t_load
+
+    if PLOT_INTERVAL_MS:
+        plot_fused(grid_ts, sti_grid, score, fused, links)
+
+    print(f'{len(links)} links, {len(ts)} packets: load {t_load:.2f}s, STI + fusion {t_sti:.2f}s')
+    print(f'Occupied in {fused.mean():.1%} of {len(grid_ts)} cells of {GRID_MS}ms')
+    print(f'Processing complete: results saved to {OUTPUT_CSV} and {FUSED_CSV}')
+
+if __name__ == '__main__':
+    run(sys.argv[1] if len(sys.argv) > 1 else CAPTURE_FILE)
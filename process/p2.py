@@ -1,21 +1,13 @@
 import os
-import csv, ast
+import csv
 import numpy as np
 import matplotlib.pyplot as plt
 
-# Hàm lọc subcarriers đã cho
-def filter_csi_raw(raw_list, null_subcarriers=None):
-    sub_ids = list(range(0, 32)) + list(range(-32, 0))
-    if null_subcarriers is None:
-        null_subcarriers = [-32, -31, -30, -29, -28, -27, 0,
-                             27, 28, 29, 30, 31]
-    remove_set = set(null_subcarriers)
-    filtered = []
-    for idx, sc in enumerate(sub_ids):
-        if sc in remove_set:
-            continue
-        filtered.extend([raw_list[2*idx], raw_list[2*idx + 1]])
-    return filtered
+from csi_layout import get_layout
+from csi_parse import parse_csi_column
+
+# Bố cục 64-FFT, bỏ guard band + DC -> 52 subcarrier (xem csi_layout.LAYOUTS)
+LAYOUT = get_layout('fft64')
 
 # Đường dẫn gốc input và output
 input_root = "process/old"
@@ -37,17 +29,15 @@ for root, dirs, files in os.walk(input_root):
         with open(input_path, 'r') as f:
             reader = csv.reader(f)
             headers = next(reader)  # nếu có header, hãy sửa nếu không có
-            for row in reader:
+            rows = list(reader)
+        # row[3] là chuỗi CSI dưới dạng "[re0,im0,re1,im1,...]", parse cả cột một lần
+        csi_vals, csi_ok = parse_csi_column([row[3] for row in rows])
+        # Lọc subcarriers null và tính biên độ 52 kênh cho cả file một lần
+        amp_all = LAYOUT.amplitude(csi_vals)
+        for row, amplitude, ok in zip(rows, amp_all, csi_ok):
+            if ok:
                 mac = row[0]
                 timestamp = int(row[1])
-                # row[3] là chuỗi CSI dưới dạng "[re0,im0,re1,im1,...]"
-                raw_list = ast.literal_eval(row[3])
-                # Lọc subcarriers null
-                filtered = filter_csi_raw(raw_list)
-                # Tính biên độ 52 kênh
-                arr = np.array(filtered).reshape(-1, 2)
-                re = arr[:, 0]; im = arr[:, 1]
-                amplitude = np.sqrt(re**2 + im**2)
                 # Nhóm theo MAC
                 data_by_mac.setdefault(mac, []).append((timestamp, amplitude))
 
@@ -1,28 +1,20 @@
 import pandas as pd
 import os
 import re
-import ast
 import numpy as np
 import matplotlib.pyplot as plt
 
+from capture_cache import load_capture
+from csi_layout import get_layout
+from label_segments import segment_labels
+
 
 def sanitize(name: str) -> str:
     return re.sub(r'[^A-Za-z0-9\-_\.]+', '_', name)
 
 
-def filter_csi_raw(raw_list, null_subcarriers=None):
-    # Lọc trực tiếp trên raw_list (128 giá trị Re/Im)
-    sub_ids = list(range(0, 31)) + list(range(-32, -1))
-    if null_subcarriers is None:
-        # null_subcarriers = [-32, -31, -30, -29, -28, -27, 0, 27, 28, 29, 30, 31]
-        null_subcarriers = [-32, -31, -30, -29, -21, -7, 0, 7, 21, 29, 30, 31]
-    remove_set = set(null_subcarriers)
-    filtered = []
-    for idx, sc in enumerate(sub_ids):
-        if sc in remove_set:
-            continue
-        filtered.extend([raw_list[2*idx], raw_list[2*idx + 1]])
-    return filtered
+# Bố cục subcarrier (xem csi_layout.LAYOUTS)
+LAYOUT = get_layout('ht20_pilots')
 
 # def filter_csi_raw(raw_list, null_subcarriers=None):
 #     """
@@ -64,7 +56,7 @@ print("✅ Bắt đầu xử lý dữ liệu CSI...")
 os.makedirs('plot', exist_ok=True)
 
 # Đọc dữ liệu
-data_df = pd.read_csv('csi_data_20250508_101047.csv')
+data_df, csi_vals, csi_ok = load_capture('csi_data_20250508_101047.csv')
 timestamp_df = pd.read_csv('timestamps.csv')
 
 data_df['timestamp_real_ms'] = pd.to_datetime(data_df['timestamp_real_ms'], unit='ms')
@@ -72,13 +64,11 @@ timestamp_df['start_utc_ms'] = pd.to_datetime(timestamp_df['start_utc_ms'], unit
 timestamp_df['end_utc_ms'] = pd.to_datetime(timestamp_df['end_utc_ms'], unit='ms')
 
 # Tìm cột CSI và lọc
-csi_col = next(col for col in data_df.columns 
-               if data_df[col].dtype == object 
-               and data_df[col].str.strip().str.startswith('[').any())
-print(f"- Cột CSI được phát hiện: {csi_col}")
-
-data_df[csi_col] = data_df[csi_col].apply(lambda s: filter_csi_raw(ast.literal_eval(s)))
-post_len = len(data_df[csi_col].iloc[0])
+if not csi_ok.all():
+    print(f"- Bỏ {np.count_nonzero(~csi_ok)} dòng CSI không parse được")
+data_df = data_df[csi_ok].copy()
+filtered = LAYOUT.filter(csi_vals[csi_ok], dtype=np.int64)
+post_len = filtered.shape[1]
 print(f"- Độ dài raw_list sau lọc: {post_len} (mong muốn 104)")
 
 # Mở rộng thành cột Re và Im
@@ -87,24 +77,17 @@ cols = []
 for i in range(n_pairs):
     cols += [f'subcarrier_{i}_Re', f'subcarrier_{i}_Im']
     
-csi_expanded = pd.DataFrame(data_df[csi_col].tolist(), index=data_df.index, columns=cols)
-data_df = pd.concat([data_df.drop(columns=[csi_col]), csi_expanded], axis=1)
+csi_expanded = pd.DataFrame(filtered, index=data_df.index, columns=cols)
+data_df = pd.concat([data_df, csi_expanded], axis=1)
 
 # Xử lý từng sample
-sample_counters = {}
-for _, row in timestamp_df.iterrows():
-    start, end = row['start_utc_ms'], row['end_utc_ms']
-    location, label = str(row['location']), str(row['label'])
-    sample_id = sample_counters.get((label, location), 1)
-    sample_counters[(label, location)] = sample_id + 1
-
-    # Lọc dữ liệu theo thời gian
-    mask = (data_df['timestamp_real_ms'] >= start) & (data_df['timestamp_real_ms'] <= end)
-    sliced = data_df.loc[mask]
-    # print(f"Sample {sample_id}: {label}/{location}, rows: {len(sliced)}")
-
-    # Danh sách devices
-    devices = list(sliced.groupby('mac'))
+# Cắt theo nhãn: xếp dữ liệu một lần, mỗi nhãn lấy đoạn dòng bằng searchsorted (label_segments.py)
+samples = segment_labels(data_df, timestamp_df, 'timestamp_real_ms')
+for sample in samples:
+    label, location, sample_id = sample.label, sample.location, sample.sample_id
+    # print(f"Sample {sample_id}: {label}/{location}, rows: {sum(len(grp) for _, grp in sample.devices)}")
+
+    devices = sample.devices  # list of (mac, DataFrame), theo thứ tự mac
 
     # Tạo figure với 3 hàng 2 cột
     fig, axes = plt.subplots(3, 2, figsize=(80, 20))
@@ -1,28 +1,21 @@
 import pandas as pd
 import os
 import re
-import ast
 import numpy as np
 import matplotlib.pyplot as plt
 
+from capture_cache import load_capture
+from csi_layout import get_layout
+from label_segments import SampleWriter, segment_labels
+
 
 def sanitize(name: str) -> str:
     return re.sub(r'[^A-Za-z0-9\-_\.]+', '_', name)
 
 
-def filter_csi_raw(raw_list, null_subcarriers=None):
-    # Lọc trực tiếp trên raw_list (128 giá trị Re/Im)
-    sub_ids = list(range(0, 31)) + list(range(-32, -1))
-    if null_subcarriers is None:
-        # null_subcarriers = [-32, -31, -30, -29, -28, -27, 0, 27, 28, 29, 30, 31]
-        null_subcarriers = [-32, -31, -30, -29, -21, -7, 0, 7, 21, 29, 30, 31]
-    remove_set = set(null_subcarriers)
-    filtered = []
-    for idx, sc in enumerate(sub_ids):
-        if sc in remove_set:
-            continue
-        filtered.extend([raw_list[2*idx], raw_list[2*idx + 1]])
-    return filtered
+# Bố cục subcarrier (xem csi_layout.LAYOUTS)
+LAYOUT = get_layout('ht20_pilots')
+
 # def filter_csi_raw(raw_list, null_subcarriers=None):
 #     """
 #     raw_list: list of int8 values, length >= 128
@@ -58,20 +51,18 @@ def filter_csi_raw(raw_list, null_subcarriers=None):
 # ---------------- Main Script ----------------
 print("✅ Bắt đầu xử lý dữ liệu CSI...")
 
-data_df = pd.read_csv('csi_data_20250508_101047.csv')
+data_df, csi_vals, csi_ok = load_capture('csi_data_20250508_101047.csv')
 timestamp_df = pd.read_csv('timestamps.csv')
 
 data_df['timestamp_real_ms'] = pd.to_datetime(data_df['timestamp_real_ms'], unit='ms')
 timestamp_df['start_utc_ms'] = pd.to_datetime(timestamp_df['start_utc_ms'], unit='ms')
 timestamp_df['end_utc_ms'] = pd.to_datetime(timestamp_df['end_utc_ms'], unit='ms')
 
-csi_col = next(col for col in data_df.columns 
-               if data_df[col].dtype == object 
-               and data_df[col].str.strip().str.startswith('[').any())
-print(f"- Cột CSI được phát hiện: {csi_col}")
-
-data_df[csi_col] = data_df[csi_col].apply(lambda s: filter_csi_raw(ast.literal_eval(s)))
-post_len = len(data_df[csi_col].iloc[0])
+if not csi_ok.all():
+    print(f"- Bỏ {np.count_nonzero(~csi_ok)} dòng CSI không parse được")
+data_df = data_df[csi_ok].copy()
+filtered = LAYOUT.filter(csi_vals[csi_ok], dtype=np.int64)
+post_len = filtered.shape[1]
 print(f"- Độ dài raw_list sau lọc: {post_len} (mong muốn 104)")
 
 # Mở rộng thành cột Re và Im
@@ -79,31 +70,27 @@ n_pairs = post_len // 2
 cols = []
 for i in range(n_pairs):
     cols += [f'subcarrier_{i}_Re', f'subcarrier_{i}_Im']
-csi_expanded = pd.DataFrame(data_df[csi_col].tolist(), index=data_df.index, columns=cols)
-data_df = pd.concat([data_df.drop(columns=[csi_col]), csi_expanded], axis=1)
+csi_expanded = pd.DataFrame(filtered, index=data_df.index, columns=cols)
+data_df = pd.concat([data_df, csi_expanded], axis=1)
 
 # Xử lý từng sample
-sample_counters = {}
-for _, row in timestamp_df.iterrows():
-    start, end = row['start_utc_ms'], row['end_utc_ms']
-    location, label = str(row['location']), str(row['label'])
-    sample_id = sample_counters.get((label, location), 1)
-    sample_counters[(label, location)] = sample_id + 1
+# Cắt theo nhãn: xếp dữ liệu một lần, mỗi nhãn lấy đoạn dòng bằng searchsorted (label_segments.py)
+samples = segment_labels(data_df, timestamp_df, 'timestamp_real_ms')
+writer = SampleWriter()  # ghi CSV trên nhóm luồng, vẽ ở luồng chính
+for sample in samples:
+    label, location, sample_id = sample.label, sample.location, sample.sample_id
     sample_folder = os.path.join(sanitize(label), sanitize(location), f'sample{sample_id}')
     os.makedirs(sample_folder, exist_ok=True)
 
-    mask = (data_df['timestamp_real_ms'] >= start) & (data_df['timestamp_real_ms'] <= end)
-    sliced = data_df.loc[mask]
-    print(f"Sample {sample_id}: {label}/{location}, rows: {len(sliced)}")
+    print(f"Sample {sample_id}: {label}/{location}, rows: {sum(len(grp) for _, grp in sample.devices)}")
 
-    # Danh sách devices
-    devices = list(sliced.groupby('mac'))
+    devices = sample.devices  # list of (mac, DataFrame), theo thứ tự mac
 
     # Vẽ biểu đồ biên độ theo thời gian cho mỗi device riêng biệt
     for mac, grp in devices:
         safe_mac = sanitize(mac)
         csv_f = os.path.join(sample_folder, f'{safe_mac}.csv')
-        grp.to_csv(csv_f, index=False)
+        writer.write(grp, csv_f)
         print(f"  - {mac}: {len(grp)} rows -> {csv_f}")
 
         timestamps = grp['timestamp_real_ms']
@@ -143,4 +130,5 @@ for _, row in timestamp_df.iterrows():
     fig.savefig(img_heat)
     plt.close(fig)
 
+writer.close()
 print("✅ Hoàn thành tất cả bước xử lý và vẽ CSI.")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gán dòng CSI vào lưới thời gian đều, không dùng lại một dòng hai lần
+(quy tắc của #2_nearest_v2_khong_gan_lap_lai.py).
+
+Với mỗi điểm lưới t: lấy dòng đầu tiên có timestamp >= t; nếu dòng đó đã được gán thì lấy
+dòng kế tiếp khi nó cách t không quá tol_ms, ngược lại bỏ điểm lưới này.
+
+Các dòng đã gán KHÔNG liền nhau (nhiều dòng giữa hai điểm lưới bị bỏ qua), nên "chỉ số <= last"
+không có nghĩa là đã dùng. Vòng hai con trỏ dựa vào hai điều khác, với last là dòng gán gần nhất:
+ - idx (dòng đầu tiên >= t) không giảm theo t, dòng được chọn là idx hoặc idx + 1 và tăng ngặt,
+   nên mọi dòng đã dùng đều <= last;
+ - vì vậy trong hai ứng viên idx, idx + 1 chỉ có thể trùng last, hoặc last - 1 khi lần trước đã
+   lấy idx + 1 (khi đó idx = last - 1 và cả hai ứng viên đều đã dùng -> bỏ điểm lưới).
+Nên thay cho set() chỉ cần so idx với last: idx > last thì idx chưa dùng, idx == last thì chỉ
+còn idx + 1, idx < last thì không còn ứng viên. Mỗi MAC là một lượt hai con trỏ.
+
+Kiểm tra khớp với cách làm cũ:
+    python snap_grid.py check                              # dữ liệu tổng hợp
+    python snap_grid.py check in.csv                       # so với cách cũ chạy trên in.csv
+    python snap_grid.py check in.csv old_output.csv        # so với file do script cũ xuất ra
+"""
+import io
+import sys
+
+import numpy as np
+import pandas as pd
+
+GRID_STEP_MS = 10
+TOLERANCE_MS = 20
+
+
+def snap_no_reuse(source_times, grid, tol_ms: int = TOLERANCE_MS):
+    """
+    source_times: timestamp đã xếp tăng của một MAC; grid: các điểm lưới tăng dần.
+    Trả về (chỉ số dòng được chọn, điểm lưới tương ứng).
+    """
+    n = len(source_times)
+    starts = np.searchsorted(source_times, grid, side='left')
+    times = source_times.tolist()
+    take = []
+    grid_out = []
+    last = -1
+    for t, idx in zip(grid.tolist(), starts.tolist()):
+        if idx >= n:
+            break
+        if idx > last:
+            chosen = idx
+        elif idx == last and idx + 1 < n and times[idx + 1] - t <= tol_ms:
+            chosen = idx + 1
+        else:
+            continue
+        take.append(chosen)
+        grid_out.append(t)
+        last = chosen
+    return np.array(take, dtype=np.intp), np.array(grid_out, dtype=np.int64)
+
+
+def snap_frame(df, step_ms: int = GRID_STEP_MS, tol_ms: int = TOLERANCE_MS):
+    """Áp dụng snap_no_reuse cho mọi MAC; trả về DataFrame cùng cột, timestamp_real_ms theo lưới."""
+    df = df.sort_values(['mac', 'timestamp_real_ms'], kind='stable').reset_index(drop=True)
+    grid = np.arange(df['timestamp_real_ms'].min(), df['timestamp_real_ms'].max() + 1, step_ms)
+    all_times = df['timestamp_real_ms'].values
+    macs = df['mac'].values
+    bounds = np.flatnonzero(macs[1:] != macs[:-1]) + 1
+    take_parts = []
+    grid_parts = []
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(df)]):
+        take, grid_out = snap_no_reuse(all_times[lo:hi], grid, tol_ms)
+        take_parts.append(lo + take)
+        grid_parts.append(grid_out)
+    out = df.take(np.concatenate(take_parts) if take_parts else np.zeros(0, dtype=np.intp))
+    out['timestamp_real_ms'] = np.concatenate(grid_parts) if grid_parts else []
+    return out.reset_index(drop=True)
+
+
+def snap_frame_reference(df, step_ms: int = GRID_STEP_MS, tol_ms: int = TOLERANCE_MS):
+    """Cách làm cũ (set các chỉ số đã dùng, tra từng dòng bằng .loc), giữ lại để đối chiếu."""
+    df = df.sort_values(['mac', 'timestamp_real_ms'], kind='stable').reset_index(drop=True)
+    grid_timestamps = np.arange(df['timestamp_real_ms'].min(), df['timestamp_real_ms'].max() + 1, step_ms)
+    result_rows = []
+    for mac, group in df.groupby('mac'):
+        group = group.sort_values('timestamp_real_ms', kind='stable').reset_index(drop=True)
+        used_index = set()
+        idx = 0
+        for t in grid_timestamps:
+            while idx < len(group) and group.loc[idx, 'timestamp_real_ms'] < t:
+                idx += 1
+            if idx >= len(group):
+                break
+            chosen_idx = idx
+            if chosen_idx in used_index:
+                next_idx = chosen_idx + 1
+                if next_idx < len(group):
+                    next_ts = group.loc[next_idx, 'timestamp_real_ms']
+                    if next_ts - t > tol_ms:
+                        chosen_idx = idx
+                    else:
+                        chosen_idx = next_idx
+                else:
+                    continue
+            if chosen_idx >= len(group):
+                continue
+            if chosen_idx not in used_index:
+                row = group.loc[chosen_idx].copy()
+                if row['timestamp_real_ms'] >= t:
+                    row['timestamp_real_ms'] = t
+                    result_rows.append(row)
+                    used_index.add(chosen_idx)
+    return pd.DataFrame(result_rows).reset_index(drop=True)
+
+
+def _synthetic(n_rows: int = 20_000, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    macs = np.array(['34:86:5D:39:A5:5C', 'A0:A3:B3:2F:49:C4', '44:17:93:7C:43:B0'])
+    mac = macs[rng.integers(0, len(macs), n_rows)]
+    steps = rng.choice([0, 1, 3, 7, 9, 10, 10, 10, 11, 13, 25, 60], n_rows)
+    ts = np.zeros(n_rows, dtype=np.int64)
+    for m in macs:
+        sel = mac == m
+        ts[sel] = 1_000 + np.cumsum(steps[sel])
+    return pd.DataFrame({'mac': mac, 'timestamp_real_ms': ts, 'CSI': [f'[{i}, 1]' for i in range(n_rows)]})
+
+
+def check(input_file=None, reference_file=None, step_ms: int = GRID_STEP_MS, tol_ms: int = TOLERANCE_MS):
+    """So snap_frame với cách cũ; trả về True nếu khớp hoàn toàn."""
+    df = pd.read_csv(input_file) if input_file else _synthetic()
+    new = snap_frame(df, step_ms, tol_ms)
+    if reference_file:
+        ref = pd.read_csv(reference_file)
+        new = pd.read_csv(io.StringIO(new.to_csv(index=False)))  # cùng kiểu dữ liệu như khi đọc CSV
+    else:
+        ref = snap_frame_reference(df, step_ms, tol_ms)
+    same = len(new) == len(ref) and list(new.columns) == list(ref.columns) and \
+        all((new[c].astype(str).values == ref[c].astype(str).values).all() for c in ref.columns)
+    print(f"{'✅' if same else '❌'} {len(new)} dòng mới / {len(ref)} dòng theo cách cũ")
+    return same
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'check':
+        print("Cách dùng: python snap_grid.py check [in.csv [old_output.csv]]")
+        sys.exit(1)
+    sys.exit(0 if check(*sys.argv[2:4]) else 1)
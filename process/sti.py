@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+STI (short-term instability) cho phát hiện có người, tính trên cả ma trận CSI (N, L) một lần.
+
+Mỗi dòng được chuẩn hoá: trừ trung bình của dòng rồi chia cho chuẩn L2 (dòng hằng số giữ là
+vector 0); STI của dòng k là ||norm[k] - norm[k - 1]||, dòng đầu không có STI.
+
+    from sti import sti_series, write_sti_csv
+    sti, occupied = sti_series(csi)                       # (N - 1,), cho các dòng 1..N-1
+    write_sti_csv('occupancy_output.csv', macs[1:], timestamps[1:], sti, occupied)
+
+Kết quả và file ra giống vòng lặp cũ của ocupice.py (normalize_csi + ghi từng dòng).
+
+Nhiều thiết bị trong một file thu (ocupice_multi.py):
+    links, link_idx, ts, csi = load_csi(path)  # csi_tensor.py, mỗi link là một cặp (MAC, cổng)
+    sti = sti_by_mac(link_idx, csi)       # (N,), so với gói trước của cùng link, NaN ở gói đầu
+    grid_ts, sti_grid, score, fused = fuse_grid(link_idx, ts, sti, len(links), grid_ms=500)
+"""
+import csv
+
+import numpy as np
+
+THRESHOLD = 0.8
+BLOCK_ROWS = 262_144   # số dòng xử lý mỗi khối (giới hạn bộ nhớ tạm float64)
+
+
+def normalize_rows(csi):
+    """Trừ trung bình và chia chuẩn L2 theo từng dòng; trả về mảng float64 mới."""
+    shifted = np.asarray(csi, dtype=np.float64)
+    shifted = shifted - shifted.mean(axis=1, keepdims=True)
+    sigma = np.linalg.norm(shifted, axis=1, keepdims=True)
+    return shifted / np.where(sigma == 0, 1.0, sigma)
+
+
+def sti_series(csi, threshold: float = THRESHOLD, block_rows: int = BLOCK_ROWS):
+    """csi: (N, L). Trả về (sti (N - 1,) float64, occupied (N - 1,) bool = sti > threshold)."""
+    n = len(csi)
+    sti = np.empty(max(n - 1, 0), dtype=np.float64)
+    prev = None
+    for lo in range(0, n, block_rows):
+        cur = normalize_rows(csi[lo:lo + block_rows])
+        if prev is not None:
+            sti[lo - 1] = np.linalg.norm(cur[0] - prev)
+        sti[lo:lo + len(cur) - 1] = np.linalg.norm(np.diff(cur, axis=0), axis=1)
+        prev = cur[-1]
+    return sti, sti > threshold
+
+
+def sti_by_mac(mac_idx, csi, block_rows: int = BLOCK_ROWS, port=None):
+    """
+    STI của mọi MAC trong một lượt: xếp ổn định theo MAC (giữ thứ tự dòng trong từng MAC, như
+    file tách theo MAC mà ocupice.py đọc), tính như sti_series rồi trả về theo thứ tự dòng gốc.
+    port (theo dòng): nếu có thì nhóm theo (MAC, cổng), không so CSI của cùng TX nghe qua hai cổng;
+    link_idx của csi_tensor.load_csi đã gồm cổng nên không cần truyền.
+    Trả về sti (N,) float64; NaN ở gói đầu tiên của mỗi nhóm.
+    """
+    mac_idx = np.asarray(mac_idx, dtype=np.int64)
+    if port is not None:
+        mac_idx = mac_idx * 256 + np.asarray(port, dtype=np.int64)
+    order = np.argsort(mac_idx, kind='stable')
+    mac_sorted = mac_idx[order]
+    sti = np.full(len(order), np.nan)
+    prev = None
+    for lo in range(0, len(order), block_rows):
+        rows = order[lo:lo + block_rows]
+        cur = normalize_rows(csi[rows])
+        if prev is not None and mac_sorted[lo] == mac_sorted[lo - 1]:
+            sti[rows[0]] = np.linalg.norm(cur[0] - prev)
+        same = mac_sorted[lo + 1:lo + len(rows)] == mac_sorted[lo:lo + len(rows) - 1]
+        sti[rows[1:][same]] = np.linalg.norm(np.diff(cur, axis=0), axis=1)[same]
+        prev = cur[-1]
+    return sti
+
+
+def fuse_grid(mac_idx, timestamps, sti, n_macs: int, grid_ms: int, threshold: float = THRESHOLD,
+              mode: str = 'vote', quorum: float = 0.5, weights=None):
+    """
+    Đưa STI của các MAC về lưới thời gian chung (ô grid_ms, lấy STI lớn nhất của MAC trong ô)
+    rồi gộp thành một quyết định cho mỗi ô:
+     - 'vote':     tỉ lệ MAC có mặt trong ô có STI > threshold, có người nếu >= quorum
+     - 'weighted': trung bình STI có trọng số (weights theo MAC, mặc định 1), có người nếu > threshold
+    MAC không có gói trong ô thì không tính. Trả về (grid_ts (T,), sti_grid (T, n_macs) NaN nếu
+    không có gói, score (T,), fused (T,) bool); ô không có MAC nào có score NaN, fused False.
+    """
+    ok = ~np.isnan(sti)
+    mac_idx = np.asarray(mac_idx)[ok]
+    ts = np.asarray(timestamps, dtype=np.int64)[ok]
+    sti = np.asarray(sti)[ok]
+    if not len(sti):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, n_macs)), np.zeros(0), np.zeros(0, dtype=bool)
+    t0 = ts.min()
+    n_bins = int((ts.max() - t0) // grid_ms) + 1
+    key = (ts - t0) // grid_ms * n_macs + mac_idx
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    sti_grid = np.full(n_bins * n_macs, np.nan)
+    sti_grid[key[starts]] = np.maximum.reduceat(sti[order], starts)
+    sti_grid = sti_grid.reshape(n_bins, n_macs)
+
+    present = ~np.isnan(sti_grid)
+    w = np.ones(n_macs) if weights is None else np.asarray(weights, dtype=np.float64)
+    w_present = present * w
+    total = w_present.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if mode == 'vote':
+            score = ((sti_grid > threshold) * w_present).sum(axis=1) / total
+            fused = score >= quorum
+        elif mode == 'weighted':
+            score = np.where(present, sti_grid, 0.0) @ w / total
+            fused = score > threshold
+        else:
+            raise ValueError(f"mode phải là 'vote' hoặc 'weighted', không phải {mode!r}")
+    fused &= total > 0
+    return t0 + np.arange(n_bins, dtype=np.int64) * grid_ms, sti_grid, score, fused
+
+
+def plot_windows(timestamps, interval_ms):
+    """
+    Chia các dòng 1..N-1 thành cửa sổ vẽ như ocupice.py: cửa sổ bắt đầu ở timestamp của dòng mở
+    cửa sổ, đóng ở dòng đầu tiên cách đó >= interval_ms (dòng này thuộc cửa sổ vừa đóng).
+    Trả về list (start_ts, lo, hi): dòng lo..hi-1 (chỉ số dòng gốc); cửa sổ cuối chưa đóng bị bỏ.
+    """
+    ts = list(timestamps)
+    windows = []
+    if not ts:
+        return windows
+    start_ts, lo = ts[0], 1
+    for k in range(1, len(ts)):
+        if ts[k] - start_ts >= interval_ms:
+            windows.append((start_ts, lo, k + 1))
+            start_ts, lo = ts[k], k + 1
+    return windows
+
+
+def write_sti_csv(path, macs, timestamps, sti, occupied):
+    """Ghi cả kết quả trong một lần mở file (header: mac, timestamp_real_ms, sti, occupancy)."""
+    with open(path, 'w', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(['mac', 'timestamp_real_ms', 'sti', 'occupancy'])
+        writer.writerows(zip(list(macs), list(timestamps), [round(v, 4) for v in np.asarray(sti).tolist()],
+                             np.asarray(occupied).tolist()))
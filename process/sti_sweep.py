@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Quét ngưỡng STI và debounce một lượt, chấm điểm theo khoảng nhãn của label.py (timestamps.csv).
+
+Thay cho việc sửa THRESHOLD trong ocupice.py, chạy lại cả script rồi nhìn ảnh sti_*.png:
+nhận STI đã tính sẵn (occupancy_output.csv của ocupice.py / ocupice_multi.py) và chấm cùng lúc
+hàng nghìn ngưỡng x vài giá trị enter_frames. Với occupancy_fused.csv của ocupice_multi.py (không
+có cột sti / mac) thì quét trên cột score của từng ô lưới: tỉ lệ link vượt ngưỡng (FUSION = 'vote',
+ngưỡng ở đây là quorum) hoặc STI trung bình có trọng số ('weighted').
+
+Quyết định giống OccupancyDetector (occupancy_stream.py) với exit_ms = 0: gói i là "có người"
+khi enter_frames gói liên tiếp tới i (của cùng luồng) đều có STI > ngưỡng, tức min trượt > ngưỡng.
+Với mỗi gói, c = số ngưỡng (đã xếp tăng) nhỏ hơn min trượt đó; gói dương với ngưỡng j khi j < c.
+Đếm c theo khoảng nhãn bằng bincount rồi cộng dồn ngược theo trục ngưỡng -> TP/FP của mọi ngưỡng.
+Độ trễ: cummax của c trong từng khoảng, gói đầu tiên có cummax > j là lúc phát hiện với ngưỡng j.
+
+Khoảng có label thuộc EMPTY_LABELS là không có người, các khoảng khác là có người; gói ngoài
+mọi khoảng không được tính. Các khoảng không được chồng lên nhau.
+
+Khoảng nhãn là giờ UTC của PC còn STI mang timestamp_real_ms của thiết bị: truyền --manifest
+(manifest của phiên thu, khoá "clock" do clock_model.py khớp) để đổi timestamp sang giờ PC trước
+khi chấm; không truyền thì hai đồng hồ được coi là trùng nhau. Không gói nào rơi vào khoảng nhãn
+nào (thường là do lệch đồng hồ) thì có cảnh báo và độ trễ là NaN.
+
+    python sti_sweep.py occupancy_output.csv timestamps.csv [mac] [--manifest csi_data_xxx_manifest.json]
+    python sti_sweep.py occupancy_fused.csv timestamps.csv          # cột score, không đổi đồng hồ
+    python sti_sweep.py check                                       # so với vòng lặp từng ngưỡng
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from clock_model import device_to_host, load_clock_model, segments_for
+
+THRESHOLDS = np.linspace(0.0, 2.0, 2001)   # STI của vector đã chuẩn hoá nằm trong [0, 2]
+ENTER_FRAMES = (1, 2, 3, 5, 8)
+EMPTY_LABELS = ('0',)
+OUTPUT_CSV = 'sti_sweep.csv'
+
+
+def trailing_min(sti, k: int):
+    """Min của k gói liên tiếp tới mỗi gói; -inf khi chưa đủ k gói (NaN coi như không vượt ngưỡng)."""
+    sti = np.where(np.isnan(sti), -np.inf, sti)
+    out = np.full(len(sti), -np.inf)
+    if len(sti) >= k:
+        out[k - 1:] = np.lib.stride_tricks.sliding_window_view(sti, k).min(axis=-1)
+    return out
+
+
+def assign_intervals(timestamps, starts, ends):
+    """Chỉ số khoảng (theo starts đã xếp tăng) chứa mỗi timestamp, -1 nếu ngoài mọi khoảng."""
+    k = np.searchsorted(starts, timestamps, side='right') - 1
+    inside = (k >= 0) & (timestamps <= ends[np.maximum(k, 0)])
+    return np.where(inside, k, -1)
+
+
+def sweep(timestamps, sti, intervals, thresholds=THRESHOLDS, enter_frames=ENTER_FRAMES,
+          empty_labels=EMPTY_LABELS):
+    """
+    timestamps, sti: một luồng (một MAC hoặc điểm đã gộp) theo thứ tự gói; intervals: DataFrame
+    start_utc_ms, end_utc_ms, label. Trả về DataFrame mỗi dòng một (enter_frames, threshold).
+    """
+    thresholds = np.sort(np.asarray(thresholds, dtype=np.float64))
+    n_thr = len(thresholds)
+    ts = np.asarray(timestamps, dtype=np.int64)
+    sti = np.asarray(sti, dtype=np.float64)
+
+    iv = intervals.sort_values('start_utc_ms')
+    starts = iv['start_utc_ms'].to_numpy(dtype=np.int64)
+    ends = iv['end_utc_ms'].to_numpy(dtype=np.int64)
+    positive = ~iv['label'].astype(str).isin([str(v) for v in empty_labels]).to_numpy()
+    n_iv = len(starts)
+
+    order = np.argsort(ts, kind='stable')
+    ts_sorted = ts[order]
+    iv_idx = assign_intervals(ts_sorted, starts, ends)
+    inside = iv_idx >= 0
+    ts_in, iv_in = ts_sorted[inside], iv_idx[inside]
+    if not len(ts_in):
+        warnings.warn(f"không có gói nào trong {n_iv} khoảng nhãn: kiểm tra đồng hồ thiết bị / PC (--manifest)")
+    n_packets = np.bincount(iv_in, minlength=n_iv)
+
+    rows = []
+    for k in enter_frames:
+        # c: số ngưỡng bị vượt (ngưỡng j < min trượt), theo thứ tự thời gian, chỉ gói trong khoảng
+        c = np.searchsorted(thresholds, trailing_min(sti, k), side='left')[order][inside]
+
+        # Số gói dương của từng (khoảng, ngưỡng j) = số gói có c > j
+        hist = np.bincount(iv_in * (n_thr + 1) + c, minlength=n_iv * (n_thr + 1)).reshape(n_iv, n_thr + 1)
+        above = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:]   # (n_iv, n_thr)
+        tp = above[positive].sum(axis=0)
+        fp = above[~positive].sum(axis=0)
+        fn = n_packets[positive].sum() - tp
+
+        # Lúc phát hiện: gói đầu tiên trong khoảng có cummax(c) > j (cummax theo từng khoảng nhờ offset)
+        offset = iv_in.astype(np.int64) * (n_thr + 2)
+        run_max = np.maximum.accumulate(c + offset)
+        pos_iv = np.flatnonzero(positive)
+        first = np.searchsorted(run_max, pos_iv[:, None] * (n_thr + 2) + np.arange(n_thr), side='right')
+        iv_end = np.searchsorted(iv_in, pos_iv, side='right')
+        detected = first < iv_end[:, None]
+        if len(ts_in):
+            latency = np.where(detected, ts_in[np.minimum(first, len(ts_in) - 1)] - starts[pos_iv][:, None], np.nan)
+        else:
+            latency = np.full(detected.shape, np.nan)
+
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)   # ngưỡng không phát hiện được khoảng nào: NaN
+            precision = tp / (tp + fp)
+            recall = tp / (tp + fn)
+            f1 = 2 * precision * recall / (precision + recall)
+            lat_med = np.nanmedian(latency, axis=0)
+            lat_p90 = np.nanpercentile(latency, 90, axis=0)
+            detected_share = detected.mean(axis=0)
+        rows.append(pd.DataFrame({
+            'enter_frames': k, 'threshold': thresholds, 'precision': precision, 'recall': recall, 'f1': f1,
+            'tp': tp, 'fp': fp, 'fn': fn,
+            'detected': detected_share,
+            'latency_ms_median': lat_med, 'latency_ms_p90': lat_p90,
+        }))
+    return pd.concat(rows, ignore_index=True)
+
+
+def _sweep_reference(timestamps, sti, intervals, thresholds, enter_frames, empty_labels=EMPTY_LABELS):
+    """Từng ngưỡng một: chạy quyết định từng gói như OccupancyDetector (exit_ms = 0)."""
+    ts = np.asarray(timestamps, dtype=np.int64)
+    empty = [str(v) for v in empty_labels]
+    rows = []
+    for k in enter_frames:
+        for thr in thresholds:
+            decision, above = [], 0
+            for v in sti:
+                above = above + 1 if v > thr else 0   # NaN: không vượt
+                decision.append(above >= k)
+            decision = np.array(decision)
+            tp = fp = fn = 0
+            latencies = []
+            for _, r in intervals.iterrows():
+                sel = (ts >= r['start_utc_ms']) & (ts <= r['end_utc_ms'])
+                hit = decision[sel]
+                if str(r['label']) in empty:
+                    fp += hit.sum()
+                    continue
+                tp += hit.sum()
+                fn += (~hit).sum()
+                if hit.any():
+                    latencies.append(np.sort(ts[sel][hit])[0] - r['start_utc_ms'])
+            rows.append((k, thr, tp, fp, fn, np.median(latencies) if latencies else np.nan))
+    return pd.DataFrame(rows, columns=['enter_frames', 'threshold', 'tp', 'fp', 'fn', 'latency_ms_median'])
+
+
+def check(n: int = 3000, seed: int = 0):
+    """So sweep với vòng lặp từng ngưỡng trên dữ liệu tổng hợp."""
+    rng = np.random.default_rng(seed)
+    ts = np.cumsum(rng.integers(5, 15, n))
+    intervals = pd.DataFrame({'start_utc_ms': np.arange(500, ts[-1] - 1500, 2000),
+                              'end_utc_ms': np.arange(500, ts[-1] - 1500, 2000) + 1200})
+    intervals['label'] = np.where(np.arange(len(intervals)) % 2, '0', '3')
+    iv_idx = assign_intervals(ts, intervals['start_utc_ms'].to_numpy(), intervals['end_utc_ms'].to_numpy())
+    busy = (iv_idx >= 0) & (intervals['label'].to_numpy()[np.maximum(iv_idx, 0)] != '0')
+    sti = np.abs(rng.normal(0.3 + 0.8 * busy, 0.3))
+    sti[rng.random(n) < 0.01] = np.nan
+    thresholds = np.linspace(0, 2, 41)
+
+    t0 = time.perf_counter()
+    res = sweep(ts, sti, intervals, thresholds, (1, 3))
+    t_new = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ref = _sweep_reference(ts, sti, intervals, thresholds, (1, 3))
+    t_old = time.perf_counter() - t0
+    ok = all(np.array_equal(res[c].to_numpy(), ref[c].to_numpy()) for c in ('tp', 'fp', 'fn'))
+    ok &= np.allclose(res['latency_ms_median'], ref['latency_ms_median'], equal_nan=True)
+    print(f"📊 {len(thresholds)} ngưỡng x 2 enter_frames, {n} gói: từng ngưỡng {t_old:.2f} s, một lượt {t_new:.3f} s")
+    print(f"{'✅ khớp' if ok else '❌ lệch'} TP/FP/FN và độ trễ so với vòng lặp từng ngưỡng")
+
+    # Không gói nào trong khoảng nhãn (gói 0-5 s, nhãn 10-11 s): không lỗi, độ trễ NaN
+    far = pd.DataFrame({'start_utc_ms': [10_000], 'end_utc_ms': [11_000], 'label': ['3']})
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        res = sweep(np.arange(0, 5000, 10), np.ones(500), far, thresholds, (1,))
+    empty_ok = bool(caught) and res['latency_ms_median'].isna().all() and (res['tp'] == 0).all() \
+        and (res['detected'] == 0).all()
+    print(f"{'✅' if empty_ok else '❌'} không có gói trong khoảng nhãn: cảnh báo, độ trễ NaN, detected = 0")
+    return ok and empty_ok
+
+
+def to_host_ms(df, clock):
+    """timestamp_real_ms của df -> giờ PC theo mô hình đồng hồ của từng link (cột mac: "MAC" hoặc "MAC@cổng")."""
+    ts = df['timestamp_real_ms'].to_numpy(dtype=np.int64)
+    out = np.empty(len(ts), dtype=np.int64)
+    for link, idx in df.groupby(df['mac'].astype(str)).indices.items():
+        segments = segments_for(clock, link)
+        if segments is None:
+            raise KeyError(f"manifest không có mô hình đồng hồ cho {link} (MAC thu qua nhiều cổng cần nhãn MAC@cổng)")
+        out[idx] = np.round(device_to_host(segments, ts[idx]))
+    return out
+
+
+def main():
+    args = sys.argv[1:]
+    manifest = None
+    if '--manifest' in args:
+        i = args.index('--manifest')
+        manifest = args[i + 1] if i + 1 < len(args) else None
+        del args[i:i + 2]
+        if manifest is None:
+            print("⚠️ --manifest cần đường dẫn file manifest")
+            sys.exit(1)
+    if args and args[0] == 'check':
+        sys.exit(0 if check() else 1)
+    if len(args) < 2:
+        print("Cách dùng: python sti_sweep.py occupancy_output.csv timestamps.csv [mac] [--manifest file] | check")
+        sys.exit(1)
+    df = pd.read_csv(args[0])
+    fused = 'sti' not in df.columns and 'score' in df.columns   # occupancy_fused.csv của ocupice_multi.py
+    if 'sti' not in df.columns and not fused:
+        print(f"⚠️ {args[0]} không có cột sti hoặc score")
+        sys.exit(1)
+    if len(args) > 2:
+        if 'mac' not in df.columns:
+            print(f"⚠️ {args[0]} không có cột mac (điểm đã gộp), bỏ tham số MAC")
+            sys.exit(1)
+        df = df[df['mac'] == args[2]]
+    elif 'mac' in df.columns and df['mac'].nunique() > 1:
+        print(f"⚠️ File có {df['mac'].nunique()} MAC: chọn một MAC (tham số thứ 3) hoặc dùng occupancy_fused.csv")
+        sys.exit(1)
+    intervals = pd.read_csv(args[1])
+    ts = df['timestamp_real_ms'].to_numpy()
+    if manifest and fused:
+        # Ô lưới gộp nhiều link, mỗi link một đồng hồ: không có một mô hình chung để đổi
+        print("⚠️ Điểm đã gộp không có cột mac: bỏ qua --manifest, timestamp giữ theo đồng hồ thiết bị")
+    elif manifest:
+        ts = to_host_ms(df, load_clock_model(manifest))
+        print(f"🕒 Đổi timestamp_real_ms sang giờ PC theo {manifest}")
+    t0 = time.perf_counter()
+    res = sweep(ts, df['score' if fused else 'sti'].to_numpy(), intervals)
+    res.to_csv(OUTPUT_CSV, index=False)
+    print(f"⏱️ {len(res)} cấu hình, {len(df)} gói, {len(intervals)} khoảng nhãn: {time.perf_counter() - t0:.2f} s")
+    best = res.sort_values('f1', ascending=False).head(5)
+    print(best.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+    print(f"💾 Đã ghi {OUTPUT_CSV}")
+
+if __name__ == '__main__':
+    main()
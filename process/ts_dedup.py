@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Xử lý trùng (mac, timestamp_real_ms): đồng hồ ESP32 chỉ có độ phân giải 1 ms nên hai gói
+trong cùng một ms mang cùng timestamp.
+
+Quy tắc giống #1_duplicate_rows.py: gói đến trước bị lùi về 1 ms, lặp tới khi hết trùng.
+Điểm bất động của vòng lặp đó (với dữ liệu đã theo thứ tự thời gian) tính được trong một lượt
+từ cuối lên, sau khi xếp theo (timestamp, thứ tự đến):
+
+    assigned[k] = min(ts[k], assigned[k + 1] - 1)
+
+ - assign_unique(): quy tắc trên cho một dãy của một MAC.
+ - TimestampDeduper: dùng trong com_readv5.py, sửa timestamp ngay lúc ghi.
+ - dedup_csv(): thay cho vòng lặp của #1_duplicate_rows.py với file đã thu, đọc theo khối.
+
+TimestampDeduper xử lý theo từng (MAC, cổng): timestamp_real_ms là đồng hồ của ESP32 nhận, hai cổng
+là hai đồng hồ không liên quan nên không dời gói của cổng này vì trùng với cổng kia. File thu một
+cổng ra không còn cặp (mac, timestamp_real_ms) trùng. File 'merged' thu từ nhiều cổng vẫn có thể
+trùng giữa các cổng, mà #1_duplicate_rows.py / #2_nearest.py nhóm theo (mac, timestamp_real_ms),
+nên với file đó vẫn phải chạy #1_duplicate_rows.py (hoặc dùng shard / nhóm theo cả cột port).
+
+Yêu cầu ban đầu là đánh số thứ tự dưới 1 ms cho gói trùng; ở đây vẫn lùi nguyên 1 ms như #1 để
+timestamp_real_ms giữ kiểu số nguyên (cột u8 của .bin, CSV cũ) và kết quả trùng với #1.
+
+Viết lại công thức: assigned[k] = k + min(ts[j] - j với j >= k), tức một lần cộng dồn min từ cuối.
+
+Khác vòng lặp cũ khi dòng của một MAC không theo thứ tự thời gian trong file (file ghép, thiết bị
+khởi động lại): vòng lặp cũ luôn lùi dòng đứng trước trong file, ở đây lùi dòng có timestamp nhỏ
+hơn (bằng nhau thì dòng đứng trước). Ví dụ một MAC có a=5, b=5, c=4 theo thứ tự dòng: cách cũ cho
+a=3, c=4, b=5, ở đây a=4, c=3, b=5. Cả hai đều cho timestamp không trùng; ở đây thứ tự timestamp
+mới giữ đúng thứ tự timestamp gốc. Vòng lặp cũ cũng xếp lại dòng theo nhóm, dedup_csv giữ nguyên
+thứ tự dòng của file vào. python ts_dedup.py check so hai cách trên cả hai loại dữ liệu.
+"""
+import csv
+import os
+import sys
+import tempfile
+from collections import defaultdict
+
+import numpy as np
+
+RESET_MS = 1000  # timestamp_real_ms lùi quá mức này so với giá trị đã ghi thì coi là thiết bị khởi động lại
+
+
+def assign_unique(ts, floor=None):
+    """
+    ts: timestamp đã xếp theo (timestamp, thứ tự đến). Trả về list timestamp tăng ngặt.
+    floor: giá trị đã ghi ra trước đó (không sửa được nữa); mọi kết quả phải lớn hơn nó,
+    nếu không thì đẩy lên (trường hợp hiếm khi chuỗi trùng dài hơn phần còn giữ lại).
+    """
+    out = list(ts)
+    for k in range(len(out) - 2, -1, -1):
+        if out[k] >= out[k + 1]:
+            out[k] = out[k + 1] - 1
+    if floor is not None:
+        prev = floor
+        for k in range(len(out)):
+            if out[k] <= prev:
+                out[k] = prev + 1
+            prev = out[k]
+    return out
+
+
+def assign_unique_np(ts: np.ndarray) -> np.ndarray:
+    """Như assign_unique (không có floor), dạng vector cho mảng đã xếp theo (timestamp, thứ tự đến)."""
+    k = np.arange(len(ts), dtype=np.int64)
+    return k + np.minimum.accumulate((ts - k)[::-1])[::-1]
+
+
+class TimestampDeduper:
+    """
+    Sửa timestamp_real_ms trùng theo từng (MAC, cổng) ngay trong writer_loop.
+    resolve(ready, lookahead): ready là các frame sắp ghi, lookahead là các frame còn nằm trong
+    cửa sổ sắp xếp lại (chưa ghi) để biết gói trùng đến sau; chỉ frame trong ready được sửa.
+    """
+
+    def __init__(self, reset_ms: int = RESET_MS):
+        self.reset_ms = reset_ms
+        self.last = {}   # (mac_bytes, port) -> timestamp lớn nhất đã ghi
+        self.shifted = 0
+
+    def resolve(self, ready, lookahead=()):
+        links = defaultdict(list)
+        for i, frame in enumerate(ready):
+            links[(frame[0], frame[3])].append((frame[1], i))
+        n_ready = len(ready)
+        for j, frame in enumerate(lookahead):
+            seq = links.get((frame[0], frame[3]))
+            if seq is not None:
+                seq.append((frame[1], n_ready + j))
+
+        out = None
+        for key, seq in links.items():
+            floor = self.last.get(key)
+            # Đường nhanh: đã tăng ngặt và lớn hơn giá trị đã ghi -> không có gì để sửa
+            prev = floor
+            for ts, _ in seq:
+                if prev is not None and ts <= prev:
+                    break
+                prev = ts
+            else:
+                self.last[key] = max(ts for ts, i in seq if i < n_ready)
+                continue
+
+            seq.sort()
+            if floor is not None and seq[0][0] < floor - self.reset_ms:
+                floor = None  # thiết bị khởi động lại, đồng hồ bắt đầu lại từ đầu
+            assigned = assign_unique([ts for ts, _ in seq], floor)
+            last = None
+            for (ts, i), new_ts in zip(seq, assigned):
+                if i >= n_ready:
+                    continue
+                if last is None or new_ts > last:
+                    last = new_ts
+                if new_ts != ts:
+                    if out is None:
+                        out = list(ready)
+                    mac_bytes, _, ts_pc_ms, port, csi = out[i]
+                    out[i] = (mac_bytes, new_ts, ts_pc_ms, port, csi)
+                    self.shifted += 1
+            self.last[key] = last
+        return ready if out is None else out
+
+
+def dedup_arrays(mac, ts):
+    """
+    mac (mã MAC), ts theo thứ tự dòng. Trả về (timestamp mới, in_chain): in_chain đánh dấu dòng
+    thuộc một chuỗi trùng (bị sửa, hoặc trùng timestamp gốc với dòng kề bên của cùng MAC).
+    """
+    # lexsort ổn định: theo mac, rồi timestamp, bằng nhau thì giữ thứ tự dòng
+    order = np.lexsort((ts, mac))
+    ts_sorted = ts[order]
+    mac_sorted = mac[order]
+    bounds = np.flatnonzero(np.diff(mac_sorted)) + 1
+    assigned_sorted = np.empty_like(ts_sorted)
+    # Dòng thuộc chuỗi trùng: timestamp bị sửa, hoặc trùng timestamp gốc với dòng kề bên của cùng MAC
+    in_chain_sorted = np.zeros(len(ts_sorted), dtype=bool)
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(ts_sorted)]):
+        seg = ts_sorted[lo:hi]
+        fixed = assign_unique_np(seg)
+        assigned_sorted[lo:hi] = fixed
+        chain = fixed != seg
+        same = seg[:-1] == seg[1:]
+        chain[:-1] |= same
+        chain[1:] |= same
+        in_chain_sorted[lo:hi] = chain
+    assigned = np.empty_like(ts)
+    assigned[order] = assigned_sorted
+    in_chain = np.zeros(len(ts), dtype=bool)
+    in_chain[order] = in_chain_sorted
+    return assigned, in_chain
+
+
+def dedup_csv(input_file, output_file, duplicate_file, chunk_rows: int = 200_000):
+    """
+    Sửa (mac, timestamp_real_ms) trùng trong file CSV (cột 0 là mac, cột 1 là timestamp_real_ms).
+
+    Lượt 1 chỉ đọc hai cột đó theo khối, giữ (mac_id, timestamp) của mọi dòng (~10 byte/dòng thay
+    vì cả dòng CSI), xếp mỗi MAC theo (timestamp, thứ tự dòng) một lần và tính timestamp mới.
+    Lượt 2 đọc lại file theo dòng, chỉ thay cột timestamp; thứ tự dòng giữ nguyên như file vào.
+    Dòng trống / chỉ có dấu cách bị bỏ như pandas bỏ ở lượt 1; mỗi dòng còn lại phải có cùng
+    timestamp với dòng tương ứng của lượt 1, nếu không thì báo ValueError thay vì sửa nhầm dòng.
+    duplicate_file nhận các dòng gốc (trước khi sửa) thuộc một chuỗi trùng.
+    Trả về (số dòng, số dòng bị đổi timestamp, số dòng trong duplicate_file).
+    """
+    import pandas as pd  # chỉ cần cho công cụ offline, com_readv5.py không phải nạp pandas
+
+    mac_ids = {}
+    mac_parts = []
+    ts_parts = []
+    for chunk in pd.read_csv(input_file, usecols=[0, 1], header=0, dtype={0: str}, chunksize=chunk_rows):
+        macs = chunk.iloc[:, 0].to_numpy()
+        codes, uniques = pd.factorize(macs)
+        remap = np.array([mac_ids.setdefault(m, len(mac_ids)) for m in uniques], dtype=np.int32)
+        mac_parts.append(remap[codes])
+        ts_parts.append(chunk.iloc[:, 1].to_numpy(dtype=np.int64))
+    mac = np.concatenate(mac_parts) if mac_parts else np.zeros(0, dtype=np.int32)
+    ts = np.concatenate(ts_parts) if ts_parts else np.zeros(0, dtype=np.int64)
+    del mac_parts, ts_parts
+
+    assigned, in_chain = dedup_arrays(mac, ts)
+
+    n_rows = len(ts)
+    n_changed = int(np.count_nonzero(assigned != ts))
+    n_dup = 0
+    with open(input_file, 'r', newline='', encoding='utf-8') as fin, \
+            open(output_file, 'w', newline='', encoding='utf-8') as fout, \
+            open(duplicate_file, 'w', newline='', encoding='utf-8') as fdup:
+        reader = csv.reader(fin)
+        out_writer = csv.writer(fout)
+        dup_writer = csv.writer(fdup)
+        header = next(reader)
+        out_writer.writerow(header)
+        dup_writer.writerow(header)
+        out_rows = []
+        i = -1
+        for row in reader:
+            if not ''.join(row).strip():
+                continue   # pandas.read_csv bỏ dòng trống ở lượt 1
+            i += 1
+            if i >= n_rows or row[1].strip() != str(ts[i]):
+                raise ValueError(f"{input_file}: dòng dữ liệu thứ {i + 1} không khớp giữa hai lượt đọc "
+                                 f"({row[:2]}), không sửa file")
+            if in_chain[i]:
+                dup_writer.writerow(row)
+                n_dup += 1
+                if assigned[i] != ts[i]:
+                    row[1] = str(assigned[i])
+            out_rows.append(row)
+            if len(out_rows) == chunk_rows:
+                out_writer.writerows(out_rows)
+                out_rows = []
+        out_writer.writerows(out_rows)
+    if i + 1 != n_rows:
+        raise ValueError(f"{input_file}: lượt 2 đọc {i + 1} dòng, lượt 1 đọc {n_rows} dòng")
+    return n_rows, n_changed, n_dup
+
+
+def _dedup_reference(mac, ts):
+    """Vòng lặp của #1_duplicate_rows.py trên (mac, timestamp), giữ danh tính dòng; trả về timestamp mới."""
+    rows = [[m, t, i] for i, (m, t) in enumerate(zip(mac, ts))]
+    changed = True
+    while changed:
+        grouped = defaultdict(list)
+        for row in rows:
+            grouped[(row[0], row[1])].append(row)
+        changed = False
+        rows = []
+        for group in grouped.values():
+            if len(group) > 1:
+                changed = True
+                group[0][1] -= 1
+            rows.extend(group)
+    out = np.empty(len(ts), dtype=np.int64)
+    for _, t, i in rows:
+        out[i] = t
+    return out
+
+
+def check(n_rows: int = 5000, seed: int = 0):
+    """So dedup_arrays với vòng lặp cũ: khớp khi mỗi MAC theo thứ tự thời gian, khác (đã biết) khi không."""
+    rng = np.random.default_rng(seed)
+    mac = rng.integers(0, 3, n_rows)
+    ts = np.cumsum(rng.choice([0, 0, 1, 2, 10], n_rows))   # nhiều dòng cùng ms
+    new, _ = dedup_arrays(mac, ts)
+    ok = np.array_equal(new, _dedup_reference(mac, ts))
+    print(f"{'✅' if ok else '❌'} {n_rows} dòng theo thứ tự thời gian: {'khớp' if ok else 'lệch'} với vòng lặp cũ")
+
+    # Dòng không theo thứ tự (ví dụ trong docstring): khác vòng lặp cũ, nhưng vẫn không trùng
+    # và giữ thứ tự của timestamp gốc
+    mac = np.zeros(3, dtype=np.int64)
+    ts = np.array([5, 5, 4])
+    new, _ = dedup_arrays(mac, ts)
+    old = _dedup_reference(mac, ts)
+    expected = np.array([4, 5, 3]), np.array([3, 5, 4])
+    known = np.array_equal(new, expected[0]) and np.array_equal(old, expected[1])
+    print(f"{'✅' if known else '❌'} a=5, b=5, c=4 không theo thứ tự: mới {new.tolist()}, cũ {old.tolist()}")
+
+    ts = rng.integers(0, 50, n_rows)
+    mac = rng.integers(0, 3, n_rows)
+    new, _ = dedup_arrays(mac, ts)
+    unique = all(len(np.unique(new[mac == m])) == np.count_nonzero(mac == m) for m in range(3))
+    order = np.lexsort((np.arange(n_rows), ts, mac))
+    monotonic = all((np.diff(new[order][mac[order] == m]) > 0).all() for m in range(3))
+    print(f"{'✅' if unique and monotonic else '❌'} {n_rows} dòng lộn xộn: không trùng, giữ thứ tự timestamp gốc "
+          f"({np.count_nonzero(new != _dedup_reference(mac, ts))} dòng khác vòng lặp cũ)")
+
+    # dedup_csv với dòng trống / chỉ có dấu cách giữa các dòng dữ liệu: phải sửa đúng dòng
+    with tempfile.TemporaryDirectory() as tmp:
+        src, out, dup = (os.path.join(tmp, name) for name in ('in.csv', 'out.csv', 'dup.csv'))
+        with open(src, 'w', newline='', encoding='utf-8') as f:
+            f.write('mac,timestamp_real_ms,CSI\nA,5,"[1]"\n\nA,5,"[2]"\n   \nB,7,"[3]"\nA,6,"[4]"\n\n')
+        n_rows, n_changed, n_dup = dedup_csv(src, out, dup)
+        with open(out, newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))[1:]
+    blank_ok = n_rows == 4 and rows == [['A', '4', '[1]'], ['A', '5', '[2]'], ['B', '7', '[3]'], ['A', '6', '[4]']]
+    print(f"{'✅' if blank_ok else '❌'} dedup_csv với dòng trống: {rows}")
+    return ok and known and unique and monotonic and blank_ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'check':
+        print("Cách dùng: python ts_dedup.py check")
+        sys.exit(1)
+    sys.exit(0 if check() else 1)
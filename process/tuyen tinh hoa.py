@@ -2,14 +2,22 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 
+from clock_model import load_clock_model, device_to_host, segments_for
+from csi_parse import parse_csi_column
+
 # === Đọc file CSV ===
 input_file = 'csi_data_20250508_101047.csv'
 output_file = 'csi_data_20250508_101047_interpolated.csv'
+# Manifest của phiên thu (có mô hình đồng hồ); None thì cộng offset cố định theo dòng đầu như cũ
+clock_file = None  # 'csi_data_20250508_101047_manifest.json'
+clock = load_clock_model(clock_file) if clock_file else {}
 
 df = pd.read_csv(input_file)
 
 # === Chuyển CSI từ string sang list[int] ===
-df['CSI'] = df['CSI'].apply(lambda x: list(map(int, x.strip('[]').split(','))))
+csi_vals, csi_ok = parse_csi_column(df['CSI'])
+df = df[csi_ok].copy()
+df['CSI'] = csi_vals[csi_ok].tolist()
 
 # === Bỏ trùng timestamp_real_ms trong từng MAC (giữ dòng đầu tiên) ===
 df = df.drop_duplicates(subset=['mac', 'timestamp_real_ms'], keep='first')
@@ -51,9 +59,15 @@ for mac in mac_list:
     csi_interp = np.array(csi_interp).T.tolist()
     
     # Tạo timestamp_pc_ms, timestamp_pc_hms
-    base_pc_ms = mac_df['timestamp_pc_ms'].dropna().iloc[0]
-    pc_delta = full_ts - min_ts
-    timestamp_pc_ms = base_pc_ms + pc_delta
+    # Mô hình đồng hồ theo (MAC, cổng): lấy cổng của MAC trong file (cột port khi thu nhiều cổng)
+    port = int(mac_df['port'].dropna().iloc[0]) if 'port' in mac_df else None
+    segments = segments_for(clock, mac, port)
+    if segments is not None:
+        timestamp_pc_ms = np.round(device_to_host(segments, full_ts))
+    else:
+        base_pc_ms = mac_df['timestamp_pc_ms'].dropna().iloc[0]
+        pc_delta = full_ts - min_ts
+        timestamp_pc_ms = base_pc_ms + pc_delta
     timestamp_pc_hms = [datetime.fromtimestamp(t/1000).strftime('%H:%M:%S.%f')[:-3] for t in timestamp_pc_ms]
     
     # Ghi vào output
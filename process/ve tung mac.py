@@ -1,41 +1,32 @@
-import csv
-import ast
 import numpy as np
 import matplotlib.pyplot as plt
 import os
 
+from capture_cache import load_capture
+
 # Configuration
 device_files = [
     '34_86_5D_39_A5_5C.csv',
     'A0_DD_6C_0F_99_C8.csv',
     'A0_DD_6C_85_F7_44.csv'
 ]
+# File .bin cũng được; shard theo MAC của com_readv5.py (OUTPUT_LAYOUT = 'by_mac') đọc qua manifest,
+# ghép mọi segment: ('csi_data_20250508_141303_manifest.json', '34:86:5D:39:A5:5C')
 OUTPUT_DIR = 'heatmaps'      # Thư mục lưu ảnh
 WINDOW_MS = 20_000          # Khoảng thời gian 20 giây
 
 # Tạo thư mục lưu nếu chưa tồn tại
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Hàm parse CSI string thành numpy array
-def parse_csi(csi_str):
-    try:
-        raw = ast.literal_eval(csi_str)
-        return np.array(raw, dtype=float)
-    except:
-        return None
+# Load dữ liệu CSI gốc (cache qua capture_cache.py), bỏ qua các dòng không parse được
+def load_entries(source):
+    path, stream = source if isinstance(source, tuple) else (source, 'merged')
+    data_df, csi, valid = load_capture(path, csi_col='CSI', stream=stream)
+    timestamps = data_df['timestamp_real_ms'].to_numpy(dtype=float)
+    return timestamps[valid], csi[valid].astype(float)
 
-# Load dữ liệu CSI gốc, bỏ qua các dòng không parse được
-def load_entries(path):
-    timestamps, raw_matrix = [], []
-    with open(path, 'r', newline='') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            vec = parse_csi(row['CSI'])
-            if vec is None:
-                continue
-            timestamps.append(float(row['timestamp_real_ms']))
-            raw_matrix.append(vec)
-    return np.array(timestamps), np.vstack(raw_matrix)
+def device_name(source):
+    return source[1] if isinstance(source, tuple) else os.path.splitext(os.path.basename(source))[0]
 
 # Main: load all devices
 data = {}
@@ -80,8 +71,7 @@ while window_start < end_time:
                 origin='lower',
                 extent=[seg_ts[0]/1000, seg_ts[-1]/1000, 0, n_sub]
             )
-        device_name = os.path.splitext(os.path.basename(csv_file))[0]
-        ax.set_title(device_name)
+        ax.set_title(device_name(csv_file))
         ax.set_xlabel('Time (s)')
         ax.set_ylabel('Subcarrier Index')
         fig.colorbar(im, ax=ax, orientation='vertical', label='Amplitude')
@@ -18,21 +18,14 @@ from PyQt5 import QtWidgets, QtCore, QtGui
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from capture_cache import load_capture
+from csi_layout import get_layout
+
 WINDOW_MS = 1000
 DEFAULT_FPS = 30
 
-# Hàm lọc CSI raw
-def filter_csi_raw(raw_list, null_subcarriers=None):
-    sub_ids = list(range(0,1)) + list(range(0,32)) + list(range(-31,0))
-    if null_subcarriers is None:
-        null_subcarriers = [-31, -30, -29, 0, 28, 29, 30, 31]
-    remove_set = set(null_subcarriers)
-    filtered = []
-    for idx, sc in enumerate(sub_ids):
-        if sc in remove_set:
-            continue
-        filtered.extend([raw_list[2*idx], raw_list[2*idx + 1]])
-    return filtered
+# Bố cục subcarrier: cặp đầu là số 0 ESP32 chèn vào (xem csi_layout.LAYOUTS)
+LAYOUT = get_layout('leading_zero')
 
 class MplCanvas(FigureCanvas):
     def __init__(self, parent=None, width=8, height=6, dpi=100, nrows=3, ncols=2):
@@ -50,6 +43,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.video_folder = None
         self.labels_df = None
         self.csi_df = None
+        self.csi_mat = None
         self.mac_list = []
         # video state
         self.cap = None
@@ -120,7 +114,11 @@ class MainWindow(QtWidgets.QMainWindow):
     def select_csi_file(self):
         path, _ = QtWidgets.QFileDialog.getOpenFileName(self, 'Chọn file CSI', filter='CSV Files (*.csv)')
         if path:
-            df = pd.read_csv(path, usecols=['mac','timestamp_real_ms','CSI'])
+            # CSI đã parse được cache cạnh file (capture_cache.py), mở lại lần sau gần như tức thì;
+            # bỏ dòng hỏng, hàng i của csi_mat ứng với dòng i của csi_df
+            df, csi, valid = load_capture(path, csi_col='CSI')
+            df = df.loc[valid, ['mac', 'timestamp_real_ms']].reset_index(drop=True)
+            self.csi_mat = csi[valid]
             self.csi_df = df
             self.mac_list = df['mac'].unique()[:3].tolist()
 
@@ -231,10 +229,6 @@ class MainWindow(QtWidgets.QMainWindow):
         self.videoLabel.setPixmap(pix.scaled(
             self.videoLabel.size(), QtCore.Qt.KeepAspectRatio))
 
-    def parse_csi(self, s):
-        arr = np.fromstring(s.strip('[]'), sep=',', dtype=np.int8)
-        return arr[0::2] + 1j*arr[1::2]
-
     def update_plots(self):
         half = WINDOW_MS // 2
         t0, t1 = self.current_ts - half, self.current_ts + half
@@ -248,9 +242,8 @@ class MainWindow(QtWidgets.QMainWindow):
                 ax_h.text(0.5, 0.5, 'No data', transform=ax_h.transAxes)
                 ax_l.text(0.5, 0.5, 'No data', transform=ax_l.transAxes)
             else:
-                raw = [list(map(int, v.strip('[]').split(','))) for v in dfw['CSI']]
-                filt = [filter_csi_raw(r) for r in raw]
-                amps = np.stack([np.abs(np.array(f)).reshape(-1, 2).sum(axis=1) for f in filt])
+                re, im = LAYOUT.re_im(self.csi_mat[dfw.index])
+                amps = np.abs(re) + np.abs(im)
                 ax_h.imshow(amps.T, aspect='auto', cmap='jet', interpolation='nearest', extent=[t0, t1, 0, amps.shape[1]], origin='lower')
                 ax_h.axvline(self.current_ts, linestyle='--')
                 ax_h.set_ylabel('Subcarrier')
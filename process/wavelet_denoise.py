@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Khử nhiễu DWT (sym4, ngưỡng universal, soft) cho cả ma trận CSI (N, L) cùng lúc.
+
+Thay cho vòng lặp từng subcarrier của ocupice copy.py (np.interp rồi wavedec/waverec từng cột):
+ - fill_missing(): nội suy NaN theo timestamp cho mọi cột một lần (các cột có cùng mẫu NaN,
+   thường là cả dòng CSI hỏng, dùng chung chỉ số nội suy), chỉ tính lại các dòng cần
+ - denoise_matrix(): wavedec / waverec cho mọi cột trong một lần gọi, ngưỡng tính theo từng cột
+ - preprocess_csi(): hai bước trên, chỉ chuyển vị dữ liệu một lần; kết quả khớp cách cũ tới sai số
+   làm tròn (python wavelet_denoise.py check)
+ - BlockDenoiser: chạy theo khối có chồng lấn để giới hạn bộ nhớ hoặc dùng cho luồng trực tiếp;
+   mỗi khối có ngưỡng riêng nên kết quả gần đúng (không trùng) với chạy một lần cả file.
+   Nên truyền level cố định: level=None lấy mức tối đa theo độ dài nên khối ngắn và cả file
+   dùng số mức khác nhau (với level=4 hai cách lệch nhau ~1e-4 biên độ tín hiệu).
+
+timestamps phải tăng dần (không giảm) như np.interp yêu cầu.
+"""
+import sys
+import time
+
+import numpy as np
+import pywt
+
+WAVELET = 'sym4'
+BLOCK_ROWS = 4096      # số dòng mỗi khối của BlockDenoiser
+OVERLAP_ROWS = 256     # số dòng ngữ cảnh mỗi bên khối (bỏ hiệu ứng biên của DWT)
+
+
+def _interp_rows(x, xp, fp):
+    """Như np.interp(x, xp, fp[:, c]) cho mọi cột c của fp (n_xp, C) cùng lúc."""
+    n_xp = len(xp)
+    j = np.searchsorted(xp, x, side='right') - 1
+    below = j < 0
+    above = j >= n_xp - 1        # x >= xp[-1]
+    j = np.clip(j, 0, max(n_xp - 2, 0))
+    j1 = np.minimum(j + 1, n_xp - 1)
+    f0 = fp[j]
+    dx = (xp[j1] - xp[j])[:, None]
+    slope = (fp[j1] - f0) / np.where(dx == 0, 1, dx)
+    out = slope * (x - xp[j])[:, None] + f0
+    exact = (x == xp[j])
+    out[exact] = f0[exact]
+    out[below] = fp[0]
+    out[above] = fp[-1]
+    return out
+
+
+def _transpose(matrix, block_rows: int = 2048):
+    """Bản chuyển vị (L, N) float64 liền bộ nhớ của matrix (N, L), chép theo khối dòng cho vừa cache."""
+    n = matrix.shape[0]
+    out = np.empty((matrix.shape[1], n), dtype=np.float64)
+    for lo in range(0, n, block_rows):
+        out[:, lo:lo + block_rows] = matrix[lo:lo + block_rows].T
+    return out
+
+
+def fill_missing(timestamps, raw_matrix):
+    """
+    Nội suy NaN theo timestamp. Trả về (matrix, ok): ok[c] = False nếu cột c có < 2 giá trị
+    (cột đó được thay NaN bằng 0 và không khử nhiễu, như cách cũ).
+    Chỉ tính lại các dòng mà np.interp không trả nguyên giá trị cũ: dòng thiếu và dòng trùng
+    timestamp (np.interp lấy giá trị của dòng cuối cùng trong nhóm trùng).
+    matrix là view chuyển vị của mảng (L, N) liền bộ nhớ, nên denoise_matrix không phải chép lại.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n = len(timestamps)
+    out_t = _transpose(raw_matrix)
+    missing_t = np.isnan(out_t)
+    ok = np.ones(raw_matrix.shape[1], dtype=bool)
+    if missing_t.any():
+        # Gom cột theo mẫu NaN (khoá là bitmask đã pack); thường chỉ có một nhóm
+        packed = np.packbits(missing_t, axis=1)
+        groups = {}
+        for c in range(raw_matrix.shape[1]):
+            groups.setdefault(packed[c].tobytes(), []).append(c)
+        groups = list(groups.values())
+    else:
+        groups = [list(range(raw_matrix.shape[1]))]
+    for cols in groups:
+        valid_pos = np.flatnonzero(~missing_t[cols[0]])
+        if len(valid_pos) < 2:
+            out_t[cols] = np.nan_to_num(out_t[cols])
+            ok[cols] = False
+            continue
+        xp = timestamps[valid_pos]
+        own = np.full(n, -1)
+        own[valid_pos] = np.arange(len(valid_pos))
+        rows = np.flatnonzero(np.searchsorted(xp, timestamps, side='right') - 1 != own)
+        if len(rows):
+            fp = raw_matrix[valid_pos] if len(cols) == raw_matrix.shape[1] else raw_matrix[np.ix_(valid_pos, cols)]
+            out_t[np.ix_(cols, rows)] = _interp_rows(timestamps[rows], xp, fp).T
+    return out_t.T, ok
+
+
+def _denoise_signals(signals, wavelet=WAVELET, level=None):
+    """signals (C, N) liền bộ nhớ, mỗi hàng là một tín hiệu; trả về (C, N)."""
+    n = signals.shape[1]
+    coeffs = pywt.wavedec(signals, wavelet, level=level, axis=-1)
+    sigma = np.median(np.abs(coeffs[1]), axis=-1) / 0.6745
+    uthresh = (sigma * np.sqrt(2 * np.log(n)))[:, None]
+    for c in coeffs[1:]:
+        c -= np.clip(c, -uthresh, uthresh)   # soft threshold tại chỗ (= pywt.threshold mode='soft')
+    return pywt.waverec(coeffs, wavelet, axis=-1)[:, :n]
+
+
+def denoise_matrix(matrix, wavelet=WAVELET, level=None):
+    """
+    DWT cho mọi cột cùng lúc; ngưỡng universal từ hệ số chi tiết mức thô nhất, riêng cho từng cột.
+    Biến đổi chạy trên bản chuyển vị liền bộ nhớ (L, N) (axis=0 chậm hơn nhiều); không chép lại
+    nếu matrix đã là view chuyển vị như kết quả của fill_missing. Trả về view chuyển vị (N, L).
+    """
+    signals = matrix.T
+    if signals.dtype != np.float64 or not signals.flags.c_contiguous:
+        signals = _transpose(matrix)
+    return _denoise_signals(signals, wavelet, level).T
+
+
+def preprocess_csi(timestamps, raw_matrix, wavelet=WAVELET, level=None):
+    """Nội suy NaN rồi khử nhiễu mọi cột (thay cho preprocess_csi của ocupice copy.py)."""
+    filled, ok = fill_missing(timestamps, raw_matrix)
+    if ok.all():
+        return denoise_matrix(filled, wavelet, level)
+    signals = filled.T   # (L, N) liền bộ nhớ; các cột không khử nhiễu giữ nguyên
+    signals[ok] = _denoise_signals(signals[ok], wavelet, level)
+    return filled
+
+
+class BlockDenoiser:
+    """
+    Khử nhiễu theo khối: push(timestamps, rows) trả về các dòng đã xong (timestamps, rows).
+    Mỗi khối block_rows dòng được xử lý cùng overlap dòng ngữ cảnh mỗi bên, nên một dòng
+    ra trễ tối đa block_rows + overlap dòng; flush() trả nốt phần còn lại khi hết dữ liệu.
+    """
+
+    def __init__(self, wavelet=WAVELET, level=None, block_rows: int = BLOCK_ROWS, overlap: int = OVERLAP_ROWS):
+        self.wavelet = wavelet
+        self.level = level
+        self.block_rows = block_rows
+        self.overlap = overlap
+        self.ts = np.zeros(0)
+        self.rows = None
+        self.n_context = 0   # số dòng đầu bộ đệm đã trả ra, chỉ còn làm ngữ cảnh
+
+    def push(self, timestamps, rows):
+        rows = np.asarray(rows, dtype=np.float64)
+        self.ts = np.concatenate([self.ts, np.asarray(timestamps, dtype=np.float64)])
+        self.rows = rows if self.rows is None else np.concatenate([self.rows, rows])
+        out_ts, out_rows = [], []
+        while len(self.ts) - self.n_context >= self.block_rows + self.overlap:
+            ts, done = self._run(self.n_context + self.block_rows)
+            out_ts.append(ts)
+            out_rows.append(done)
+        return self._join(out_ts, out_rows)
+
+    def flush(self):
+        if self.rows is None or len(self.ts) == self.n_context:
+            return self._join([], [])
+        ts, done = self._run(len(self.ts))
+        return ts, done
+
+    def _run(self, stop):
+        """Khử nhiễu bộ đệm tới stop + overlap, trả dòng n_context..stop-1, giữ overlap dòng ngữ cảnh."""
+        end = min(stop + self.overlap, len(self.ts))
+        window = preprocess_csi(self.ts[:end], self.rows[:end], self.wavelet, self.level)
+        ts, done = self.ts[self.n_context:stop], window[self.n_context:stop]
+        keep = max(stop - self.overlap, 0)
+        self.ts, self.rows = self.ts[keep:], self.rows[keep:]
+        self.n_context = stop - keep
+        return ts, done
+
+    def _join(self, out_ts, out_rows):
+        n_cols = 0 if self.rows is None else self.rows.shape[1]
+        if not out_ts:
+            return np.zeros(0), np.zeros((0, n_cols))
+        return np.concatenate(out_ts), np.concatenate(out_rows)
+
+
+def denoise_blocks(timestamps, raw_matrix, chunk_rows: int = BLOCK_ROWS, **kwargs):
+    """Chạy BlockDenoiser trên cả ma trận theo từng đoạn chunk_rows (ví dụ memmap từ capture_cache)."""
+    den = BlockDenoiser(**kwargs)
+    parts = []
+    for lo in range(0, len(raw_matrix), chunk_rows):
+        parts.append(den.push(timestamps[lo:lo + chunk_rows], raw_matrix[lo:lo + chunk_rows])[1])
+    parts.append(den.flush()[1])
+    return np.concatenate(parts)
+
+
+def _preprocess_reference(timestamps, raw_matrix, wavelet=WAVELET, level=None):
+    """Cách cũ của ocupice copy.py: từng cột một, giữ lại để đối chiếu."""
+    denoised = np.zeros_like(raw_matrix)
+    for i in range(raw_matrix.shape[1]):
+        col = raw_matrix[:, i]
+        valid_idx = ~np.isnan(col)
+        if valid_idx.sum() < 2:
+            denoised[:, i] = np.nan_to_num(col)
+            continue
+        interp = np.interp(timestamps, timestamps[valid_idx], col[valid_idx])
+        coeffs = pywt.wavedec(interp, wavelet, level=level)
+        sigma = np.median(np.abs(coeffs[1])) / 0.6745
+        uthresh = sigma * np.sqrt(2 * np.log(len(interp)))
+        denoised_coeffs = [coeffs[0]] + [pywt.threshold(c, uthresh, mode='soft') for c in coeffs[1:]]
+        denoised[:, i] = pywt.waverec(denoised_coeffs, wavelet)[:len(interp)]
+    return denoised
+
+
+def check(n_rows: int = 100_000, n_cols: int = 128, seed: int = 0):
+    """So preprocess_csi với cách cũ trên dữ liệu tổng hợp (dòng hỏng, timestamp trùng, cột thiếu)."""
+    rng = np.random.default_rng(seed)
+    ts = np.cumsum(rng.choice([0, 9, 10, 11, 40], n_rows)).astype(np.float64)
+    raw = rng.integers(-128, 128, (n_rows, n_cols)).astype(np.float64)
+    raw[rng.random(n_rows) < 0.01] = np.nan   # dòng CSI không parse được
+    raw[rng.random(n_rows) < 0.001, 3] = np.nan   # một cột có mẫu NaN khác
+    raw[1:, 5] = np.nan                           # cột chỉ có 1 giá trị
+
+    t0 = time.perf_counter()
+    old = _preprocess_reference(ts, raw)
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = preprocess_csi(ts, raw)
+    t_new = time.perf_counter() - t0
+    err = float(np.max(np.abs(new - old)))
+    print(f"📊 {n_rows} x {n_cols}: từng cột {t_old:.2f} s, cả ma trận {t_new:.2f} s ({t_old / t_new:.1f} lần)")
+    print(f"{'✅' if err < 1e-9 else '❌'} lệch lớn nhất so với cách cũ: {err:.2e}")
+
+    # Theo khối: tín hiệu trơn + nhiễu, cùng level cố định
+    smooth = 20 * np.sin(np.arange(n_rows)[:, None] / 500 + np.arange(n_cols)) + rng.normal(0, 3, (n_rows, n_cols))
+    full = preprocess_csi(ts, smooth, level=4)
+    blocks = denoise_blocks(ts, smooth, level=4)
+    print(f"   theo khối {BLOCK_ROWS}+{OVERLAP_ROWS} (level=4): lệch trung bình {np.mean(np.abs(blocks - full)):.2e} "
+          f"(biên độ trung bình {np.mean(np.abs(full)):.1f})")
+    return err < 1e-9
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'check':
+        print("Cách dùng: python wavelet_denoise.py check")
+        sys.exit(1)
+    sys.exit(0 if check() else 1)
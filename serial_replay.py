@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Nguồn phát lại UART cho com_readv5.py, chạy không cần ESP32.
+
+Tạo đúng định dạng dây 0xA5 | len (u16 LE) | payload (mac, ts_real_ms, len, CSI) | XOR
+từ file CSV/.bin đã thu hoặc từ bộ sinh tổng hợp, với các chế độ nhịp:
+ - speed=1.0: thời gian thực theo timestamp_real_ms
+ - speed=k: nhanh/chậm k lần
+ - speed=0: nhanh nhất có thể
+Có thể chèn frame hỏng (sai checksum, bị cắt) và dòng log văn bản.
+
+Cách dùng:
+    python serial_replay.py bench [--frames 200000]          # đo frame/s và CPU/frame của FrameReader
+    python serial_replay.py merge [--ports 2]                # trộn nhiều cổng qua reader/writer_loop, kiểm tra thứ tự
+    python serial_replay.py pty csi_data_xxx.csv --speed 1   # phát qua cặp pty, mở cổng in ra bằng com_readv5.py
+"""
+import argparse
+import csv
+import os
+import random
+import queue
+import struct
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from process.csi_record import load_records, mac_from_str
+
+FRAME_START_BYTE = 0xA5
+SYNTHETIC_MACS = [
+    b'\x34\x86\x5D\x39\xA5\x5C',
+    b'\xA0\xA3\xB3\x2F\x49\xC4',
+    b'\x44\x17\x93\x7C\x43\xB0',
+]
+
+
+def encode_frame(mac_bytes: bytes, ts_real_ms: int, csi) -> bytes:
+    csi = np.asarray(csi, dtype=np.int8)
+    payload = struct.pack('<6sQH', mac_bytes, ts_real_ms, len(csi)) + csi.tobytes()
+    crc = int(np.bitwise_xor.reduce(np.frombuffer(payload, dtype=np.uint8)))
+    return struct.pack('<BH', FRAME_START_BYTE, len(payload)) + payload + bytes([crc])
+
+
+# --- Nguồn frame: mỗi nguồn sinh (mac_bytes, ts_real_ms, csi int8) ---
+def frames_from_csv(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            csi = np.array(row['CSI'].strip('[]').split(',')).astype(np.int8)
+            yield mac_from_str(row['mac']), int(row['timestamp_real_ms']), csi
+
+
+def frames_from_records(path):
+    macs, records = load_records(path)
+    for rec in records:
+        yield macs[rec['mac_id']], int(rec['ts_real_ms']), rec['csi'][:rec['csi_len']]
+
+
+def synthetic_frames(n_frames=None, macs=SYNTHETIC_MACS, rate_hz=100.0, n_values=128, seed=0):
+    """Các MAC phát xen kẽ, mỗi MAC rate_hz gói/s; CSI là nhiễu quanh một mẫu cố định."""
+    rng = np.random.default_rng(seed)
+    base = rng.integers(-40, 40, size=(len(macs), n_values))
+    noise = rng.integers(-3, 4, size=(1024, n_values))
+    step_ms = 1000.0 / rate_hz
+    ts0 = 1_000_000
+    i = 0
+    while n_frames is None or i < n_frames:
+        k = i % len(macs)
+        ts = ts0 + int((i // len(macs)) * step_ms)
+        yield macs[k], ts, (base[k] + noise[i % len(noise)]).astype(np.int8)
+        i += 1
+
+
+def open_source(source, n_frames=None):
+    if source == 'synthetic':
+        return synthetic_frames(n_frames)
+    if source.lower().endswith('.csv'):
+        return frames_from_csv(source)
+    return frames_from_records(source)
+
+
+class ReplaySerial:
+    """
+    Giả lập serial.Serial (in_waiting, read, readinto, close) phát lại một nguồn frame.
+    speed=0 sinh dữ liệu ngay khi được đọc; speed>0 có thread phát theo timestamp_real_ms.
+    """
+
+    def __init__(self, frames, speed: float = 0.0, timeout: float = 0.1,
+                 corrupt_rate: float = 0.0, log_rate: float = 0.0, seed: int = 0):
+        self.frames = iter(frames)
+        self.speed = speed
+        self.timeout = timeout
+        self.corrupt_rate = corrupt_rate
+        self.log_rate = log_rate
+        self.rng = random.Random(seed)
+        self.frames_sent = 0      # frame nguyên vẹn đã phát
+        self.frames_corrupted = 0
+        self.logs_sent = 0
+        self.exhausted = False
+        self.is_open = True
+        self._buf = bytearray()
+        self._cond = threading.Condition()
+        self._thread = None
+        if speed > 0:
+            self._thread = threading.Thread(target=self._pace, daemon=True)
+            self._thread.start()
+
+    def _next_chunk(self):
+        """Mã hoá frame kế tiếp (kèm lỗi/log nếu có); trả về (ts_real_ms, bytes) hoặc None."""
+        try:
+            mac_bytes, ts_real_ms, csi = next(self.frames)
+        except StopIteration:
+            return None
+        chunk = b''
+        if self.log_rate and self.rng.random() < self.log_rate:
+            chunk += f"I ({ts_real_ms}) replay: log line {self.logs_sent}\n".encode()
+            self.logs_sent += 1
+        frame = encode_frame(mac_bytes, ts_real_ms, csi)
+        if self.corrupt_rate and self.rng.random() < self.corrupt_rate:
+            self.frames_corrupted += 1
+            if self.rng.random() < 0.5:
+                # Lật một bit trong payload -> sai checksum
+                pos = self.rng.randrange(3, len(frame) - 1)
+                frame = frame[:pos] + bytes([frame[pos] ^ 0x10]) + frame[pos + 1:]
+            else:
+                # Mất đuôi frame -> reader phải đồng bộ lại
+                frame = frame[:self.rng.randrange(1, len(frame) - 1)]
+        else:
+            self.frames_sent += 1
+        return ts_real_ms, chunk + frame
+
+    def _fill(self, want: int):
+        # Chế độ nhanh nhất: sinh đủ byte ngay trong lời gọi đọc
+        while len(self._buf) < want and not self.exhausted:
+            item = self._next_chunk()
+            if item is None:
+                self.exhausted = True
+                break
+            self._buf += item[1]
+
+    def _pace(self):
+        t0 = None
+        ts0 = None
+        while self.is_open:
+            item = self._next_chunk()
+            if item is None:
+                break
+            ts_real_ms, data = item
+            if t0 is None:
+                t0, ts0 = time.perf_counter(), ts_real_ms
+            delay = t0 + (ts_real_ms - ts0) / 1000.0 / self.speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with self._cond:
+                self._buf += data
+                self._cond.notify_all()
+        with self._cond:
+            self.exhausted = True
+            self._cond.notify_all()
+
+    @property
+    def in_waiting(self) -> int:
+        if self._thread is None:
+            self._fill(4096)
+        return len(self._buf)
+
+    def read(self, size: int = 1) -> bytes:
+        if self._thread is None:
+            self._fill(size)
+        else:
+            deadline = time.monotonic() + (self.timeout or 0)
+            with self._cond:
+                while len(self._buf) < size and not self.exhausted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+        with self._cond:
+            data = bytes(self._buf[:size])
+            del self._buf[:size]
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        n = len(data)
+        b[:n] = data
+        return n
+
+    def close(self):
+        self.is_open = False
+
+
+def serve_pty(frames, speed: float = 1.0, **kwargs):
+    """Phát lại qua cặp pseudo-terminal (Linux/macOS); trả về (tên thiết bị slave, thread)."""
+    import tty
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    src = ReplaySerial(frames, speed=speed, **kwargs)
+
+    def pump():
+        while True:
+            data = src.read(4096)
+            if data:
+                os.write(master, data)
+            elif src.exhausted:
+                break
+
+    th = threading.Thread(target=pump, daemon=True)
+    th.start()
+    return os.ttyname(slave), th
+
+
+def benchmark(n_frames: int = 200_000, corrupt_rate: float = 0.01, log_rate: float = 0.01):
+    """Đo FrameReader.poll trên nguồn tổng hợp, nhanh nhất có thể; in frame/s và CPU/frame."""
+    from com_readv5 import FrameReader
+
+    ser = ReplaySerial(synthetic_frames(n_frames), speed=0, corrupt_rate=corrupt_rate, log_rate=log_rate)
+    reader = FrameReader(ser, on_log=lambda text: None)
+    ser._fill(float('inf'))  # mã hoá trước toàn bộ luồng byte, chỉ đo phần tách frame
+    parsed = 0
+    wall0, cpu0 = time.perf_counter(), time.process_time()
+    while not (ser.exhausted and not ser._buf):
+        parsed += len(reader.poll())
+    parsed += len(reader.poll())
+    wall = time.perf_counter() - wall0
+    cpu = time.process_time() - cpu0
+
+    print(f"📊 {n_frames} frame phát ({ser.frames_corrupted} hỏng, {ser.logs_sent} dòng log)")
+    print(f"  Tách được: {parsed} / {ser.frames_sent} frame nguyên vẹn "
+          f"(crc={reader.checksum_errors}, resync={reader.resyncs}, bỏ {reader.bytes_discarded} byte)")
+    print(f"  Tốc độ:    {parsed / wall:,.0f} frame/s")
+    print(f"  CPU:       {cpu / max(parsed, 1) * 1e6:.2f} µs/frame")
+    return parsed / wall, cpu / max(parsed, 1)
+
+
+def check_merge(n_frames: int = 200_000, n_ports: int = 2):
+    """
+    Phát n_ports nguồn tổng hợp nhanh nhất có thể qua reader_loop / writer_loop của com_readv5.py
+    vào một file .bin, rồi kiểm tra timestamp_pc_ms của file không bao giờ đi lùi.
+    """
+    from capture_metrics import CaptureStats
+    from com_readv5 import QUEUE_MAX_BATCHES, WHITELIST_MACS, FrameReader, reader_loop, writer_loop
+    from process.csi_record import RecordWriter
+    from process.ts_dedup import TimestampDeduper
+
+    macs = [m for m in SYNTHETIC_MACS if m in WHITELIST_MACS]
+    path = os.path.join(tempfile.mkdtemp(), 'merge.bin')
+    sink = RecordWriter(path, sorted(WHITELIST_MACS))
+    frame_queue = queue.Queue(maxsize=QUEUE_MAX_BATCHES)
+    stats = CaptureStats(frame_queue)
+    stop = threading.Event()
+    sers = [ReplaySerial(synthetic_frames(n_frames, macs=macs, seed=p), speed=0) for p in range(n_ports)]
+    readers = [threading.Thread(target=reader_loop, args=(FrameReader(ser, on_log=lambda text: None), p,
+                                                          frame_queue, stats, stop))
+               for p, ser in enumerate(sers)]
+    writer = threading.Thread(target=writer_loop, args=(sink, frame_queue, stats),
+                              kwargs={'deduper': TimestampDeduper()})
+    writer.start()
+    for th in readers:
+        th.start()
+    while not all(ser.exhausted and not ser._buf for ser in sers):
+        time.sleep(0.05)
+    time.sleep(0.2)  # lượt poll cuối của các reader
+    stop.set()
+    for th in readers:
+        th.join()
+    frame_queue.put(None)
+    writer.join()
+    sink.close()
+
+    _, records = load_records(path)
+    steps = np.diff(records['ts_pc_ms'].astype(np.int64))
+    backward = int(np.count_nonzero(steps < 0))
+    ok = backward == 0 and len(records) == n_frames * n_ports
+    print(f"📊 {n_ports} cổng x {n_frames} frame -> {len(records)} bản ghi, "
+          f"drop={stats.frames_dropped}, q_max={stats.max_queue_depth}")
+    print(f"{'✅' if ok else '❌'} timestamp_pc_ms lùi {backward} lần"
+          + (f" (tối đa {-int(steps.min())} ms)" if backward else ''))
+    os.remove(path)
+    return ok
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Phát lại / giả lập UART CSI")
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('bench', help='đo thông lượng của FrameReader')
+    b.add_argument('--frames', type=int, default=200_000)
+    b.add_argument('--corrupt', type=float, default=0.01)
+    b.add_argument('--logs', type=float, default=0.01)
+    m = sub.add_parser('merge', help='trộn nhiều cổng qua writer_loop, kiểm tra file ra đúng thứ tự')
+    m.add_argument('--frames', type=int, default=200_000, help='số frame mỗi cổng')
+    m.add_argument('--ports', type=int, default=2)
+    p = sub.add_parser('pty', help='phát qua cặp pty')
+    p.add_argument('source', help="file .csv/.bin hoặc 'synthetic'")
+    p.add_argument('--speed', type=float, default=1.0, help='1 = thời gian thực, 0 = nhanh nhất')
+    p.add_argument('--corrupt', type=float, default=0.0)
+    p.add_argument('--logs', type=float, default=0.0)
+    args = ap.parse_args()
+
+    if args.cmd == 'bench':
+        benchmark(args.frames, args.corrupt, args.logs)
+    elif args.cmd == 'merge':
+        raise SystemExit(0 if check_merge(args.frames, args.ports) else 1)
+    else:
+        name, th = serve_pty(open_source(args.source), speed=args.speed,
+                             corrupt_rate=args.corrupt, log_rate=args.logs)
+        print(f"🔌 Đang phát lại trên {name} — mở cổng này trong com_readv5.py. Ctrl+C để dừng.")
+        try:
+            th.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
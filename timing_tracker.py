@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Theo dõi trực tuyến khoảng cách giữa các gói của từng MAC (theo từng cổng) trong lúc thu.
+
+Mỗi gói cập nhật O(1) cho cả hai đồng hồ:
+ - thiết bị: hiệu timestamp_real_ms liên tiếp (gap ở đây là mất gói / TX ngừng phát)
+ - PC: hiệu timestamp_pc_ms liên tiếp (gap chỉ ở đây là do UART / host đệm trễ)
+Giữ trung bình và jitter dạng EWMA, histogram bucket cố định theo cửa sổ WINDOW_MS để lấy p99,
+và max gap của cửa sổ. Gap/stall được báo ngay qua on_event (com_readv5.py ghi vào gaps_<ts>.csv,
+không in ra console) thay vì chờ tới bước #2/#3 offline.
+"""
+import threading
+
+from capture_metrics import LatencyHistogram
+
+GAP_MS = 50          # hiệu timestamp_real_ms lớn hơn mức này coi là một gap
+STALL_MS = 500       # quá bấy nhiêu ms (giờ PC) không có gói mới thì coi TX đang đứng
+WINDOW_MS = 10_000   # độ dài cửa sổ cho p99 / max
+EWMA_ALPHA = 1 / 16
+INTERVAL_BUCKETS_MS = (1, 2, 5, 8, 10, 12, 15, 20, 30, 50, 100, 200, 500, 1000, 5000)
+
+GAP_CSV_HEADER = ["timestamp_pc_ms", "mac", "port", "event", "device_gap_ms", "host_gap_ms", "timestamp_real_ms"]
+
+
+class ClockStats:
+    """Thống kê khoảng cách giữa các gói trên một đồng hồ."""
+
+    __slots__ = ('mean', 'jitter', 'window_max', 'hist', 'last_max', 'last_hist')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.jitter = 0.0
+        self.window_max = 0
+        self.hist = LatencyHistogram(INTERVAL_BUCKETS_MS)
+        self.last_max = 0        # max của cửa sổ đã kết thúc gần nhất
+        self.last_hist = None
+
+    def update(self, dt):
+        if self.hist.count == 0 and self.last_hist is None:
+            self.mean = float(dt)
+        else:
+            self.mean += EWMA_ALPHA * (dt - self.mean)
+            self.jitter += EWMA_ALPHA * (abs(dt - self.mean) - self.jitter)
+        if dt > self.window_max:
+            self.window_max = dt
+        self.hist.observe(dt)
+
+    def rotate(self):
+        self.last_max, self.last_hist = self.window_max, self.hist
+        self.window_max = 0
+        self.hist = LatencyHistogram(INTERVAL_BUCKETS_MS)
+
+    def p99(self) -> float:
+        hist = self.last_hist if self.last_hist is not None else self.hist
+        return hist.quantile(0.99)
+
+    def max_gap(self):
+        return max(self.last_max, self.window_max)
+
+
+class LinkTiming:
+    """Trạng thái của một cặp (MAC, cổng)."""
+
+    __slots__ = ('last_dev', 'last_host', 'window_start', 'device', 'host', 'packets', 'gaps', 'stalls', 'stalled')
+
+    def __init__(self):
+        self.last_dev = None
+        self.last_host = None
+        self.window_start = None
+        self.device = ClockStats()
+        self.host = ClockStats()
+        self.packets = 0
+        self.gaps = 0
+        self.stalls = 0
+        self.stalled = False
+
+
+class TimingTracker:
+    def __init__(self, on_event=None, gap_ms: int = GAP_MS, stall_ms: int = STALL_MS, window_ms: int = WINDOW_MS):
+        self.on_event = on_event
+        self.gap_ms = gap_ms
+        self.stall_ms = stall_ms
+        self.window_ms = window_ms
+        self.links = {}  # (mac_bytes, port) -> LinkTiming
+        self.lock = threading.Lock()
+
+    def _emit(self, *event):
+        if self.on_event:
+            with self.lock:
+                self.on_event(event)
+
+    def update(self, frames):
+        """frames: list (mac_bytes, ts_real_ms, ts_pc_ms, port, csi), theo thứ tự nhận."""
+        links = self.links
+        for mac_bytes, ts_real_ms, ts_pc_ms, port, _ in frames:
+            key = (mac_bytes, port)
+            link = links.get(key)
+            if link is None:
+                link = links[key] = LinkTiming()
+                link.window_start = ts_pc_ms
+            link.packets += 1
+            if link.stalled:
+                link.stalled = False
+                self._emit(ts_pc_ms, mac_bytes, port, 'resume', '', ts_pc_ms - link.last_host, ts_real_ms)
+            if link.last_dev is not None:
+                dev_dt = ts_real_ms - link.last_dev
+                host_dt = ts_pc_ms - link.last_host
+                if dev_dt >= 0:  # bỏ qua lúc đồng hồ thiết bị bị reset
+                    link.device.update(dev_dt)
+                link.host.update(host_dt)
+                if dev_dt > self.gap_ms:
+                    link.gaps += 1
+                    self._emit(ts_pc_ms, mac_bytes, port, 'gap', dev_dt, host_dt, ts_real_ms)
+            link.last_dev = ts_real_ms
+            link.last_host = ts_pc_ms
+            if ts_pc_ms - link.window_start >= self.window_ms:
+                link.device.rotate()
+                link.host.rotate()
+                link.window_start = ts_pc_ms
+
+    def check_stalls(self, now_ms: int):
+        """Gọi định kỳ: báo 'stall' một lần cho mỗi TX im lặng quá stall_ms."""
+        for (mac_bytes, port), link in list(self.links.items()):
+            last_host = link.last_host
+            if last_host is None:
+                continue  # link vừa được thread ghi thêm vào, chưa xong gói đầu tiên
+            if not link.stalled and now_ms - last_host > self.stall_ms:
+                link.stalled = True
+                link.stalls += 1
+                self._emit(now_ms, mac_bytes, port, 'stall', '', now_ms - last_host, link.last_dev)
+
+    def snapshot(self):
+        """[(mac_bytes, port, LinkTiming)] để báo cáo."""
+        return [(mac, port, link) for (mac, port), link in sorted(self.links.items())]